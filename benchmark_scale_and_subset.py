@@ -0,0 +1,916 @@
+#!/usr/bin/env python3
+# Contact: Josh Port (joshua_port@uri.edu)
+#
+# Benchmarks for the performance-sensitive pieces of scale_and_subset.py
+# Each subcommand times the current implementation against the implementation it replaced and checks that the results agree
+#
+import argparse
+import contextlib
+import datetime
+import io
+import math
+import netCDF4
+import numpy
+import os
+import pandas
+import pyproj
+import scipy.interpolate
+import tempfile
+import time
+import scale_and_subset
+import track
+import water_z0
+
+
+def timed(func, *args, repeat=1):
+    # Return the result of the last call and the best wall-clock time over repeat calls
+    best = math.inf
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - t0)
+    return result, best
+
+
+def quietly(func, *args):
+    # Call func without its INFO progress messages
+    with contextlib.redirect_stdout(io.StringIO()):
+        return func(*args)
+
+
+def synthetic_roughness(n_lat, n_lon, resolution):
+    # Random land roughness with an open-water region, similar to the NLCD RICHAMP grid
+    rng = numpy.random.default_rng(0)
+    lat = 41.0 + resolution * numpy.arange(n_lat)
+    lon = -71.8 + resolution * numpy.arange(n_lon)
+    land_rough = rng.uniform(0.02, 0.9, (n_lat, n_lon))
+    land_rough[:, :n_lon // 3] = 0.001
+    return lon, lat, land_rough
+
+
+def report(name, legacy_time, new_time):
+    print("{:s}: legacy {:.4f} s, current {:.4f} s, speedup {:.1f}x".format(name, legacy_time, new_time, legacy_time / new_time), flush=True)
+
+
+def write_synthetic_owi_ascii(filename, n_lat, n_lon, num_times, step_hours=1):
+    # Write an OWI ASCII file with random winds on a 0.25 degree grid
+    rng = numpy.random.default_rng(0)
+    start_date = datetime.datetime(2022, 9, 15, 0)
+    end_date = start_date + datetime.timedelta(hours=step_hours * (num_times - 1))
+    with open(filename, "w") as f:
+        f.write("Oceanweather WIN/PRE Format                            {:s}     {:s}\n".format(start_date.strftime("%Y%m%d%H"), end_date.strftime("%Y%m%d%H")))
+        for t in range(num_times):
+            date = start_date + datetime.timedelta(hours=step_hours * t)
+            f.write("iLat={:4d}iLong={:4d}DX={:6.4f}DY={:6.4f}SWLat={:8.5f}SWLon={:8.4f}DT={:s}\n".format(
+                n_lat, n_lon, 0.25, 0.25, 10.0, -90.0, date.strftime("%Y%m%d%H%M")))
+            for component in range(2):
+                values = rng.uniform(-40, 40, n_lat * n_lon)
+                for i in range(0, values.size, 8):
+                    f.write("".join("{:10.4f}".format(v) for v in values[i:i + 8]) + "\n")
+
+
+def legacy_owi_ascii_get(lines, idx, num_lats, num_lons):
+    # The per-value parser OwiAsciiWind.get used before the vectorized decoder
+    win_idx_header_row = 1 + 2 * math.ceil((num_lats * num_lons) / 8) * idx + idx
+    uvel = [[None for i in range(num_lons)] for j in range(num_lats)]
+    for i in range(num_lats * num_lons):
+        low_idx = 1 + 10 * (i % 8)
+        high_idx = 10 + 10 * (i % 8)
+        line_idx = win_idx_header_row + 1 + math.floor(i / 8)
+        uvel[math.floor(i / num_lons)][i % num_lons] = float(lines[line_idx][low_idx:high_idx])
+    vvel = [[None for i in range(num_lons)] for j in range(num_lats)]
+    for i in range(num_lats * num_lons):
+        low_idx = 1 + 10 * (i % 8)
+        high_idx = 10 + 10 * (i % 8)
+        line_idx = win_idx_header_row + 1 + math.floor(i / 8) + math.ceil((num_lats * num_lons) / 8)
+        vvel[math.floor(i / num_lons)][i % num_lons] = float(lines[line_idx][low_idx:high_idx])
+    return numpy.array(uvel), numpy.array(vvel)
+
+
+def bench_owi_ascii(args):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        filename = args.w
+        if filename is None:
+            filename = os.path.join(tmp_dir, "synthetic.wnd")
+            print("INFO: Writing a {:d}-day, {:d} x {:d} OWI ASCII file...".format(args.days, args.nlat, args.nlon), flush=True)
+            write_synthetic_owi_ascii(filename, args.nlat, args.nlon, 24 * args.days + 1)
+        with open(filename, "r") as f:
+            lines = f.readlines()
+        owi_ascii = scale_and_subset.OwiAsciiWind(lines)
+        num_times = owi_ascii.num_times()
+        n_lat = owi_ascii.grid().n_latitude()
+        n_lon = owi_ascii.grid().n_longitude()
+
+        def run_legacy():
+            return [legacy_owi_ascii_get(lines, i, n_lat, n_lon) for i in range(num_times)]
+
+        def run_current():
+            return [owi_ascii.get(i) for i in range(num_times)]
+
+        def run_mmap():
+            owi_ascii_mmap = scale_and_subset.OwiAsciiWind(filename=filename)
+            winds = [owi_ascii_mmap.get(i) for i in range(owi_ascii_mmap.num_times())]
+            owi_ascii_mmap.close()
+            return winds
+
+        def run_cropped():
+            # A window a tenth the size of the grid in each direction, as when a wide domain is cropped to the high-res domain
+            owi_ascii_mmap = scale_and_subset.OwiAsciiWind(filename=filename)
+            grid = owi_ascii_mmap.grid()
+            lon_span = grid.lon1d()[-1] - grid.lon1d()[0]
+            lat_span = grid.lat1d()[-1] - grid.lat1d()[0]
+            owi_ascii_mmap.crop(grid.lon1d()[0] + 0.45 * lon_span, grid.lon1d()[0] + 0.55 * lon_span,
+                                grid.lat1d()[0] + 0.45 * lat_span, grid.lat1d()[0] + 0.55 * lat_span)
+            winds = [owi_ascii_mmap.get(i) for i in range(owi_ascii_mmap.num_times())]
+            owi_ascii_mmap.close()
+            return winds
+
+        legacy, legacy_time = timed(run_legacy)
+        current, current_time = timed(run_current)
+        mapped, mapped_time = timed(run_mmap)
+        cropped, cropped_time = timed(run_cropped)
+        for (u_legacy, v_legacy), wind, wind_mapped in zip(legacy, current, mapped):
+            if not (numpy.array_equal(u_legacy, wind.u_velocity()) and numpy.array_equal(v_legacy, wind.v_velocity())):
+                raise RuntimeError("Vectorized OWI ASCII parser does not reproduce the legacy values")
+            if not (numpy.array_equal(u_legacy, wind_mapped.u_velocity()) and numpy.array_equal(v_legacy, wind_mapped.v_velocity())):
+                raise RuntimeError("Memory-mapped OWI ASCII reader does not reproduce the legacy values")
+        print("INFO: {:d} snapshots of {:d} x {:d}; values identical".format(num_times, n_lat, n_lon), flush=True)
+        report("OwiAsciiWind.get", legacy_time, current_time)
+        report("OwiAsciiWind.get (memory-mapped, including indexing)", legacy_time, mapped_time)
+        report("OwiAsciiWind.get (memory-mapped, cropped to {:d} x {:d})".format(*cropped[0].u_velocity().shape), legacy_time, cropped_time)
+
+
+def bench_z0_cube(args):
+    if args.hr is not None:
+        lon, lat, land_rough = scale_and_subset.Roughness.get(args.hr)
+    else:
+        lon, lat, land_rough = synthetic_roughness(args.nlat, args.nlon, args.res)
+    lon_grid, lat_grid = numpy.meshgrid(lon, lat)
+    print("INFO: Building {:d} x {:d} directional z0 cubes (radius {:d} m, sigma {:d} m)...".format(lat.size, lon.size, args.r, args.sigma), flush=True)
+    legacy, legacy_time = timed(quietly, scale_and_subset.generate_directional_z0_interpolant, lon_grid, lat_grid, land_rough, args.sigma, args.r, "loop")
+    current, current_time = timed(quietly, scale_and_subset.generate_directional_z0_interpolant, lon_grid, lat_grid, land_rough, args.sigma, args.r, "fft")
+    difference = numpy.abs(current.z0_directional() - legacy.z0_directional())
+    print("INFO: Max abs difference {:.3e}, max relative difference {:.3e}".format(
+        difference.max(), (difference / numpy.abs(legacy.z0_directional())).max()), flush=True)
+    report("generate_directional_z0_interpolant", legacy_time, current_time)
+
+
+def bench_regrid(args):
+    # Interpolate U and V from a 0.25 degree wind grid onto a fine target grid, as roughness_adjust does every time slice
+    rng = numpy.random.default_rng(0)
+    src_lat = 40.0 + 0.25 * numpy.arange(13)
+    src_lon = -73.0 + 0.25 * numpy.arange(13)
+    tgt_lat = 40.5 + (2.0 / args.nlat) * numpy.arange(args.nlat)
+    tgt_lon = -72.5 + (2.0 / args.nlon) * numpy.arange(args.nlon)
+    winds = [(rng.uniform(-40, 40, (13, 13)), rng.uniform(-40, 40, (13, 13))) for i in range(args.slices)]
+
+    def run_legacy():
+        results = []
+        for u, v in winds:
+            u_interp = scipy.interpolate.RectBivariateSpline(src_lat, src_lon, u, kx=1, ky=1)
+            v_interp = scipy.interpolate.RectBivariateSpline(src_lat, src_lon, v, kx=1, ky=1)
+            results.append(numpy.stack((u_interp(tgt_lat, tgt_lon), v_interp(tgt_lat, tgt_lon))))
+        return results
+
+    def run_current():
+        return [scale_and_subset.Regridder.get(src_lat, src_lon, tgt_lat, tgt_lon).apply(numpy.stack((u, v))) for u, v in winds]
+
+    legacy, legacy_time = timed(run_legacy, repeat=3)
+    current, current_time = timed(run_current, repeat=3)
+    difference = max(numpy.abs(a - b).max() for a, b in zip(legacy, current))
+    print("INFO: {:d} slices onto {:d} x {:d}; max abs difference {:.3e}".format(args.slices, args.nlat, args.nlon, difference), flush=True)
+    report("U/V regridding", legacy_time, current_time)
+
+
+def legacy_spline_regrid(src_lat, src_lon, values, tgt_lat, tgt_lon):
+    # The original regridding: a kx=ky=1 RectBivariateSpline built for every field on every call
+    return scipy.interpolate.RectBivariateSpline(src_lat, src_lon, values, kx=1, ky=1)(tgt_lat, tgt_lon)
+
+
+def legacy_roughness_adjust(input_wind, z0_wr, z0_hr, z0_directional_interpolant, sl):
+    # The original roughness_adjust for owi-ascii or owi-netcdf wind without background wind: every roughness and wind field is
+    # regridded with a new spline each slice, the high-res 2-D axes are rebuilt, and directional z0 comes from a
+    # RegularGridInterpolator over (lat, lon, angle)
+    wind_lat, wind_lon = input_wind.wind_grid().lat1d(), input_wind.wind_grid().lon1d()
+    z0_wr_w_grid = legacy_spline_regrid(z0_wr.lat(), z0_wr.lon(), z0_wr.land_rough(), wind_lat, wind_lon)
+    z_ref = 80
+    if sl == "adcirc":
+        u_w_grid, v_w_grid = input_wind.u_velocity(), input_wind.v_velocity()
+        z0_wr_hr_grid = legacy_spline_regrid(wind_lat, wind_lon, z0_wr_w_grid, z0_hr.lat(), z0_hr.lon())
+    elif sl == "up-down":
+        b = 1 / (numpy.log(10) - numpy.log(z0_wr_w_grid))
+        u_w_grid = input_wind.u_velocity() * (1 + b * numpy.log(z_ref / 10))
+        v_w_grid = input_wind.v_velocity() * (1 + b * numpy.log(z_ref / 10))
+    hr_lon_grid, hr_lat_grid = numpy.meshgrid(z0_hr.lon(), z0_hr.lat())
+    u_hr = legacy_spline_regrid(wind_lat, wind_lon, u_w_grid, z0_hr.lat(), z0_hr.lon())
+    v_hr = legacy_spline_regrid(wind_lat, wind_lon, v_w_grid, z0_hr.lat(), z0_hr.lon())
+    dir_hr_grid = scale_and_subset.direction_from_uv(u_hr, v_hr)
+    z0_hr_directional = z0_directional_interpolant((hr_lat_grid, hr_lon_grid, dir_hr_grid))
+    if sl == "adcirc":
+        u_out = u_hr * (z0_hr_directional / z0_wr_hr_grid)**0.0706 * numpy.log(10 / z0_hr_directional) / numpy.log(10 / z0_wr_hr_grid)
+        v_out = v_hr * (z0_hr_directional / z0_wr_hr_grid)**0.0706 * numpy.log(10 / z0_hr_directional) / numpy.log(10 / z0_wr_hr_grid)
+    elif sl == "up-down":
+        b = 1 / (numpy.log(10) - numpy.log(z0_hr_directional))
+        u_out = u_hr / (1 + b * numpy.log(z_ref / 10))
+        v_out = v_hr / (1 + b * numpy.log(z_ref / 10))
+    return scale_and_subset.WindData(input_wind.date(), None, u_out, v_out)
+
+
+def bench_roughness_adjust(args):
+    # Per-slice roughness_adjust time: the original implementation (see legacy_roughness_adjust) vs the current one with a
+    # ScalingContext built before the time loop and reused; the Regridder cache is cleared first, so the current side pays for
+    # its regridding weights too
+    rng = numpy.random.default_rng(0)
+    hr_lon, hr_lat, hr_land_rough = synthetic_roughness(args.nlat, args.nlon, args.res)
+    z0_hr = scale_and_subset.Roughness(hr_lon, hr_lat, hr_land_rough)
+    wind_grid = scale_and_subset.WindGrid(-72.5 + 0.25 * numpy.arange(13), 40.5 + 0.25 * numpy.arange(13))
+    z0_wr = scale_and_subset.Roughness(wind_grid.lon1d(), wind_grid.lat1d(), rng.uniform(0.001, 0.3, (13, 13)))
+    angle = numpy.arange(0, 361, 30, dtype=numpy.float64)
+    z0_directional = scale_and_subset.DirectionalZ0(hr_lat, hr_lon, angle, numpy.repeat(hr_land_rough[:, :, None], angle.size, axis=2))
+    z0_directional_interpolant = z0_directional.interpolant()
+    winds = [scale_and_subset.WindData(datetime.datetime(2022, 9, 15, i), wind_grid, rng.uniform(-40, 40, (13, 13)), rng.uniform(-40, 40, (13, 13)))
+             for i in range(args.slices)]
+
+    def run_legacy():
+        return [legacy_roughness_adjust(wind, z0_wr, z0_hr, z0_directional_interpolant, args.sl) for wind in winds]
+
+    def run_current():
+        scale_and_subset.Regridder.clear_cache()
+        context = scale_and_subset.ScalingContext(args.sl, wind_grid, z0_wr, z0_hr, z0_directional)
+        return [scale_and_subset.roughness_adjust([context, wind, None]) for wind in winds]
+
+    legacy, legacy_time = timed(run_legacy)
+    current, current_time = timed(run_current)
+    max_diff = max(float(numpy.abs(numpy.stack((a.u_velocity(), a.v_velocity())) - numpy.stack((b.u_velocity(), b.v_velocity()))).max())
+                   for a, b in zip(legacy, current))
+    if max_diff > 1e-6:
+        raise RuntimeError("The current roughness_adjust doesn't match the original (max difference {:.3g} m/s)".format(max_diff))
+    print("INFO: {:d} slices onto {:d} x {:d} with {:s} scaling; max difference {:.2g} m/s".format(args.slices, args.nlat, args.nlon, args.sl, max_diff), flush=True)
+    print("INFO: Per slice: original {:.4f} s, current with a reused context {:.4f} s".format(legacy_time / args.slices, current_time / args.slices), flush=True)
+    report("roughness_adjust", legacy_time, current_time)
+
+
+def legacy_write_netcdf(filename, lon, lat, slices):
+    # The original NetcdfOutput: unlimited time, the netCDF library's default chunking, and time, spd, and dir written one
+    # slice at a time as each slice is appended
+    nc = netCDF4.Dataset(filename + ".nc", "w")
+    main = nc.createGroup("Main")
+    main.createDimension("time", None)
+    main.createDimension("longitude", len(lon))
+    main.createDimension("latitude", len(lat))
+    var_time = main.createVariable("time", "f4", "time", zlib=True, complevel=2, fill_value=netCDF4.default_fillvals["f4"])
+    var_time_unix = main.createVariable("time_unix", "i8", "time", zlib=True, complevel=2, fill_value=netCDF4.default_fillvals["i8"])
+    main.createVariable("lon", "f8", "longitude", zlib=True, complevel=2, fill_value=netCDF4.default_fillvals["f8"])[:] = lon
+    main.createVariable("lat", "f8", "latitude", zlib=True, complevel=2, fill_value=netCDF4.default_fillvals["f8"])[:] = lat
+    var_spd = main.createVariable("spd", "f4", ("time", "latitude", "longitude"), zlib=True, complevel=2, fill_value=netCDF4.default_fillvals["f4"])
+    var_dir = main.createVariable("dir", "f4", ("time", "latitude", "longitude"), zlib=True, complevel=2, fill_value=netCDF4.default_fillvals["f4"])
+    for idx, (date, uvel, vvel) in enumerate(slices):
+        delta = (date - datetime.datetime(1990, 1, 1, 0, 0, 0))
+        var_time[idx] = round((delta.days * 86400 + delta.seconds) / 60)
+        delta_unix = (date - datetime.datetime(1970, 1, 1, 0, 0, 0))
+        var_time_unix[idx] = round(delta_unix.days * 86400 + delta_unix.seconds)
+        var_spd[idx, :, :] = scale_and_subset.magnitude_from_uv(uvel, vvel)
+        var_dir[idx, :, :] = scale_and_subset.dir_met_to_and_from_math(scale_and_subset.direction_from_uv(uvel, vvel))
+    nc.close()
+
+
+def bench_netcdf_output(args):
+    # Write the same slices with the original writer (unlimited time, default chunking, one unbuffered write per slice) and
+    # with NetcdfOutput's buffered, chunked layout; then time the dashboard read patterns: one full map, and one point's full
+    # time series. Writes are timed as the best of -repeat runs, since a single small write is dominated by noise
+    rng = numpy.random.default_rng(0)
+    lon = -71.8 + 0.001 * numpy.arange(args.nlon)
+    lat = 41.0 + 0.001 * numpy.arange(args.nlat)
+    yy, xx = numpy.meshgrid(numpy.linspace(0, 6, args.nlat), numpy.linspace(0, 6, args.nlon), indexing="ij")
+    slices = [(datetime.datetime(2022, 9, 15) + datetime.timedelta(hours=i), 20 * numpy.sin(xx + 0.1 * i) + rng.normal(0, 0.5, xx.shape),
+               20 * numpy.cos(yy - 0.1 * i) + rng.normal(0, 0.5, xx.shape)) for i in range(args.slices)]
+    chunk_shape = scale_and_subset.chunk_shape_from_str(args.ochunk)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        def write(name, options):
+            output = scale_and_subset.NetcdfOutput(os.path.join(tmp_dir, name), lon, lat, **options)
+            for idx, (date, u, v) in enumerate(slices):
+                output.append(idx, date, u, v)
+            output.close()
+
+        def read_map(name):
+            with netCDF4.Dataset(os.path.join(tmp_dir, name + ".nc")) as nc:
+                return nc["Main"]["spd"][args.slices // 2, :, :]
+
+        def read_point(name):
+            with netCDF4.Dataset(os.path.join(tmp_dir, name + ".nc")) as nc:
+                return nc["Main"]["spd"][:, args.nlat // 2, args.nlon // 2]
+
+        _, legacy_time = timed(legacy_write_netcdf, os.path.join(tmp_dir, "legacy"), lon, lat, slices, repeat=args.repeat)
+        _, current_time = timed(write, "current", {"num_times": args.slices, "chunk_shape": chunk_shape, "buffer_slices": args.obuffer,
+                                                   "complevel": args.ocomplevel, "shuffle": not args.onoshuffle, "pack": args.opack},
+                                repeat=args.repeat)
+        for name in ("legacy", "current"):
+            _, map_time = timed(read_map, name, repeat=3)
+            _, point_time = timed(read_point, name, repeat=3)
+            print("INFO: {:s}: {:.1f} MB; read one map {:.4f} s, read one point's time series {:.4f} s".format(
+                name, os.path.getsize(os.path.join(tmp_dir, name + ".nc")) / 1e6, map_time, point_time), flush=True)
+        if args.opack != "none":
+            print("INFO: Max abs spd error from packing: {:.4g} m s-1".format(numpy.abs(read_map("legacy") - read_map("current")).max()), flush=True)
+        elif not (numpy.array_equal(read_map("legacy"), read_map("current")) and numpy.array_equal(read_point("legacy"), read_point("current"))):
+            raise RuntimeError("Buffered output does not match the legacy output")
+    report("NetcdfOutput ({:d} slices of {:d} x {:d})".format(args.slices, args.nlat, args.nlon), legacy_time, current_time)
+
+
+def bench_speed_direction(args):
+    # Output conversion of one slice of u and v to float32 spd and dir, as NetcdfOutput.append does, including calm and u = 0 cells
+    rng = numpy.random.default_rng(0)
+    u = rng.uniform(-40, 40, (args.nlat, args.nlon))
+    v = rng.uniform(-40, 40, (args.nlat, args.nlon))
+    u[::7, ::5] = 0
+    v[::14, ::5] = 0
+    spd = numpy.empty(u.shape, dtype=numpy.float32)
+    direction = numpy.empty(u.shape, dtype=numpy.float32)
+    speed_direction = scale_and_subset.SpeedDirection(u.shape)
+
+    def run_legacy():
+        return (scale_and_subset.magnitude_from_uv(u, v).astype(numpy.float32),
+                scale_and_subset.dir_met_to_and_from_math(scale_and_subset.direction_from_uv(u, v)).astype(numpy.float32))
+
+    def run_current():
+        speed_direction.compute(u, v, spd, direction)
+        return spd, direction
+
+    with numpy.errstate(invalid="ignore"):
+        (legacy_spd, legacy_dir), legacy_time = timed(run_legacy, repeat=args.repeat)
+    (current_spd, current_dir), current_time = timed(run_current, repeat=args.repeat)
+    if not numpy.array_equal(numpy.isnan(legacy_dir), numpy.isnan(current_dir)):
+        raise RuntimeError("Calm cells differ between the legacy and fused speed/direction")
+    dir_difference = numpy.abs(numpy.nan_to_num(legacy_dir) - numpy.nan_to_num(current_dir))
+    print("INFO: {:d} x {:d}; max abs difference spd {:.3e} m s-1, dir {:.3e} degrees".format(
+        args.nlat, args.nlon, numpy.abs(legacy_spd - current_spd).max(), numpy.minimum(dir_difference, 360 - dir_difference).max()), flush=True)
+    report("spd/dir from u/v", legacy_time, current_time)
+
+
+def legacy_retrieve_ust_U10(u_obs, z_obs):
+    # The per-cell search water_z0.retrieve_ust_U10 used before the cached lookup table (with the per-value cal_z0_from_ustar)
+    res = 0.001
+    ust = numpy.arange(0, 5, res)
+    z0 = numpy.array([legacy_cal_z0_from_ustar(u) for u in ust])
+    Y = numpy.empty(len(ust))
+    for i in range(len(ust)):
+        if z0[i] == 0 and ust[i] == 0:
+            Y[0] = 1
+        else:
+            Y[i] = (z_obs / z0[i])**ust[i]
+    y = numpy.exp(0.40 * u_obs)
+    ust_est = numpy.empty(u_obs.shape)
+    for i in range(u_obs.shape[0]):
+        for j in range(u_obs.shape[1]):
+            loc = numpy.argmin(abs(y[i, j] - Y))
+            if Y[loc] - y[i, j] > 0:
+                ust_est[i, j] = ust[loc - 1] + (y[i, j] - Y[loc - 1]) / ((Y[loc] - Y[loc - 1]) / res)
+            else:
+                ust_est[i, j] = ust[loc] + (y[i, j] - Y[loc]) / ((Y[loc + 1] - Y[loc]) / res)
+    return ust_est
+
+
+def legacy_cal_z0_from_ustar(ustar):
+    p_b1 = numpy.array([-0.000098701949811, 0.001486209983407, -0.007584567778927, 0.019487056157620, -0.029314498154105,
+                        0.024309735869547, -0.006997554677642, 0.001258400989803, -0.000043976208055])
+    p_b2 = numpy.array([-0.002182648458354, 0.046387047659009, -0.428830523588356, 2.251251262348664, -7.334368361013868,
+                        15.163848944684784, -19.388290305787166, 13.970227275905133, -4.319572176336596])
+    powers = numpy.array([ustar**n for n in range(8, -1, -1)])
+    if ustar < 0.3:
+        return 0.0185 / 9.806650 * ustar**2
+    elif ustar < 2.35:
+        return float(numpy.matmul(p_b1, powers))
+    elif ustar < 3:
+        return float(numpy.matmul(p_b2, powers))
+    return 0.001305
+
+
+def bench_water_z0(args):
+    # Retrieve ustar from 10 m wind speed over a field of water cells
+    rng = numpy.random.default_rng(0)
+    u_obs = rng.uniform(0, 70, (args.nlat, args.nlon))
+    legacy, legacy_time = timed(legacy_retrieve_ust_U10, u_obs, args.zobs)
+    water_z0.ust_lookup_table.cache_clear()
+    current, first_time = timed(water_z0.retrieve_ust_U10, u_obs, args.zobs)
+    current, current_time = timed(water_z0.retrieve_ust_U10, u_obs, args.zobs, repeat=3)
+    print("INFO: {:d} x {:d} cells; max abs ustar difference {:.3e} m s-1; first call (building the table) {:.4f} s".format(
+        args.nlat, args.nlon, numpy.abs(legacy - current).max(), first_time), flush=True)
+    report("retrieve_ust_U10", legacy_time, current_time)
+
+
+def bench_dynamic_water_z0(args):
+    # Per-slice roughness_adjust time with constant water z0 vs dynamic water z0 (z0 derived from the wind over cells whose cones
+    # reach water); the cube and water fraction are generated from the same synthetic roughness with the fft engine
+    rng = numpy.random.default_rng(0)
+    hr_lon, hr_lat, hr_land_rough = synthetic_roughness(args.nlat, args.nlon, args.res)
+    lon_grid, lat_grid = numpy.meshgrid(hr_lon, hr_lat)
+    z0_hr = scale_and_subset.Roughness(hr_lon, hr_lat, hr_land_rough)
+    wind_grid = scale_and_subset.WindGrid(-72.5 + 0.25 * numpy.arange(13), 40.5 + 0.25 * numpy.arange(13))
+    z0_wr = scale_and_subset.Roughness(wind_grid.lon1d(), wind_grid.lat1d(), rng.uniform(0.001, 0.3, (13, 13)))
+    (z0_directional, (water_fraction, water_z0_constant)), setup_time = timed(quietly, lambda: (
+        scale_and_subset.generate_directional_z0_interpolant(lon_grid, lat_grid, hr_land_rough, args.sigma, args.r),
+        scale_and_subset.generate_water_fraction(lon_grid, lat_grid, hr_land_rough, 0.005, args.sigma, args.r)))
+    winds = [scale_and_subset.WindData(datetime.datetime(2022, 9, 15, i), wind_grid, rng.uniform(-40, 40, (13, 13)), rng.uniform(-40, 40, (13, 13)))
+             for i in range(args.slices)]
+    affected = numpy.count_nonzero(water_fraction.max(axis=2) > 0) / water_fraction[:, :, 0].size
+    print("INFO: {:d} slices onto {:d} x {:d}; {:.0%} of cells have water in some cone; cube and water fraction generated in {:.2f} s".format(
+        args.slices, args.nlat, args.nlon, affected, setup_time), flush=True)
+    for scale_logic in args.sl:
+        constant = scale_and_subset.ScalingContext(scale_logic, wind_grid, z0_wr, z0_hr, z0_directional)
+        dynamic = scale_and_subset.ScalingContext(scale_logic, wind_grid, z0_wr, z0_hr, z0_directional, water_fraction=water_fraction,
+                                                  water_z0_constant=water_z0_constant)
+
+        def run(context):
+            return [scale_and_subset.roughness_adjust([context, wind, None]) for wind in winds]
+
+        constant_result, constant_time = timed(run, constant, repeat=args.repeat)
+        dynamic_result, dynamic_time = timed(run, dynamic, repeat=args.repeat)
+        max_diff = max(float(numpy.nanmax(numpy.abs(numpy.hypot(a.u_velocity(), a.v_velocity()) - numpy.hypot(b.u_velocity(), b.v_velocity()))))
+                       for a, b in zip(constant_result, dynamic_result))
+        print("INFO: {:s}: per slice, constant water z0 {:.4f} s, dynamic water z0 {:.4f} s, added cost {:.1%}; largest speed change {:.2f} m/s".format(
+            scale_logic, constant_time / args.slices, dynamic_time / args.slices, dynamic_time / constant_time - 1, max_diff), flush=True)
+
+
+def bench_directional_z0(args):
+    # Directional z0 for one direction per cell: RegularGridInterpolator over (lat, lon, angle) vs DirectionalZ0.lookup, which
+    # indexes the cell directly and only interpolates between direction bins; both in memory and memory-mapped from a saved cube
+    rng = numpy.random.default_rng(0)
+    lat = 41.0 + 0.001 * numpy.arange(args.nlat)
+    lon = -71.8 + 0.001 * numpy.arange(args.nlon)
+    angle = numpy.linspace(0, 360, 13)
+    z0_directional = scale_and_subset.DirectionalZ0(lat, lon, angle, rng.uniform(0.001, 1, (args.nlat, args.nlon, angle.size)))
+    direction = rng.uniform(0, 360, (args.nlat, args.nlon))
+    hr_grid = scale_and_subset.WindGrid(lon, lat)
+    interpolant = z0_directional.interpolant()
+
+    legacy, legacy_time = timed(interpolant, (hr_grid.lat(), hr_grid.lon(), direction), repeat=args.repeat)
+    current, current_time = timed(z0_directional.lookup, direction, repeat=args.repeat)
+    with tempfile.TemporaryDirectory() as tmp:
+        z0_directional.save(os.path.join(tmp, "z0_interp"))
+        mapped = scale_and_subset.DirectionalZ0.load(os.path.join(tmp, "z0_interp"))
+        mapped_result, mapped_time = timed(mapped.lookup, direction, repeat=args.repeat)
+    max_diff = numpy.max(numpy.abs(current - legacy))
+    if max_diff > 1e-12 or not numpy.array_equal(current, mapped_result):
+        raise RuntimeError("Direct directional z0 lookup does not match RegularGridInterpolator")
+    print("INFO: {:d} x {:d} cells; largest difference {:.1e}; memory-mapped lookup {:.4f} s".format(args.nlat, args.nlon, max_diff, mapped_time), flush=True)
+    report("directional z0 lookup", legacy_time, current_time)
+
+
+def synthetic_storm(wind_grid, num_times):
+    # Rankine-like vortex with a 30 km radius of maximum wind moving north-east across the grid, sampled hourly
+    lon, lat = numpy.meshgrid(wind_grid.lon1d(), wind_grid.lat1d())
+    winds = []
+    for i in range(num_times):
+        lon_ctr = wind_grid.lon1d()[0] + (0.3 + 0.4 * i / max(1, num_times - 1)) * (wind_grid.lon1d()[-1] - wind_grid.lon1d()[0])
+        lat_ctr = wind_grid.lat1d()[0] + (0.3 + 0.4 * i / max(1, num_times - 1)) * (wind_grid.lat1d()[-1] - wind_grid.lat1d()[0])
+        dx = (lon - lon_ctr) * 111000 * math.cos(math.radians(lat_ctr))
+        dy = (lat - lat_ctr) * 111000
+        r = numpy.hypot(dx, dy) + 1
+        spd = 50 * numpy.minimum(r / 30000, (30000 / r)**0.6)
+        winds.append(scale_and_subset.WindData(datetime.datetime(2022, 9, 15, i), wind_grid, -spd * dy / r, spd * dx / r))
+    return winds
+
+
+def bench_precision(args):
+    # Per-slice roughness_adjust plus spd/dir conversion in float64 vs float32, and the largest spd/dir differences between them
+    # (the validation for -precision float32); the storm is synthetic, the roughness and cube are generated as in z0sv. This does
+    # not cover a reference storm: for that, run both precisions and compare the outputs with compare_wind_output.py
+    rng = numpy.random.default_rng(0)
+    hr_lon, hr_lat, hr_land_rough = synthetic_roughness(args.nlat, args.nlon, args.res)
+    lon_grid, lat_grid = numpy.meshgrid(hr_lon, hr_lat)
+    z0_hr = scale_and_subset.Roughness(hr_lon, hr_lat, hr_land_rough)
+    z0_directional = quietly(scale_and_subset.generate_directional_z0_interpolant, lon_grid, lat_grid, hr_land_rough, args.sigma, args.r)
+    wind_grid = scale_and_subset.WindGrid(hr_lon[0] - 0.5 + 0.1 * numpy.arange(int((hr_lon[-1] - hr_lon[0]) / 0.1) + 11),
+                                          hr_lat[0] - 0.5 + 0.1 * numpy.arange(int((hr_lat[-1] - hr_lat[0]) / 0.1) + 11))
+    z0_wr = scale_and_subset.Roughness(wind_grid.lon1d(), wind_grid.lat1d(), rng.uniform(0.001, 0.3, (wind_grid.lat1d().size, wind_grid.lon1d().size)))
+    winds = synthetic_storm(wind_grid, args.slices)
+
+    def run(dtype):
+        context = scale_and_subset.ScalingContext(args.sl, wind_grid, z0_wr, z0_hr, z0_directional.astype(dtype), dtype=dtype)
+        speed_direction = scale_and_subset.SpeedDirection((args.nlat, args.nlon), dtype)
+        spd = numpy.empty((args.slices, args.nlat, args.nlon), dtype=numpy.float32)
+        direction = numpy.empty((args.slices, args.nlat, args.nlon), dtype=numpy.float32)
+        for i, wind in enumerate(winds):
+            wind_hr = scale_and_subset.roughness_adjust([context, wind, None])
+            speed_direction.compute(wind_hr.u_velocity(), wind_hr.v_velocity(), spd[i], direction[i])
+        return spd, direction
+
+    (spd64, dir64), time64 = timed(run, numpy.float64, repeat=args.repeat)
+    (spd32, dir32), time32 = timed(run, numpy.float32, repeat=args.repeat)
+    spd_diff = numpy.abs(spd32 - spd64)
+    moving = spd64 >= 0.1  # Direction is meaningless for near-calm wind, e.g. at the storm center
+    dir_diff = numpy.abs((dir32 - dir64 + 180) % 360 - 180)[moving]  # The short way around
+    print("INFO: {:d} slices of a synthetic storm onto {:d} x {:d} with {:s} scaling; directional z0 cube {:.0f} MB as float64, {:.0f} MB as float32".format(
+        args.slices, args.nlat, args.nlon, args.sl, z0_directional.z0_directional().nbytes / 1e6, z0_directional.z0_directional().nbytes / 2e6), flush=True)
+    print("INFO: spd: max difference {:.2e} m/s, RMS {:.2e} m/s; dir where spd >= 0.1 m/s: max difference {:.2e} degrees, RMS {:.2e} degrees".format(
+        numpy.nanmax(spd_diff), math.sqrt(numpy.nanmean(spd_diff**2)), numpy.nanmax(dir_diff), math.sqrt(numpy.nanmean(dir_diff**2))), flush=True)
+    print("INFO: {:d} cells below 0.1 m/s; {:d} calm (NaN dir) mismatches".format(
+        int(numpy.count_nonzero(~moving)), int(numpy.count_nonzero(numpy.isnan(dir32) != numpy.isnan(dir64)))), flush=True)
+    print("INFO: Per slice: float64 {:.4f} s, float32 {:.4f} s".format(time64 / args.slices, time32 / args.slices), flush=True)
+    report("float64 vs float32 scaling", time64, time32)
+
+
+def bench_wind_source(args):
+    # Stream an OWI ASCII file through WindSource.iter_slices with and without read-ahead while each slice is regridded to a
+    # high-res grid and converted to spd/dir, standing in for the scaling work that reading overlaps with. Reading can only overlap
+    # with that work on a spare core, so the comparison means nothing with a single core available
+    num_cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+    if num_cores < 2:
+        print("WARNING: Only 1 core is available, so read-ahead can't overlap with processing; run on a multi-core node to measure it", flush=True)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        filename = os.path.join(tmp_dir, "synthetic.wnd")
+        write_synthetic_owi_ascii(filename, args.nlat, args.nlon, args.slices)
+        source = scale_and_subset.WindSource.open("owi-ascii", filename)
+        grid = source.grid()
+        hr_lat = numpy.linspace(grid.lat1d()[0], grid.lat1d()[-1], args.hrnlat)
+        hr_lon = numpy.linspace(grid.lon1d()[0], grid.lon1d()[-1], args.hrnlon)
+        regridder = scale_and_subset.Regridder.get(grid.lat1d(), grid.lon1d(), hr_lat, hr_lon)
+        speed_direction = scale_and_subset.SpeedDirection((args.hrnlat, args.hrnlon))
+        spd = numpy.empty((args.hrnlat, args.hrnlon), dtype=numpy.float32)
+        direction = numpy.empty((args.hrnlat, args.hrnlon), dtype=numpy.float32)
+
+        def run(prefetch):
+            checksum = 0.0
+            for wind in source.iter_slices(prefetch=prefetch):
+                uv_hr = regridder.apply(numpy.stack((wind.u_velocity(), wind.v_velocity())))
+                speed_direction.compute(uv_hr[0], uv_hr[1], spd, direction)
+                checksum += float(spd.sum(dtype=numpy.float64))
+            return checksum
+
+        read_only, read_time = timed(lambda: [source.get(i) for i in range(args.slices)])
+        sequential, sequential_time = timed(run, 0)
+        prefetched, prefetched_time = timed(run, args.prefetch)
+        source.close()
+    if sequential != prefetched:
+        raise RuntimeError("Prefetching changes the streamed slices")
+    print("INFO: {:d} slices of {:d} x {:d} onto {:d} x {:d}; cores available: {:d}; reading alone takes {:.2f} s, so read-ahead can save "
+          "at most that; results identical".format(args.slices, args.nlat, args.nlon, args.hrnlat, args.hrnlon, num_cores, read_time), flush=True)
+    report("read and process (prefetch {:d} vs none)".format(args.prefetch), sequential_time, prefetched_time)
+
+
+def write_synthetic_owi_netcdf(filename, n_lat, n_lon, num_times):
+    # Write an OWI NetCDF file with random winds on a 0.25 degree grid, laid out as OwiNetcdf expects
+    rng = numpy.random.default_rng(0)
+    lat = 40.0 + 0.25 * numpy.arange(n_lat)
+    lon = -80.0 + 0.25 * numpy.arange(n_lon)
+    nc = netCDF4.Dataset(filename, "w")
+    main = nc.createGroup("Main")
+    main.createDimension("time", None)
+    main.createDimension("yi", n_lat)
+    main.createDimension("xi", n_lon)
+    lon_grid, lat_grid = numpy.meshgrid(lon, lat)
+    main.createVariable("lon", "f8", ("yi", "xi"))[:] = lon_grid
+    main.createVariable("lat", "f8", ("yi", "xi"))[:] = lat_grid
+    main.createVariable("time", "i8", "time")[:] = 60 * numpy.arange(num_times) + 16830720  # Hourly from 2022-01-01
+    for name in ("U10", "V10"):
+        variable = main.createVariable(name, "f4", ("time", "yi", "xi"))
+        for t in range(num_times):
+            variable[t, :, :] = rng.uniform(-40, 40, (n_lat, n_lon))
+    nc.close()
+
+
+def legacy_owi_netcdf_get(nc, idx):
+    # The original OwiNetcdf.get reads: the first [:] loads the whole (time, lat, lon) variable
+    return nc["Main"].variables["U10"][:][:][idx], nc["Main"].variables["V10"][:][:][idx]
+
+
+def bench_owi_netcdf(args):
+    # Reading every slice of OWI NetCDF files of increasing length: per-slice time should stay flat with hyperslab reads and grow
+    # with the number of time steps with the legacy whole-variable reads; also reads a window a tenth the size in each direction
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for num_times in args.times:
+            filename = os.path.join(tmp_dir, "synthetic_{:d}.nc".format(num_times))
+            write_synthetic_owi_netcdf(filename, args.nlat, args.nlon, num_times)
+            source = scale_and_subset.OwiNetcdf(filename)
+            grid = source.grid()
+            legacy_nc = netCDF4.Dataset(filename, "r")
+            legacy, legacy_time = timed(lambda: [legacy_owi_netcdf_get(legacy_nc, i) for i in range(num_times)])
+            current, current_time = timed(lambda: [source.get(i) for i in range(num_times)])
+            legacy_nc.close()
+            for (u_legacy, v_legacy), wind in zip(legacy, current):
+                if not (numpy.array_equal(u_legacy, wind.u_velocity()) and numpy.array_equal(v_legacy, wind.v_velocity())):
+                    raise RuntimeError("Hyperslab reads don't reproduce the legacy values")
+            lon_span = grid.lon1d()[-1] - grid.lon1d()[0]
+            lat_span = grid.lat1d()[-1] - grid.lat1d()[0]
+            source.crop(grid.lon1d()[0] + 0.45 * lon_span, grid.lon1d()[0] + 0.55 * lon_span, grid.lat1d()[0] + 0.45 * lat_span, grid.lat1d()[0] + 0.55 * lat_span)
+            windowed, windowed_time = timed(lambda: [source.get(i) for i in range(num_times)])
+            source.close()
+            print("INFO: {:d} slices of {:d} x {:d}: per slice legacy {:.2f} ms, current {:.2f} ms, {:d} x {:d} window {:.2f} ms".format(
+                num_times, args.nlat, args.nlon, 1000 * legacy_time / num_times, 1000 * current_time / num_times,
+                windowed[0].u_velocity().shape[0], windowed[0].u_velocity().shape[1], 1000 * windowed_time / num_times), flush=True)
+            report("OwiNetcdf.get, {:d} slices".format(num_times), legacy_time, current_time)
+
+
+def legacy_blend(param_wind, back_wind, lon_ctr_interpolant, lat_ctr_interpolant, rmw_interpolant, time_ctr_date_0, time_rmw_date_0):
+    # The original blend(): a WGS84 geodesic to every cell of the grid each slice; it modifies param_wind in place
+    int_param_wind_date = (param_wind.date() - time_ctr_date_0).total_seconds()
+    lon_ctr_interp = lon_ctr_interpolant(int_param_wind_date)
+    lat_ctr_interp = lat_ctr_interpolant(int_param_wind_date)
+    int_param_wind_date = (param_wind.date() - time_rmw_date_0).total_seconds()
+    rmw_interp = rmw_interpolant(int_param_wind_date)
+    mag_param = scale_and_subset.magnitude_from_uv(param_wind.u_velocity(), param_wind.v_velocity())
+    max_wind = mag_param.max()
+    low_lim = min(.667 * max_wind, 15.5)
+    high_lim = min(.733 * max_wind, 20.5)
+    lon_ctr_interp_grid = numpy.zeros((param_wind.wind_grid().lon1d().size, param_wind.wind_grid().lat1d().size)) + lon_ctr_interp
+    lat_ctr_interp_grid = numpy.zeros((param_wind.wind_grid().lon1d().size, param_wind.wind_grid().lat1d().size)) + lat_ctr_interp
+    wgs84_geod = pyproj.Geod(ellps='WGS84')
+    _, _, dist_from_ctr = wgs84_geod.inv(lon_ctr_interp_grid, lat_ctr_interp_grid, param_wind.wind_grid().lon(), param_wind.wind_grid().lat())
+    rmw_mask = dist_from_ctr <= rmw_interp
+    blend_mask = (low_lim < mag_param) & (mag_param < high_lim) & ~rmw_mask
+    back_mask = (mag_param <= low_lim) & ~rmw_mask
+    u_blend = param_wind.u_velocity()
+    v_blend = param_wind.v_velocity()
+    alpha = (mag_param - low_lim) / (high_lim - low_lim)
+    u_blend[blend_mask] = (alpha[blend_mask] * param_wind.u_velocity()[blend_mask]) + ((1 - alpha[blend_mask]) * back_wind.u_velocity()[blend_mask])
+    v_blend[blend_mask] = (alpha[blend_mask] * param_wind.v_velocity()[blend_mask]) + ((1 - alpha[blend_mask]) * back_wind.v_velocity()[blend_mask])
+    u_blend[back_mask] = back_wind.u_velocity()[back_mask]
+    v_blend[back_mask] = back_wind.v_velocity()[back_mask]
+    return scale_and_subset.WindData(param_wind.date(), param_wind.wind_grid(), u_blend, v_blend)
+
+
+def bench_blend(args):
+    # Blending every slice of a synthetic storm on a parametric grid with a random background: the legacy blend() vs Blender, which
+    # only computes geodesics in a ring around the RMW; the masks and blended wind must be identical
+    rng = numpy.random.default_rng(0)
+    wind_grid = scale_and_subset.WindGrid(-73.0 + args.res * numpy.arange(args.nlon), 40.0 + args.res * numpy.arange(args.nlat))
+    params = synthetic_storm(wind_grid, args.slices)
+    backs = [scale_and_subset.WindData(param.date(), wind_grid, rng.uniform(-15, 15, (args.nlat, args.nlon)), rng.uniform(-15, 15, (args.nlat, args.nlon)))
+             for param in params]
+    # The storm center as placed by synthetic_storm, and an RMW growing from 30 km
+    seconds = numpy.array([(param.date() - params[0].date()).total_seconds() for param in params])
+    fraction = 0.3 + 0.4 * numpy.arange(args.slices) / max(1, args.slices - 1)
+    lon_ctr = wind_grid.lon1d()[0] + fraction * (wind_grid.lon1d()[-1] - wind_grid.lon1d()[0])
+    lat_ctr = wind_grid.lat1d()[0] + fraction * (wind_grid.lat1d()[-1] - wind_grid.lat1d()[0])
+    blend_track = (scipy.interpolate.interp1d(seconds, lon_ctr, kind='linear'), scipy.interpolate.interp1d(seconds, lat_ctr, kind='linear'),
+                   scipy.interpolate.interp1d(seconds, 30000 + 1000 * numpy.arange(args.slices), kind='linear'), params[0].date(), params[0].date())
+    storm_track = track.StormTrack([param.date() for param in params], [params[0].date() + datetime.timedelta(seconds=t) for t in seconds],
+                                   lon_ctr, lat_ctr, [params[0].date() + datetime.timedelta(seconds=t) for t in seconds], 30000 + 1000 * numpy.arange(args.slices))
+    blender = scale_and_subset.Blender(wind_grid, storm_track)
+
+    def run_legacy():
+        return [legacy_blend(scale_and_subset.WindData(param.date(), wind_grid, param.u_velocity(), param.v_velocity()), back, *blend_track)
+                for param, back in zip(params, backs)]
+
+    def run_current():
+        return [blender.blend(param, back) for param, back in zip(params, backs)]
+
+    legacy, legacy_time = timed(run_legacy, repeat=args.repeat)
+    current, current_time = timed(run_current, repeat=args.repeat)
+    for legacy_wind, wind in zip(legacy, current):
+        if not (numpy.array_equal(legacy_wind.u_velocity(), wind.u_velocity()) and numpy.array_equal(legacy_wind.v_velocity(), wind.v_velocity())):
+            raise RuntimeError("Blender doesn't reproduce the legacy blend")
+    print("INFO: {:d} slices of {:d} x {:d}; per slice legacy {:.2f} ms, current {:.2f} ms".format(
+        args.slices, args.nlat, args.nlon, 1000 * legacy_time / args.slices, 1000 * current_time / args.slices), flush=True)
+    report("parametric/background blend", legacy_time, current_time)
+
+
+def legacy_generate_rmw_interpolant(filename):
+    # The original generate_rmw_interpolant, reading filename instead of TrackRMW.txt
+    TrackRMW = pandas.read_csv(filename, header=0, sep=r"\s+")
+    TrackRMW_rows = len(TrackRMW)
+    rmw = numpy.zeros((TrackRMW_rows, 1))
+    time_rmw = numpy.zeros((TrackRMW_rows, 1))
+    for i in range(0, TrackRMW_rows):
+        rmw[i] = float(TrackRMW.iloc[i, 8]) * 1000
+        time_rmw_date = datetime.datetime(TrackRMW.iloc[i, 0], TrackRMW.iloc[i, 1], TrackRMW.iloc[i, 2],
+                                          TrackRMW.iloc[i, 3], TrackRMW.iloc[i, 4], TrackRMW.iloc[i, 5])
+        if i == 0:
+            time_rmw_date_0 = time_rmw_date
+        time_rmw[i] = (time_rmw_date - time_rmw_date_0).total_seconds()
+    rmw_interpolant = scipy.interpolate.interp1d(time_rmw.flatten(), rmw.flatten(), kind='linear')
+    return rmw_interpolant, time_rmw_date_0
+
+
+def legacy_generate_ctr_interpolant(filename):
+    # The original generate_ctr_interpolant, reading filename instead of fort.22
+    fort22 = pandas.read_csv(filename, header=None)
+    fort22_rows = len(fort22)
+    lat_ctr = numpy.zeros((fort22_rows, 1))
+    lon_ctr = numpy.zeros((fort22_rows, 1))
+    time_ctr = numpy.zeros((fort22_rows, 1))
+    for i in range(0, fort22_rows):
+        lat_ctr[i] = float(fort22.iloc[i, 6].replace('N', ''))/10
+        lon_ctr[i] = -float(fort22.iloc[i, 7].replace('W', ''))/10
+        time_ctr_date = datetime.datetime.strptime(str(fort22.iloc[i, 2]), '%Y%m%d%H')
+        if i == 0:
+            time_ctr_date_0 = time_ctr_date
+        time_ctr[i] = (time_ctr_date - time_ctr_date_0).total_seconds()
+    lon_ctr_interpolant = scipy.interpolate.interp1d(time_ctr.flatten(), lon_ctr.flatten(), kind='linear')
+    lat_ctr_interpolant = scipy.interpolate.interp1d(time_ctr.flatten(), lat_ctr.flatten(), kind='linear')
+    return lon_ctr_interpolant, lat_ctr_interpolant, time_ctr_date_0
+
+
+def bench_track(args):
+    # Reading a long fort.22 and TrackRMW.txt and evaluating the track at every wind time slice: the legacy row-by-row parsing with
+    # interp1d evaluated per slice vs track.StormTrack, which parses by column and interpolates to all slices at once
+    t0 = datetime.datetime(2022, 9, 1, 0)
+    dates = [t0 + datetime.timedelta(minutes=15 * i) for i in range(args.slices)]
+    num_fixes = args.slices // 24 + 2  # One fix every 6 hours, covering every slice
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        fort22_filename = os.path.join(tmp_dir, "fort.22")
+        track_rmw_filename = os.path.join(tmp_dir, "TrackRMW.txt")
+        with open(fort22_filename, "w") as fort22, open(track_rmw_filename, "w") as track_rmw:
+            track_rmw.write("yr mo da hr mi se lon lat rmw\n")
+            for i in range(num_fixes):
+                fix_date = t0 + datetime.timedelta(hours=6 * i)
+                lat_ctr, lon_ctr = 250 + 2 * i, 800 - 3 * i
+                fort22.write("AL, 09, {:s},   , BEST,   0, {:4d}N, {:5d}W,  90,  960, HU\n".format(fix_date.strftime("%Y%m%d%H"), lat_ctr, lon_ctr))
+                track_rmw.write("{:d} {:d} {:d} {:d} 0 0 {:.1f} {:.1f} {:.1f}\n".format(fix_date.year, fix_date.month, fix_date.day, fix_date.hour,
+                                                                                    -lon_ctr / 10, lat_ctr / 10, 30 + (i % 7)))
+
+        def run_legacy():
+            lon_ctr_interpolant, lat_ctr_interpolant, time_ctr_date_0 = legacy_generate_ctr_interpolant(fort22_filename)
+            rmw_interpolant, time_rmw_date_0 = legacy_generate_rmw_interpolant(track_rmw_filename)
+            return [(float(lon_ctr_interpolant((date - time_ctr_date_0).total_seconds())), float(lat_ctr_interpolant((date - time_ctr_date_0).total_seconds())),
+                     float(rmw_interpolant((date - time_rmw_date_0).total_seconds()))) for date in dates]
+
+        def run_current():
+            storm_track = track.StormTrack.read(dates, fort22_filename, track_rmw_filename)
+            return [storm_track.at(date) for date in dates]
+
+        legacy, legacy_time = timed(run_legacy, repeat=args.repeat)
+        current, current_time = timed(run_current, repeat=args.repeat)
+    if legacy != current:
+        raise RuntimeError("StormTrack doesn't reproduce the legacy interpolants")
+    print("INFO: {:d} track fixes, {:d} slices".format(num_fixes, args.slices), flush=True)
+    report("storm track ingestion", legacy_time, current_time)
+
+
+def write_synthetic_wnd(wnd_filename, wind_inp_filename, n_lat, n_lon, num_times, res):
+    # A WND file of the synthetic storm ("%9.3f %9.3f" per cell, NW corner first) and its Wind_Inp.txt, at 10-minute steps
+    w_lim, s_lim = -73.0, 40.0
+    wind_grid = scale_and_subset.WindGrid(w_lim + res * numpy.arange(n_lon), s_lim + res * numpy.arange(n_lat))
+    with open(wind_inp_filename, "w") as wind_inp:
+        wind_inp.write("header\nheader\n2022 9 15 0 0 0\n{:.6f}\n{:d}\n".format(1 / 6, num_times))
+        wind_inp.write("{:.2f} {:.2f}\n{:.2f} {:.2f}\n{:d}.\n".format(w_lim, w_lim + res * (n_lon - 1), s_lim, s_lim + res * (n_lat - 1), round(1 / res)))
+    with open(wnd_filename, "w") as wnd:
+        for wind in synthetic_storm(wind_grid, num_times):
+            uv = numpy.stack((wind.u_velocity()[::-1].reshape(-1), wind.v_velocity()[::-1].reshape(-1)), axis=1)
+            wnd.write("".join("{:9.3f} {:9.3f}\n".format(u, v) for u, v in uv))
+
+
+def legacy_wnd_get(lines, wind_inp, idx):
+    # The original WndWind.get: float() on two 9-character fields per line into nested lists, reading the rows NW first
+    num_lats, num_lons = wind_inp.num_lats(), wind_inp.num_lons()
+    uvel = [[None for i in range(num_lons)] for j in range(num_lats)]
+    vvel = [[None for i in range(num_lons)] for j in range(num_lats)]
+    for j in range(num_lats):
+        row_start = num_lats * num_lons * idx + (num_lats - j - 1) * num_lons
+        for i in range(num_lons):
+            line = lines[row_start + i]
+            uvel[j][i] = float(line[0:9])
+            vvel[j][i] = float(line[10:19])
+    return numpy.array(uvel), numpy.array(vvel)
+
+
+def bench_wnd(args):
+    # Reading every slice of a WND file: the legacy readlines() plus a float() per field vs WndWind, which memory-maps the file and
+    # decodes each slice at its byte offset in one pass; also reads the last slice alone, which shouldn't cost more than the first
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        wnd_filename = os.path.join(tmp_dir, "richamp.wnd")
+        wind_inp_filename = os.path.join(tmp_dir, "Wind_Inp.txt")
+        write_synthetic_wnd(wnd_filename, wind_inp_filename, args.nlat, args.nlon, args.slices, args.res)
+        wind_inp = scale_and_subset.WndWindInp(wind_inp_filename)
+
+        def run_legacy():
+            with open(wnd_filename, "r") as wnd_file:
+                lines = wnd_file.readlines()
+            return [legacy_wnd_get(lines, wind_inp, idx) for idx in range(args.slices)]
+
+        def run_current():
+            source = scale_and_subset.WindSource.open("wnd", wnd_filename, wind_inp_filename)
+            winds = [source.get(idx) for idx in range(args.slices)]
+            source.close()
+            return winds
+
+        legacy, legacy_time = timed(run_legacy)
+        current, current_time = timed(run_current, repeat=args.repeat)
+        for (u_legacy, v_legacy), wind in zip(legacy, current):
+            if not (numpy.array_equal(u_legacy, wind.u_velocity()) and numpy.array_equal(v_legacy, wind.v_velocity())):
+                raise RuntimeError("WndWind doesn't reproduce the legacy values")
+        source = scale_and_subset.WindSource.open("wnd", wnd_filename, wind_inp_filename)
+        _, first_time = timed(source.get, 0, repeat=args.repeat)
+        _, last_time = timed(source.get, args.slices - 1, repeat=args.repeat)
+        source.close()
+    print("INFO: {:d} slices of {:d} x {:d}; per slice legacy {:.1f} ms, current {:.2f} ms; first slice {:.2f} ms, last slice {:.2f} ms".format(
+        args.slices, args.nlat, args.nlon, 1000 * legacy_time / args.slices, 1000 * current_time / args.slices, 1000 * first_time, 1000 * last_time), flush=True)
+    report("WND slice reads", legacy_time, current_time)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Benchmark scale_and_subset.py components against the implementations they replaced")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+    owi_ascii = subparsers.add_parser("owi-ascii", help="OWI ASCII snapshot parsing")
+    owi_ascii.add_argument("-w", metavar="wind", type=str, help="OWI ASCII file to parse; a synthetic 0.25 degree file is generated if omitted", required=False)
+    owi_ascii.add_argument("-days", type=int, help="Length of the synthetic file, in days", required=False, default=5)
+    owi_ascii.add_argument("-nlat", type=int, help="Latitudes in the synthetic file", required=False, default=161)
+    owi_ascii.add_argument("-nlon", type=int, help="Longitudes in the synthetic file", required=False, default=201)
+    owi_ascii.set_defaults(func=bench_owi_ascii)
+    z0_cube = subparsers.add_parser("z0-cube", help="Directional z0 cube generation (fft engine vs cell-by-cell loop)")
+    z0_cube.add_argument("-hr", metavar="highres_roughness", type=str, help="High-resolution land roughness file; a synthetic grid is used if omitted", required=False)
+    z0_cube.add_argument("-nlat", type=int, help="Latitudes in the synthetic grid", required=False, default=150)
+    z0_cube.add_argument("-nlon", type=int, help="Longitudes in the synthetic grid", required=False, default=150)
+    z0_cube.add_argument("-res", type=float, help="Resolution of the synthetic grid, in degrees", required=False, default=0.001)
+    z0_cube.add_argument("-r", metavar="radius", type=int, help="Sector radius, in meters", required=False, default=3000)
+    z0_cube.add_argument("-sigma", metavar="sigma", type=int, help="Weighting parameter, in meters", required=False, default=1000)
+    z0_cube.set_defaults(func=bench_z0_cube)
+    regrid = subparsers.add_parser("regrid", help="Bilinear regridding (cached Regridder vs RectBivariateSpline per call)")
+    regrid.add_argument("-nlat", type=int, help="Latitudes in the target grid", required=False, default=1000)
+    regrid.add_argument("-nlon", type=int, help="Longitudes in the target grid", required=False, default=1000)
+    regrid.add_argument("-slices", type=int, help="Number of time slices to regrid", required=False, default=24)
+    regrid.set_defaults(func=bench_regrid)
+    adjust = subparsers.add_parser("roughness-adjust", help="Per-slice roughness_adjust cost (original implementation vs a reused scaling context)")
+    adjust.add_argument("-nlat", type=int, help="Latitudes in the synthetic high-res grid", required=False, default=1000)
+    adjust.add_argument("-nlon", type=int, help="Longitudes in the synthetic high-res grid", required=False, default=1000)
+    adjust.add_argument("-res", type=float, help="Resolution of the synthetic high-res grid, in degrees", required=False, default=0.001)
+    adjust.add_argument("-sl", metavar="scale_logic", type=str, help="Scaling logic: adcirc or up-down", required=False, default="adcirc")
+    adjust.add_argument("-slices", type=int, help="Number of time slices to scale", required=False, default=6)
+    adjust.set_defaults(func=bench_roughness_adjust)
+    output = subparsers.add_parser("netcdf-output", help="Output writing and read patterns (buffered, chunked NetcdfOutput vs the original unbuffered writer)")
+    output.add_argument("-nlat", type=int, help="Latitudes in the output grid", required=False, default=1000)
+    output.add_argument("-nlon", type=int, help="Longitudes in the output grid", required=False, default=1000)
+    output.add_argument("-slices", type=int, help="Number of time slices to write", required=False, default=48)
+    output.add_argument("-ochunk", metavar="output_chunks", type=str, help="Chunk shape as time,lat,lon; scale_and_subset.py's default if omitted", required=False)
+    output.add_argument("-obuffer", metavar="output_buffer", type=int, help="Slices buffered per write; the time size of ochunk if omitted", required=False)
+    output.add_argument("-ocomplevel", metavar="output_complevel", type=int, help="zlib compression level", required=False, default=2)
+    output.add_argument("-onoshuffle", help="Turn off the shuffle filter", action='store_true', required=False, default=False)
+    output.add_argument("-opack", metavar="output_packing", type=str, help="Output packing: none, int16, or lsd", required=False, default="none")
+    output.add_argument("-repeat", type=int, help="Number of timed writes of each file; the best is reported", required=False, default=3)
+    output.set_defaults(func=bench_netcdf_output)
+    speed_direction = subparsers.add_parser("speed-direction", help="Output spd/dir conversion (fused kernel vs magnitude/direction helpers)")
+    speed_direction.add_argument("-nlat", type=int, help="Latitudes in the grid", required=False, default=2000)
+    speed_direction.add_argument("-nlon", type=int, help="Longitudes in the grid", required=False, default=1000)
+    speed_direction.add_argument("-repeat", type=int, help="Number of timed repetitions; the best is reported", required=False, default=5)
+    speed_direction.set_defaults(func=bench_speed_direction)
+    water = subparsers.add_parser("water-z0", help="ustar retrieval over water (cached lookup table vs per-cell search)")
+    water.add_argument("-nlat", type=int, help="Latitudes in the synthetic field", required=False, default=200)
+    water.add_argument("-nlon", type=int, help="Longitudes in the synthetic field", required=False, default=200)
+    water.add_argument("-zobs", type=float, help="Height of the wind speed, in meters", required=False, default=10.0)
+    water.set_defaults(func=bench_water_z0)
+    dynamic = subparsers.add_parser("dynamic-water-z0", help="Per-slice roughness_adjust cost of dynamic water z0 over constant water z0")
+    dynamic.add_argument("-nlat", type=int, help="Latitudes in the synthetic high-res grid", required=False, default=1000)
+    dynamic.add_argument("-nlon", type=int, help="Longitudes in the synthetic high-res grid", required=False, default=1000)
+    dynamic.add_argument("-res", type=float, help="Resolution of the synthetic high-res grid, in degrees", required=False, default=0.001)
+    dynamic.add_argument("-r", metavar="radius", type=float, help="Cone radius, in meters", required=False, default=3000)
+    dynamic.add_argument("-sigma", type=float, help="Gaussian decay sigma, in meters", required=False, default=1000)
+    dynamic.add_argument("-sl", metavar="scale_logic", type=str, nargs="+", help="Scaling logics to time: adcirc, up-down, or both", required=False,
+                         default=["adcirc", "up-down"])
+    dynamic.add_argument("-slices", type=int, help="Number of time slices to scale", required=False, default=6)
+    dynamic.add_argument("-repeat", type=int, help="Number of timed repetitions; the best is reported", required=False, default=3)
+    dynamic.set_defaults(func=bench_dynamic_water_z0)
+    lookup = subparsers.add_parser("directional-z0", help="Directional z0 lookup (direct sector indexing vs RegularGridInterpolator)")
+    lookup.add_argument("-nlat", type=int, help="Latitudes in the cube", required=False, default=1000)
+    lookup.add_argument("-nlon", type=int, help="Longitudes in the cube", required=False, default=1000)
+    lookup.add_argument("-repeat", type=int, help="Number of timed repetitions; the best is reported", required=False, default=3)
+    lookup.set_defaults(func=bench_directional_z0)
+    precision = subparsers.add_parser("precision", help="Scaling and spd/dir conversion in float32 vs float64, with the differences between them")
+    precision.add_argument("-nlat", type=int, help="Latitudes in the synthetic high-res grid", required=False, default=1000)
+    precision.add_argument("-nlon", type=int, help="Longitudes in the synthetic high-res grid", required=False, default=1000)
+    precision.add_argument("-res", type=float, help="Resolution of the synthetic high-res grid, in degrees", required=False, default=0.001)
+    precision.add_argument("-r", metavar="radius", type=float, help="Cone radius, in meters", required=False, default=3000)
+    precision.add_argument("-sigma", type=float, help="Gaussian decay sigma, in meters", required=False, default=1000)
+    precision.add_argument("-sl", metavar="scale_logic", type=str, help="Scaling logic: adcirc or up-down", required=False, default="adcirc")
+    precision.add_argument("-slices", type=int, help="Number of time slices to scale", required=False, default=6)
+    precision.add_argument("-repeat", type=int, help="Number of timed repetitions; the best is reported", required=False, default=3)
+    precision.set_defaults(func=bench_precision)
+    source = subparsers.add_parser("wind-source", help="Streaming wind slices with background read-ahead vs reading each slice when needed")
+    source.add_argument("-nlat", type=int, help="Latitudes in the synthetic OWI ASCII file", required=False, default=161)
+    source.add_argument("-nlon", type=int, help="Longitudes in the synthetic OWI ASCII file", required=False, default=201)
+    source.add_argument("-hrnlat", type=int, help="Latitudes in the high-res grid each slice is regridded to", required=False, default=1000)
+    source.add_argument("-hrnlon", type=int, help="Longitudes in the high-res grid each slice is regridded to", required=False, default=1000)
+    source.add_argument("-slices", type=int, help="Number of time slices", required=False, default=24)
+    source.add_argument("-prefetch", type=int, help="Slices read ahead", required=False, default=1)
+    source.set_defaults(func=bench_wind_source)
+    owi_netcdf = subparsers.add_parser("owi-netcdf", help="OWI NetCDF slice reads (hyperslab per slice vs whole variable per slice)")
+    owi_netcdf.add_argument("-nlat", type=int, help="Latitudes in the synthetic file", required=False, default=161)
+    owi_netcdf.add_argument("-nlon", type=int, help="Longitudes in the synthetic file", required=False, default=201)
+    owi_netcdf.add_argument("-times", type=int, nargs="+", help="Numbers of time steps to generate files with", required=False, default=[24, 48, 96])
+    owi_netcdf.set_defaults(func=bench_owi_netcdf)
+    blend = subparsers.add_parser("blend", help="Parametric/background wind blending (Blender vs a geodesic to every cell per slice)")
+    blend.add_argument("-nlat", type=int, help="Latitudes in the parametric grid", required=False, default=301)
+    blend.add_argument("-nlon", type=int, help="Longitudes in the parametric grid", required=False, default=401)
+    blend.add_argument("-res", type=float, help="Parametric grid resolution in degrees", required=False, default=0.01)
+    blend.add_argument("-slices", type=int, help="Number of time slices", required=False, default=12)
+    blend.add_argument("-repeat", type=int, help="Number of timed repetitions; the best is reported", required=False, default=3)
+    blend.set_defaults(func=bench_blend)
+    track_parser = subparsers.add_parser("track", help="Storm track ingestion (column-wise StormTrack vs row-by-row parsing and interp1d per slice)")
+    track_parser.add_argument("-slices", type=int, help="Number of 15-minute time slices", required=False, default=2000)
+    track_parser.add_argument("-repeat", type=int, help="Number of timed repetitions; the best is reported", required=False, default=3)
+    track_parser.set_defaults(func=bench_track)
+    wnd = subparsers.add_parser("wnd", help="WND slice reads (memory-mapped fixed-width decode vs float() per field)")
+    wnd.add_argument("-nlat", type=int, help="Latitudes in the synthetic file", required=False, default=201)
+    wnd.add_argument("-nlon", type=int, help="Longitudes in the synthetic file", required=False, default=251)
+    wnd.add_argument("-res", type=float, help="Grid resolution in degrees", required=False, default=0.02)
+    wnd.add_argument("-slices", type=int, help="Number of time slices", required=False, default=12)
+    wnd.add_argument("-repeat", type=int, help="Number of timed repetitions; the best is reported", required=False, default=3)
+    wnd.set_defaults(func=bench_wnd)
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
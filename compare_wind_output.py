@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# Contact: Josh Port (joshua_port@uri.edu)
+#
+# Compares two scale_and_subset.py outputs, e.g. a packed (-opack) or reduced-precision run against a default run of the same inputs
+# Reports the file sizes and the error in spd and dir; direction differences are taken the short way around the circle
+#
+import argparse
+import numpy
+import netCDF4
+import os
+
+
+def read_variable(group, name, start, end):
+    # Unpacked values (netCDF4 applies scale_factor/add_offset) with fill values and NaN as NaN
+    return numpy.ma.filled(group[name][start:end, :, :].astype(numpy.float64), numpy.nan)
+
+
+def compare(reference_filename, candidate_filename, slices_per_read):
+    reference = netCDF4.Dataset(reference_filename, "r")
+    candidate = netCDF4.Dataset(candidate_filename, "r")
+    reference_main = reference["Main"]
+    candidate_main = candidate["Main"]
+    if reference_main["spd"].shape != candidate_main["spd"].shape:
+        raise RuntimeError("Outputs have different shapes: " + str(reference_main["spd"].shape) + " and " + str(candidate_main["spd"].shape))
+    if not numpy.array_equal(reference_main["time"][:], candidate_main["time"][:]):
+        print("WARNING: Outputs have different time values", flush=True)
+    num_times = reference_main["spd"].shape[0]
+    results = {}
+    for name in ("spd", "dir"):
+        max_error = 0.0
+        sum_error = 0.0
+        sum_squared_error = 0.0
+        num_values = 0
+        num_nan_mismatch = 0
+        for start in range(0, num_times, slices_per_read):
+            end = min(num_times, start + slices_per_read)
+            reference_values = read_variable(reference_main, name, start, end)
+            candidate_values = read_variable(candidate_main, name, start, end)
+            both_valid = ~numpy.isnan(reference_values) & ~numpy.isnan(candidate_values)
+            num_nan_mismatch += int(numpy.count_nonzero(numpy.isnan(reference_values) != numpy.isnan(candidate_values)))
+            error = numpy.abs(candidate_values[both_valid] - reference_values[both_valid])
+            if name == "dir":
+                error = numpy.minimum(error, 360 - error)
+            if error.size > 0:
+                max_error = max(max_error, float(error.max()))
+                sum_error += float(error.sum())
+                sum_squared_error += float((error**2).sum())
+                num_values += error.size
+        results[name] = (max_error, sum_error / max(1, num_values), (sum_squared_error / max(1, num_values))**0.5, num_nan_mismatch)
+    reference.close()
+    candidate.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the spd and dir of two scale_and_subset.py outputs and report the error and file sizes")
+    parser.add_argument("reference", type=str, help="Reference output file, e.g. from a run without opack")
+    parser.add_argument("candidate", type=str, help="Output file to compare against the reference")
+    parser.add_argument("-slices", type=int, help="Number of time slices read at once", required=False, default=24)
+    args = parser.parse_args()
+
+    results = compare(args.reference, args.candidate, args.slices)
+    reference_size = os.path.getsize(args.reference)
+    candidate_size = os.path.getsize(args.candidate)
+    print("File size: reference {:.2f} MB, candidate {:.2f} MB ({:.1f}% of reference)".format(
+        reference_size / 1e6, candidate_size / 1e6, 100 * candidate_size / reference_size), flush=True)
+    for name, units in (("spd", "m s-1"), ("dir", "degrees")):
+        max_error, mean_error, rms_error, num_nan_mismatch = results[name]
+        print("{:s}: max abs error {:.4g} {:s}, mean abs error {:.4g} {:s}, RMS error {:.4g} {:s}, NaN mismatches {:d}".format(
+            name, max_error, units, mean_error, units, rms_error, units, num_nan_mismatch), flush=True)
+
+
+if __name__ == '__main__':
+    main()
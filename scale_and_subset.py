@@ -4,43 +4,66 @@
 # Scales OWI ASCII, WND, or blended OWI ASCII + WND winds based on local surface roughness
 # Outputs a value at every point in the high-res roughness file for each time slice in the input wind file
 #
+import abc
 import argparse
+import collections
 import concurrent.futures
 import datetime
+import hashlib
+import json
 import math
+import mmap
+import multiprocessing.shared_memory
 import netCDF4
 import numpy
-import pandas
+import os
 import pickle
 import pyproj
+import queue
+import scipy.fft
 import scipy.interpolate
+import scipy.ndimage
 import threading
+import time
+import track
+import water_z0
+
+
+# Per-process state set up by ProcessPoolExecutor initializers, so large read-only inputs aren't pickled with every task
+worker_state = {}
+
+# Per-thread state set up by ThreadPoolExecutor initializers when threads scale whole time slices at once; each thread gets its own
+# scaling context, since a context's work buffers (blending, dynamic water z0) can't be shared between threads
+thread_state = threading.local()
+
+# netCDF4 (HDF5) isn't thread-safe; netCDF reads and writes that can run while other threads are active (prefetching wind sources,
+# the async writer) hold this lock
+netcdf_lock = threading.Lock()
 
 
 class WindGrid:
+    # A rectilinear grid; only the 1-D axes are stored, and lon() and lat() are read-only 2-D views of them (numpy.broadcast_to),
+    # so a grid costs no more than its axes however many cells it has
+    __slots__ = ("__n_longitude", "__n_latitude", "__d_longitude", "__d_latitude", "__xll", "__yll", "__xur", "__yur", "__lon1d", "__lat1d")
+
     def __init__(self, lon, lat):
         self.__n_longitude = len(lon)
         self.__n_latitude = len(lat)
         self.__d_longitude = round(lon[1] - lon[0], 4)
         self.__d_latitude = round(lat[1] - lat[0], 4)
-        self.__lon = numpy.empty([self.__n_latitude, self.__n_longitude], dtype=numpy.float64)
-        self.__lat = numpy.empty([self.__n_latitude, self.__n_longitude], dtype=numpy.float64)
-        lon = numpy.array(lon)
-        lat = numpy.array(lat)
-        lon = numpy.where(lon > 180, lon - 360, lon)
-        self.__xll = min(lon)
-        self.__yll = min(lat)
-        self.__xur = max(lon)
-        self.__yur = max(lat)
-        self.__lon, self.__lat = numpy.meshgrid(lon, lat)  # sparse=True is an avenue to explore for saving memory
-        self.__lon1d = numpy.array(lon)
+        lon = numpy.asarray(lon)
+        self.__lon1d = numpy.where(lon > 180, lon - 360, lon)
         self.__lat1d = numpy.array(lat)
+        self.__xll = self.__lon1d.min()
+        self.__yll = self.__lat1d.min()
+        self.__xur = self.__lon1d.max()
+        self.__yur = self.__lat1d.max()
 
     def lon(self):
-        return self.__lon
+        return numpy.broadcast_to(self.__lon1d, (self.__n_latitude, self.__n_longitude))
 
     def lat(self):
-        return self.__lat
+        return numpy.broadcast_to(self.__lat1d[:, None], (self.__n_latitude, self.__n_longitude))
 
     def lon1d(self):
         return self.__lon1d
@@ -94,8 +117,60 @@ class WindGrid:
 
     @staticmethod
     def interpolate_to_grid(original_grid, original_data, new_grid):
-        func = scipy.interpolate.RectBivariateSpline(original_grid.lat1d(), original_grid.lon1d(), original_data, kx=1, ky=1)
-        return func(new_grid.lat1d(), new_grid.lon1d())
+        regridder = Regridder.get(original_grid.lat1d(), original_grid.lon1d(), new_grid.lat1d(), new_grid.lon1d())
+        return regridder.apply(original_data)
+
+
+class Regridder:
+    # Bilinear interpolation between two rectilinear grids; equivalent to RectBivariateSpline with kx=ky=1, including holding
+    # values constant beyond the edges of the source grid. The source indices and weights along each axis are computed once
+    # per (source grid, target grid) pair and reused for every field, time slice, and subdomain on that pair of grids.
+    __cache = {}
+    __cache_lock = threading.Lock()
+
+    def __init__(self, src_lat, src_lon, tgt_lat, tgt_lon):
+        self.__lat_idx, self.__lat_wt = Regridder.__axis_weights(src_lat, tgt_lat)
+        self.__lon_idx, self.__lon_wt = Regridder.__axis_weights(src_lon, tgt_lon)
+        self.__lat_wt_lo = 1 - self.__lat_wt
+        self.__lon_wt_lo = 1 - self.__lon_wt
+        # float32 copies of the weights, so float32 data is interpolated without being promoted to float64
+        self.__weights32 = tuple(wt.astype(numpy.float32) for wt in (self.__lat_wt_lo, self.__lat_wt, self.__lon_wt_lo, self.__lon_wt))
+
+    @staticmethod
+    def __axis_weights(src, tgt):
+        src = numpy.asarray(src, dtype=numpy.float64)
+        tgt = numpy.clip(numpy.asarray(tgt, dtype=numpy.float64), src[0], src[-1])
+        idx = numpy.clip(numpy.searchsorted(src, tgt, side='right') - 1, 0, len(src) - 2)
+        return idx, (tgt - src[idx]) / (src[idx + 1] - src[idx])
+
+    @staticmethod
+    def get(src_lat, src_lon, tgt_lat, tgt_lon):
+        # Return the shared Regridder for this pair of grids, creating it the first time the pair is seen
+        key = tuple(numpy.asarray(axis, dtype=numpy.float64).tobytes() for axis in (src_lat, src_lon, tgt_lat, tgt_lon))
+        with Regridder.__cache_lock:
+            regridder = Regridder.__cache.get(key)
+            if regridder is None:
+                regridder = Regridder(src_lat, src_lon, tgt_lat, tgt_lon)
+                Regridder.__cache[key] = regridder
+        return regridder
+
+    @staticmethod
+    def clear_cache():
+        # Forget the shared Regridders, so the next get for each pair of grids computes its weights again (e.g. to time that)
+        with Regridder.__cache_lock:
+            Regridder.__cache.clear()
+
+    def apply(self, data):
+        # The last two axes of data are (lat, lon) on the source grid; any leading axes (e.g. U and V stacked) are carried through
+        # float32 data gives float32 results; anything else is interpolated in float64
+        if data.dtype == numpy.float32:
+            lat_wt_lo, lat_wt, lon_wt_lo, lon_wt = self.__weights32
+        else:
+            lat_wt_lo, lat_wt, lon_wt_lo, lon_wt = self.__lat_wt_lo, self.__lat_wt, self.__lon_wt_lo, self.__lon_wt
+        rows = data[..., self.__lat_idx, :] * lat_wt_lo[:, None] + data[..., self.__lat_idx + 1, :] * lat_wt[:, None]
+        result = rows[..., self.__lon_idx] * lon_wt_lo + rows[..., self.__lon_idx + 1] * lon_wt
+        result += 0.0  # -0.0 inputs (e.g. "-0.000" in a WND file) would otherwise give -0.0 where the spline gives +0.0
+        return result
 
 
 class WindData:
@@ -142,11 +217,365 @@ class Roughness:
         return lon, lat, land_rough
 
 
+class DirectionalZ0:
+    # Directional z0 cube (n_lat x n_lon x 13 direction bins from 0 to 360 degrees) and the parameters used to generate it
+    # Saved as <name>.npy (the cube, which can be memory-mapped read-only) plus a <name>.json header (axes and parameters)
+    format_name = "richamp-directional-z0"
+    format_version = 1
+
+    def __init__(self, lat, lon, angle, z0_directional, sigma=None, radius=None, roughness_hash=None):
+        self.__lat = numpy.asarray(lat)
+        self.__lon = numpy.asarray(lon)
+        self.__angle = numpy.asarray(angle)
+        self.__z0_directional = z0_directional
+        self.__sigma = sigma
+        self.__radius = radius
+        self.__roughness_hash = roughness_hash
+
+    def lat(self):
+        return self.__lat
+
+    def lon(self):
+        return self.__lon
+
+    def angle(self):
+        return self.__angle
+
+    def z0_directional(self):
+        return self.__z0_directional
+
+    def sigma(self):
+        return self.__sigma
+
+    def radius(self):
+        return self.__radius
+
+    def roughness_hash(self):
+        return self.__roughness_hash
+
+    def subset(self, start, end):
+        # Rows start:end of the cube; this is a view, so memory-mapped cubes stay memory-mapped
+        return DirectionalZ0(self.__lat[start:end], self.__lon, self.__angle, self.__z0_directional[start:end, :, :],
+                             self.__sigma, self.__radius, self.__roughness_hash)
+
+    def astype(self, dtype):
+        # The same cube with its values as dtype; self if they already are (so a memory-mapped cube stays memory-mapped)
+        if self.__z0_directional.dtype == dtype:
+            return self
+        return DirectionalZ0(self.__lat, self.__lon, self.__angle, numpy.asarray(self.__z0_directional, dtype=dtype),
+                             self.__sigma, self.__radius, self.__roughness_hash)
+
+    def interpolant(self):
+        return scipy.interpolate.RegularGridInterpolator((self.__lat, self.__lon, self.__angle), self.__z0_directional, method='linear')
+
+    def lookup(self, direction):
+        # Directional z0 at every cell of the cube's grid for one direction per cell (n_lat x n_lon); the cell is known, so only the
+        # direction is interpolated. Cubes with unevenly spaced direction bins fall back to the general interpolant.
+        if numpy.allclose(self.__angle, numpy.linspace(0, 360, self.__angle.size)):
+            return directional_lookup(self.__z0_directional, direction)
+        lat_grid, lon_grid = numpy.meshgrid(self.__lat, self.__lon, indexing='ij')
+        return self.interpolant()((lat_grid, lon_grid, direction))
+
+    def save(self, filename, roughness_hash=None):
+        # Write to temporary files and rename them into place so concurrent readers never see a partial file; the header is
+        # written last, so its presence means the cube is complete
+        if roughness_hash is not None:
+            self.__roughness_hash = roughness_hash
+        header = {"format": DirectionalZ0.format_name, "version": DirectionalZ0.format_version,
+                  "sigma": self.__sigma, "radius": self.__radius, "roughness_sha256": self.__roughness_hash,
+                  "shape": list(self.__z0_directional.shape), "dtype": str(self.__z0_directional.dtype),
+                  "lat": self.__lat.tolist(), "lon": self.__lon.tolist(), "angle": self.__angle.tolist()}
+        with open(filename + '.npy.tmp', 'wb') as file:
+            numpy.save(file, self.__z0_directional)
+        os.replace(filename + '.npy.tmp', filename + '.npy')
+        with open(filename + '.json.tmp', 'w') as file:
+            json.dump(header, file)
+        os.replace(filename + '.json.tmp', filename + '.json')
+
+    @staticmethod
+    def load(filename):
+        # Memory-map a saved cube read-only (safe to share between concurrent runs); fall back to a legacy pickled interpolant
+        if not os.path.exists(filename + '.json'):
+            with open(filename + '.pickle', 'rb') as file:
+                interpolant = pickle.load(file)
+            return DirectionalZ0(interpolant.grid[0], interpolant.grid[1], interpolant.grid[2], interpolant.values)
+        with open(filename + '.json', 'r') as file:
+            header = json.load(file)
+        if header.get("format") != DirectionalZ0.format_name or header.get("version") != DirectionalZ0.format_version:
+            raise RuntimeError("Unsupported directional z0 file format in " + filename + ".json")
+        z0_directional = numpy.load(filename + '.npy', mmap_mode='r')
+        if list(z0_directional.shape) != header["shape"]:
+            raise RuntimeError("Directional z0 cube " + filename + ".npy does not match its header")
+        return DirectionalZ0(header["lat"], header["lon"], header["angle"], z0_directional,
+                             header["sigma"], header["radius"], header["roughness_sha256"])
+
+
+def file_sha256(filename):
+    sha256 = hashlib.sha256()
+    with open(filename, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class SharedArray:
+    # A numpy array in shared memory; worker processes attach to it by spec() instead of receiving a pickled copy
+    def __init__(self, shape, dtype, name=None):
+        self.__shape = tuple(shape)
+        self.__dtype = numpy.dtype(dtype)
+        self.__owner = name is None
+        size = max(1, math.prod(self.__shape) * self.__dtype.itemsize)
+        self.__shm = multiprocessing.shared_memory.SharedMemory(name=name, create=self.__owner, size=size if self.__owner else 0)
+        self.__array = numpy.ndarray(self.__shape, dtype=self.__dtype, buffer=self.__shm.buf)
+
+    def array(self):
+        return self.__array
+
+    def spec(self):
+        return self.__shm.name, self.__shape, self.__dtype.str
+
+    @staticmethod
+    def attach(spec):
+        name, shape, dtype = spec
+        return SharedArray(shape, dtype, name)
+
+    @staticmethod
+    def copy_of(array, dtype=None):
+        shared = SharedArray(array.shape, array.dtype if dtype is None else dtype)
+        shared.array()[...] = array
+        return shared
+
+    def close(self):
+        # Any views of array() must be released before calling this
+        self.__array = None
+        self.__shm.close()
+        if self.__owner:
+            self.__shm.unlink()
+
+
+class ScalingContext:
+    # Everything roughness_adjust needs for one subdomain that is the same for every time slice: land roughness interpolated to the
+    # wind and high-res grids, the roughness-only parts of the scaling equations, and the subdomain's directional z0 cube (a
+    # DirectionalZ0 on the high-res grid, looked up cell by cell). Build one per subdomain before the time loop instead of
+    # recomputing these for every slice.
+    # With water_fraction (the subdomain's rows of the directional water fraction cube) and water_z0_constant (the z0 of water
+    # cells in the high-res roughness), the water part of the directional z0 is replaced every slice with z0 derived from the wind
+    # (see water_z0.py); only cells whose cones reach water are stored and updated
+    # dtype is the precision of the high-res computation: the wind is regridded to the high-res grid in dtype and the high-res
+    # factors are stored in it, so with float32 (and a float32 directional z0 cube) every full-grid array is float32
+    # With storm_track, the context owns a Blender on the wind grid, so subdomains blending at the same time don't share buffers; a
+    # context holds work buffers, so it must only be used by one thread at a time (with schedule time, each thread builds its own)
+    def __init__(self, scale_logic, wind_grid, z0_wr_w_grid, z0_hr, z0_directional,
+                 wback_grid=None, z0_wbackr=None, storm_track=None, water_fraction=None, water_z0_constant=None, dtype=numpy.float64):
+        self.__scale_logic = scale_logic
+        self.__dtype = numpy.dtype(dtype)
+        self.__hr_grid = WindGrid(z0_hr.lon(), z0_hr.lat())
+        self.__wind_to_hr = Regridder.get(wind_grid.lat1d(), wind_grid.lon1d(), z0_hr.lat(), z0_hr.lon())
+        self.__z0_directional = z0_directional
+        self.__blender = Blender(wind_grid, storm_track) if storm_track is not None else None
+        self.__wind_factor = None
+        self.__wback_factor = None
+        if scale_logic == "adcirc":
+            if z0_wbackr is not None:
+                z0_wbackr_w_grid = z0_to_grid_res(z0_wbackr, wind_grid)
+                self.__wback_factor = adcirc_factor(z0_wbackr_w_grid.land_rough(), z0_wr_w_grid.land_rough())
+            z0_wr_hr_grid = z0_to_z0_res(z0_wr_w_grid, z0_hr).land_rough()
+            self.__z0_wr_hr_pow = (z0_wr_hr_grid**-0.0706).astype(self.__dtype)
+            self.__z0_wr_hr_inv_log = (1 / numpy.log(10 / z0_wr_hr_grid)).astype(self.__dtype)
+        elif scale_logic == "up-down":
+            self.__wind_factor = zref_factor(z0_wr_w_grid.land_rough())
+            if z0_wbackr is not None:
+                z0_wbackr_wback_grid = z0_to_grid_res(z0_wbackr, wback_grid)
+                self.__wback_factor = zref_factor(z0_wbackr_wback_grid.land_rough())
+        self.__water_cells = None
+        if water_fraction is not None:
+            # Flat indices of the cells whose cones reach water. Most are usually open water, with the same fraction (1) in every
+            # direction; only the others need the fraction looked up by direction, so their fractions are kept separately (flattened,
+            # with the flat index of each cell's first bin), and the rest get a fixed fraction (1 for the directional cells, which
+            # are then multiplied by the looked-up fraction). Work arrays are reused every slice, so a context must only be used by
+            # one thread at a time (with schedule time, each thread builds its own; see roughness_adjust_thread_init).
+            self.__water_cells = numpy.flatnonzero(water_fraction.max(axis=2) > 0)
+            fraction = numpy.asarray(water_fraction.reshape(-1, water_fraction.shape[2])[self.__water_cells], dtype=numpy.float32)
+            directional = fraction.min(axis=1) != fraction.max(axis=1)
+            self.__water_bins = fraction.shape[1]
+            self.__water_directional = numpy.flatnonzero(directional)  # Positions among the water cells
+            self.__water_directional_cells = self.__water_cells[directional]
+            self.__water_fraction = fraction[directional].reshape(-1)
+            self.__water_first_bin = numpy.arange(self.__water_directional.size) * self.__water_bins
+            self.__water_fixed_fraction = numpy.where(directional, 1, fraction[:, 0]).astype(self.__dtype)
+            if numpy.all(self.__water_fixed_fraction == 1):
+                self.__water_fixed_fraction = None  # Nothing to multiply by
+            self.__water_work = numpy.empty((2, self.__water_cells.size), dtype=self.__dtype)
+            self.__water_index = numpy.empty(self.__water_cells.size, dtype=numpy.intp)
+            self.__water_directional_work = numpy.empty((2, self.__water_directional.size), dtype=self.__dtype)
+            self.__water_directional_index = numpy.empty(self.__water_directional.size, dtype=numpy.intp)
+            self.__water_z0_constant = water_z0_constant
+            self.__z_obs = 10 if scale_logic == "adcirc" else 80  # Height of the high-res wind; for up-down that's z_ref (see zref_factor)
+            # Water z0 tabulated against wind speed, with the slope of each step, so each slice interpolates on a uniform grid
+            # instead of searching the ustar table
+            self.__water_z0_speed_step = 0.01  # m/s
+            self.__water_z0_change_table = self.__water_z0_exact(numpy.arange(0, 150 + self.__water_z0_speed_step, self.__water_z0_speed_step)) - water_z0_constant
+            self.__water_z0_slope = numpy.append(numpy.diff(self.__water_z0_change_table), 0)
+
+    def scale_logic(self):
+        return self.__scale_logic
+
+    def hr_grid(self):
+        return self.__hr_grid
+
+    def blend(self, param_wind, back_wind):
+        # Blend parametric wind on the wind grid with background wind already on it (see Blender)
+        return self.__blender.blend(param_wind, back_wind)
+
+    def wind_factor(self):
+        # up-down: 10 m to z_ref over the wind-resolution roughness
+        return self.__wind_factor
+
+    def wback_factor(self):
+        # adcirc: background roughness to wind-resolution roughness, on the wind grid; up-down: 10 m to z_ref on the background grid
+        return self.__wback_factor
+
+    def wind_to_hr_grid(self, wind):
+        uv_hr = self.__wind_to_hr.apply(numpy.stack((wind.u_velocity(), wind.v_velocity())).astype(self.__dtype, copy=False))
+        return WindData(wind.date(), self.__hr_grid, uv_hr[0], uv_hr[1])
+
+    def z0_directional(self, direction):
+        return self.__z0_directional.lookup(direction)
+
+    def apply_water_z0(self, z0_hr_directional, wind_hr_grid, direction):
+        # Where a cone covers a fraction F of water, its directional z0 includes F times the constant water z0; swap that for F times
+        # the water z0 implied by the wind at the cell (assumed to hold across the cone). May modify z0_hr_directional in place.
+        # Only the water cells are touched, a few passes over each, through the context's work arrays
+        if self.__water_cells is None or self.__water_cells.size == 0:
+            return z0_hr_directional
+        speed, work = self.__water_work
+        numpy.take(wind_hr_grid.u_velocity().reshape(-1), self.__water_cells, out=speed)
+        numpy.take(wind_hr_grid.v_velocity().reshape(-1), self.__water_cells, out=work)
+        numpy.multiply(speed, speed, out=speed)
+        numpy.multiply(work, work, out=work)
+        numpy.add(speed, work, out=speed)
+        numpy.sqrt(speed, out=speed)
+        z0_change = self.__water_z0_change(speed)
+        if self.__water_fixed_fraction is not None:
+            numpy.multiply(z0_change, self.__water_fixed_fraction, out=z0_change)
+        if self.__water_directional.size > 0:
+            z0_change[self.__water_directional] *= self.__water_fraction_lookup(direction)
+        z0_flat = z0_hr_directional.reshape(-1)
+        z0_flat[self.__water_cells] += z0_change
+        return z0_flat.reshape(z0_hr_directional.shape)
+
+    def __water_fraction_lookup(self, direction):
+        # directional_lookup on the fractions of the directional water cells, with the bin offsets precomputed
+        position, fraction = self.__water_directional_work
+        index = self.__water_directional_index
+        numpy.take(direction.reshape(-1), self.__water_directional_cells, out=position)
+        numpy.multiply(position, (self.__water_bins - 1) / 360, out=position)
+        numpy.nan_to_num(position, copy=False)  # Calm wind as 0 degrees, as in directional_lookup
+        numpy.floor(position, out=fraction)
+        numpy.minimum(fraction, self.__water_bins - 2, out=fraction)
+        numpy.copyto(index, fraction, casting='unsafe')
+        numpy.subtract(position, fraction, out=position)  # Weight of the upper bin
+        numpy.add(index, self.__water_first_bin, out=index)
+        fraction[:] = self.__water_fraction[index]  # The fractions are stored as float32
+        numpy.add(index, 1, out=index)
+        upper = self.__water_fraction[index].astype(fraction.dtype)
+        numpy.subtract(upper, fraction, out=upper)
+        numpy.multiply(upper, position, out=position)
+        numpy.add(fraction, position, out=fraction)
+        return fraction
+
+    def __water_z0_change(self, speed):
+        # Water z0 less the constant water z0, by linear interpolation in the speed table; speeds beyond it (or NaN) go through the
+        # ustar retrieval directly. Overwrites speed with the result.
+        top_speed = self.__water_z0_speed_step * (self.__water_z0_change_table.size - 1)
+        beyond = None
+        if not numpy.max(speed) <= top_speed:  # Also true with any NaN
+            beyond = ~(speed <= top_speed)
+            z0_change_beyond = self.__water_z0_exact(speed[beyond]) - self.__water_z0_constant
+            speed[beyond] = 0
+        lower = self.__water_index
+        numpy.multiply(speed, 1 / self.__water_z0_speed_step, out=speed)
+        numpy.copyto(lower, speed, casting='unsafe')  # Truncation is floor for speeds; the slope table has an entry for the top speed
+        numpy.subtract(speed, lower, out=speed, casting='unsafe')  # Weight of the upper entry
+        numpy.multiply(speed, numpy.take(self.__water_z0_slope, lower), out=speed, casting='unsafe')
+        numpy.add(speed, numpy.take(self.__water_z0_change_table, lower), out=speed, casting='unsafe')
+        if beyond is not None:
+            speed[beyond] = z0_change_beyond
+        return speed
+
+    def __water_z0_exact(self, speed):
+        ust = water_z0.retrieve_ust_U10(speed, self.__z_obs)
+        return numpy.maximum(water_z0.cal_z0_from_ustar(ust), 1e-5)  # Floor for near-calm wind, where ustar and z0 go to 0
+
+    def hr_factor(self, z0_hr_directional):
+        # Factor taking the wind on the high-res grid to directional z0
+        if self.__scale_logic == "adcirc":
+            return z0_hr_directional**0.0706 * self.__z0_wr_hr_pow * numpy.log(10 / z0_hr_directional) * self.__z0_wr_hr_inv_log
+        return 1 / zref_factor(z0_hr_directional)
+
+
+class SpeedDirection:
+    # Speed and meteorological direction (coming from) of u and v, written straight into caller-provided arrays (which may be
+    # float32) using work arrays that are reused from call to call, so converting a slice allocates no full-grid temporaries
+    # Matches magnitude_from_uv and dir_met_to_and_from_math(direction_from_uv) to rounding, including NaN direction for calm wind
+    def __init__(self, shape, dtype=numpy.float64):
+        self.__work = numpy.empty((2,) + tuple(shape), dtype=dtype)
+        self.__mask = numpy.empty((2,) + tuple(shape), dtype=bool)
+
+    def compute(self, u_vel, v_vel, spd_out, dir_out):
+        work, square = self.__work
+        calm, north = self.__mask
+        numpy.square(u_vel, out=work)
+        numpy.square(v_vel, out=square)
+        numpy.add(work, square, out=work)
+        numpy.sqrt(work, out=work)  # Same operations as magnitude_from_uv; numpy.hypot is several times slower
+        numpy.equal(u_vel, 0, out=calm)
+        numpy.equal(v_vel, 0, out=north)
+        numpy.logical_and(calm, north, out=calm)
+        numpy.copyto(spd_out, work, casting='same_kind')
+        # The direction the wind comes from, clockwise from north, is 180 degrees plus the bearing it blows toward, atan2(u, v)
+        numpy.arctan2(u_vel, v_vel, out=work)
+        numpy.rad2deg(work, out=work)
+        numpy.add(work, 180, out=work)
+        numpy.equal(work, 360, out=north)  # From due north is 0, as in dir_met_to_and_from_math
+        numpy.copyto(work, 0, where=north)
+        numpy.copyto(work, numpy.nan, where=calm)
+        numpy.copyto(dir_out, work, casting='same_kind')
+
+
 class NetcdfOutput:
-    def __init__(self, filename, lon, lat):
+    # Slices are buffered and written chunk_shape[0] (or buffer_slices) at a time as one hyperslab per variable. The default chunks
+    # hold a few hours of a 128 x 128 tile, so reading a full map at one time and reading a long time series at one point both
+    # decompress a modest number of chunks. Against the original writer (one slice per chunk, one write per slice), writes take
+    # about as long on grids of a tile or two (100 x 100 to 300 x 300) and are faster on larger ones; a point's time series reads
+    # several times faster, but a single map reads slower, so output only ever read a map at a time is better with
+    # chunk_shape (1, len(lat), len(lon)). The shuffle filter is on by default, as it was for the original writer; without it
+    # the output is larger and slower to write. With bulk_time, time values are written once at close instead of with every flush.
+    # pack is "none" (float32), "int16" (spd and dir stored as int16 with scale_factor = packing_scale, which readers such as
+    # netCDF4 and xarray unpack automatically), or "lsd" (float32 rounded to least_significant_digit, so it compresses better)
+    # dtype is the precision spd and dir are computed in before they're stored. num_times only caps the time size of a chunk;
+    # the time dimension stays unlimited, so the file can still be appended to
+    default_chunk_shape = (6, 128, 128)
+    packing_scale = {"spd": 0.01, "dir": 0.1}
+    least_significant_digit = {"spd": 2, "dir": 1}
+
+    def __init__(self, filename, lon, lat, num_times=None, chunk_shape=None, buffer_slices=None, complevel=2, shuffle=True, bulk_time=False,
+                 pack="none", dtype=numpy.float64):
         self.__filename = filename
         self.__lon = lon
         self.__lat = lat
+        if chunk_shape is None:
+            chunk_shape = NetcdfOutput.default_chunk_shape
+        self.__chunk_shape = (max(1, min(chunk_shape[0], num_times or chunk_shape[0])), min(chunk_shape[1], len(lat)), min(chunk_shape[2], len(lon)))
+        self.__buffer_slices = buffer_slices if buffer_slices is not None else self.__chunk_shape[0]
+        self.__bulk_time = bulk_time
+        self.__pack = pack
+        self.__buffer_start = 0
+        self.__buffer_count = 0
+        self.__spd_buffer = numpy.empty((self.__buffer_slices, len(lat), len(lon)), dtype=numpy.float32)
+        self.__dir_buffer = numpy.empty((self.__buffer_slices, len(lat), len(lon)), dtype=numpy.float32)
+        self.__speed_direction = SpeedDirection((len(lat), len(lon)), dtype)
+        self.__times = []  # (idx, minutes, seconds) not yet written
         self.__nc = netCDF4.Dataset(self.__filename + ".nc", "w")
         self.__nc.group_order = "Main"
         self.__nc.source = "scale_and_subset.py"
@@ -158,27 +587,26 @@ class NetcdfOutput:
         self.__group_main.rank = 1
 
         # Create dimensions
-        self.__group_main_dim_time = self.__group_main.createDimension("time", None)
+        self.__group_main_dim_time = self.__group_main.createDimension("time", None)  # Unlimited, so an aborted run ends at its last flushed slice
         self.__group_main_dim_longitude = self.__group_main.createDimension("longitude", len(self.__lon))
         self.__group_main_dim_latitude = self.__group_main.createDimension("latitude", len(self.__lat))
 
         # Create variables (with compression)
-        self.__group_main_var_time = self.__group_main.createVariable("time", "f4", "time", zlib=True, complevel=2,
+        zlib = complevel > 0
+        self.__group_main_var_time = self.__group_main.createVariable("time", "f4", "time", zlib=zlib, complevel=complevel, shuffle=shuffle,
                                                                       fill_value=netCDF4.default_fillvals["f4"])
-        self.__group_main_var_time_unix = self.__group_main.createVariable("time_unix", "i8", "time", zlib=True, complevel=2,
+        self.__group_main_var_time_unix = self.__group_main.createVariable("time_unix", "i8", "time", zlib=zlib, complevel=complevel, shuffle=shuffle,
                                                                            fill_value=netCDF4.default_fillvals["i8"])  # int64 isn't supported in DAP2; still using unless RICHAMP needs DAP2
-        self.__group_main_var_lon = self.__group_main.createVariable("lon", "f8", "longitude", zlib=True, complevel=2,
+        self.__group_main_var_lon = self.__group_main.createVariable("lon", "f8", "longitude", zlib=zlib, complevel=complevel, shuffle=shuffle,
                                                                      fill_value=netCDF4.default_fillvals["f8"])
-        self.__group_main_var_lat = self.__group_main.createVariable("lat", "f8", "latitude", zlib=True, complevel=2,
+        self.__group_main_var_lat = self.__group_main.createVariable("lat", "f8", "latitude", zlib=zlib, complevel=complevel, shuffle=shuffle,
                                                                      fill_value=netCDF4.default_fillvals["f8"])
         # self.__group_main_var_u10       = self.__group_main.createVariable("U10", "f4", ("time", "latitude", "longitude"), zlib=True,
         #                                                                     complevel=2,fill_value=netCDF4.default_fillvals["f4"])
         # self.__group_main_var_v10       = self.__group_main.createVariable("V10", "f4", ("time", "latitude", "longitude"), zlib=True,
         #                                                                     complevel=2,fill_value=netCDF4.default_fillvals["f4"])
-        self.__group_main_var_spd = self.__group_main.createVariable("spd", "f4", ("time", "latitude", "longitude"), zlib=True,
-                                                                     complevel=2, fill_value=netCDF4.default_fillvals["f4"])
-        self.__group_main_var_dir = self.__group_main.createVariable("dir", "f4", ("time", "latitude", "longitude"), zlib=True,
-                                                                     complevel=2, fill_value=netCDF4.default_fillvals["f4"])
+        self.__group_main_var_spd = self.__create_wind_variable("spd", zlib, complevel, shuffle)
+        self.__group_main_var_dir = self.__create_wind_variable("dir", zlib, complevel, shuffle)
 
         # Add attributes to variables
         self.__base_date = datetime.datetime(1990, 1, 1, 0, 0, 0)
@@ -216,110 +644,361 @@ class NetcdfOutput:
         self.__group_main_var_lat[:] = self.__lat
         self.__group_main_var_lon[:] = self.__lon
 
-    def append(self, idx, date, uvel, vvel, lock):
-        if lock:
-            lock.acquire()
-
+    def __create_wind_variable(self, name, zlib, complevel, shuffle):
+        dimensions = ("time", "latitude", "longitude")
+        if self.__pack == "int16":
+            # spd up to 327.67 m s-1 and dir up to 3276.7 degrees fit in int16 at these scales
+            variable = self.__group_main.createVariable(name, "i2", dimensions, zlib=zlib, complevel=complevel, shuffle=shuffle,
+                                                        chunksizes=self.__chunk_shape, fill_value=netCDF4.default_fillvals["i2"])
+            variable.scale_factor = NetcdfOutput.packing_scale[name]
+            variable.add_offset = 0.0
+            return variable
+        least_significant_digit = NetcdfOutput.least_significant_digit[name] if self.__pack == "lsd" else None
+        return self.__group_main.createVariable(name, "f4", dimensions, zlib=zlib, complevel=complevel, shuffle=shuffle, chunksizes=self.__chunk_shape,
+                                                least_significant_digit=least_significant_digit, fill_value=netCDF4.default_fillvals["f4"])
+
+    def append(self, idx, date, uvel, vvel):
+        # Slices are expected in index order; anything already buffered is flushed first if idx doesn't follow it
+        if self.__buffer_count > 0 and idx != self.__buffer_start + self.__buffer_count:
+            self.flush()
+        if self.__buffer_count == 0:
+            self.__buffer_start = idx
         delta = (date - self.__base_date)
         minutes = round((delta.days * 86400 + delta.seconds) / 60)
         delta_unix = (date - self.__base_date_unix)
         seconds = round(delta_unix.days * 86400 + delta_unix.seconds)
 
-        self.__group_main_var_time[idx] = minutes
-        self.__group_main_var_time_unix[idx] = seconds
-        # self.__group_main_var_u10[idx, :, :] = uvel
-        # self.__group_main_var_v10[idx, :, :] = vvel
-        self.__group_main_var_spd[idx, :, :] = magnitude_from_uv(uvel, vvel)
-        self.__group_main_var_dir[idx, :, :] = dir_met_to_and_from_math(direction_from_uv(uvel, vvel))
+        self.__times.append((idx, minutes, seconds))
+        self.__speed_direction.compute(uvel, vvel, self.__spd_buffer[self.__buffer_count], self.__dir_buffer[self.__buffer_count])
+        self.__buffer_count += 1
+        if self.__buffer_count == self.__buffer_slices:
+            self.flush()
+
+    def buffered_slices(self):
+        # Number of appended slices not yet written to the file
+        return self.__buffer_count
+
+    def flush(self):
+        # Write the buffered slices with one hyperslab write per variable
+        with netcdf_lock:
+            self.__flush()
+
+    def __flush(self):
+        if self.__buffer_count > 0:
+            end = self.__buffer_start + self.__buffer_count
+            spd = self.__spd_buffer[:self.__buffer_count]
+            direction = self.__dir_buffer[:self.__buffer_count]
+            if self.__pack == "int16":
+                # Directions within half a step of 360 would round to 360 degrees when packed; wrap them to 0 first
+                dir_scale = NetcdfOutput.packing_scale["dir"]
+                direction = numpy.mod(numpy.round(direction / dir_scale), round(360 / dir_scale)) * dir_scale
+                # NaN (e.g. the direction of calm wind) has no int16 value, so mask it to be stored as the fill value
+                spd = numpy.ma.masked_array(numpy.nan_to_num(spd), mask=numpy.isnan(spd))
+                direction = numpy.ma.masked_array(numpy.nan_to_num(direction), mask=numpy.isnan(direction))
+            self.__group_main_var_spd[self.__buffer_start:end, :, :] = spd
+            self.__group_main_var_dir[self.__buffer_start:end, :, :] = direction
+            self.__buffer_count = 0
+        if not self.__bulk_time:
+            self.__write_times()
+
+    def __write_times(self):
+        # One write per variable when the pending indices are consecutive, as they are when slices arrive in order
+        if self.__times:
+            idx, minutes, seconds = (numpy.array(values) for values in zip(*self.__times))
+            if numpy.array_equal(idx, numpy.arange(idx[0], idx[0] + idx.size)):
+                self.__group_main_var_time[idx[0]:idx[-1] + 1] = minutes
+                self.__group_main_var_time_unix[idx[0]:idx[-1] + 1] = seconds
+            else:
+                for i, m, sec in self.__times:
+                    self.__group_main_var_time[i] = m
+                    self.__group_main_var_time_unix[i] = sec
+            self.__times = []
 
-        if lock:
-            lock.release()
+    def close(self):
+        with netcdf_lock:
+            self.__flush()
+            self.__write_times()
+            self.__nc.close()
+
+
+class AsyncWriter:
+    # Appends time slices to a NetcdfOutput on a single dedicated thread, in the order they are put. At most depth slices wait in
+    # the queue; put blocks while it is full, so the memory held by pending writes is capped at depth slices however slow writes are
+    def __init__(self, output, depth):
+        self.__output = output
+        self.__queue = queue.Queue(maxsize=depth)
+        self.__error = None
+        self.__num_written = 0
+        self.__total_buffer_time = 0.0
+        self.__num_flushes = 0
+        self.__total_flush_time = 0.0
+        self.__max_flush_time = 0.0
+        self.__num_waits = 0
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+
+    def put(self, idx, date, uvel, vvel):
+        self.__raise_if_failed()
+        if self.__queue.full():
+            if self.__num_waits == 0:
+                print("INFO: NetCDF writes are taking longer than computations, so computations will wait for the write queue. "
+                      + "Consider using fewer threads, or a larger wqdepth if memory allows.", flush=True)
+            self.__num_waits += 1
+        self.__queue.put((idx, date, uvel, vvel))
 
     def close(self):
-        self.__nc.close()
+        # Wait for every queued slice to be written
+        if self.__queue.qsize() > 0:
+            print("INFO: Waiting for {:d} queued time slices to be written to NetCDF".format(self.__queue.qsize()), flush=True)
+        self.__queue.join()
+        self.__queue.put(None)
+        self.__thread.join()
+        if self.__num_written > 0:
+            # Slices left in the output's buffer are flushed when the output is closed, so they aren't counted here
+            buffered = self.__num_written - self.__num_flushes
+            print("INFO: Appended {:d} time slices to NetCDF output; buffering time mean {:.4f} s per slice; {:d} flushes to NetCDF, flush time mean {:.3f} s, "
+                  "max {:.3f} s; computations waited on the write queue {:d} times".format(
+                      self.__num_written, self.__total_buffer_time / buffered if buffered > 0 else 0.0, self.__num_flushes,
+                      self.__total_flush_time / self.__num_flushes if self.__num_flushes > 0 else 0.0, self.__max_flush_time, self.__num_waits), flush=True)
+        self.__raise_if_failed()
+
+    def __raise_if_failed(self):
+        if self.__error is not None:
+            raise RuntimeError("Writing output to NetCDF failed") from self.__error
+
+    def __run(self):
+        while True:
+            item = self.__queue.get()
+            if item is None:
+                return
+            if self.__error is not None:
+                self.__queue.task_done()
+                continue  # Keep draining so producers don't block forever; the error is raised on the next put or close
+            idx, date, uvel, vvel = item
+            try:
+                buffered = self.__output.buffered_slices()
+                t0 = time.perf_counter()
+                self.__output.append(idx, date, uvel, vvel)
+                append_time = time.perf_counter() - t0
+            except Exception as e:
+                self.__error = e
+                self.__queue.task_done()
+                continue
+            self.__num_written += 1
+            if self.__output.buffered_slices() == buffered + 1:
+                self.__total_buffer_time += append_time
+            else:  # The append wrote the buffer to the file
+                self.__num_flushes += 1
+                self.__total_flush_time += append_time
+                self.__max_flush_time = max(self.__max_flush_time, append_time)
+            self.__queue.task_done()
+
+
+class WindSource(abc.ABC):
+    # Common interface of the wind readers: grid(), num_times(), get(idx) (the WindData for time slice idx), and close()
+    # crop(lon_min, lon_max, lat_min, lat_max) restricts grid() and get() to the window of the grid that bilinear interpolation needs
+    # for points within those bounds (see grid_window); only that part of each slice is decoded
+    # iter_slices() streams the slices in order; with prefetch > 0, a background thread reads up to prefetch slices ahead, so
+    # decoding slice N + 1 can overlap with whatever the caller does with slice N when a spare core is free; it saves at most the read
+    # time, and nothing on a single core. Off by default: the gain hasn't been measured on a multi-core node. get() is only ever
+    # called from one thread at a time.
+    @abc.abstractmethod
+    def grid(self):
+        pass
+
+    @abc.abstractmethod
+    def num_times(self):
+        pass
+
+    @abc.abstractmethod
+    def get(self, idx):
+        pass
+
+    @abc.abstractmethod
+    def crop(self, lon_min, lon_max, lat_min, lat_max):
+        pass
 
+    def close(self):
+        pass
+
+    def iter_slices(self, num_times=None, prefetch=0):
+        if num_times is None:
+            num_times = self.num_times()
+        if prefetch < 1:
+            for idx in range(num_times):
+                yield self.get(idx)
+            return
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        try:
+            pending = collections.deque()
+            next_idx = 0
+            for idx in range(num_times):
+                while next_idx < num_times and len(pending) <= prefetch:
+                    pending.append(executor.submit(self.get, next_idx))
+                    next_idx += 1
+                yield pending.popleft().result()
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    @staticmethod
+    def open(wfmt, filename, wind_inp_filename=None):
+        # The reader for a wind file in format wfmt (owi-ascii, owi-netcdf, or wnd, which also needs its Wind_Inp.txt)
+        if wfmt == "owi-ascii":
+            return OwiAsciiWind(filename=filename)
+        if wfmt == "owi-netcdf":
+            return OwiNetcdf(filename)
+        if wfmt == "wnd":
+            return WndWind(filename, WndWindInp(wind_inp_filename))
+        raise RuntimeError("Unsupported wind format: " + str(wfmt))
+
+
+def wind_slices(wind, wback=None, num_times=None, prefetch=0):
+    # Stream (input_wind, input_wback) pairs for each time slice; input_wback is None without a background source
+    # Each source prefetches on its own thread
+    if num_times is None:
+        num_times = wind.num_times()
+    if wback is None:
+        for input_wind in wind.iter_slices(num_times, prefetch):
+            yield input_wind, None
+    else:
+        yield from zip(wind.iter_slices(num_times, prefetch), wback.iter_slices(num_times, prefetch))
 
-class OwiAsciiWind:
-    def __init__(self, lines):
+
+class OwiAsciiWind(WindSource):
+    def __init__(self, lines=None, filename=None):
+        # Either hold the whole file as a list of lines or, if a filename is given, memory-map it and index the snapshot headers;
+        # in the latter case only the snapshot requested from get() is decoded, so memory use doesn't grow with forecast length
         self.__lines = lines
-        self.__grid = self.__get_grid()
-        self.__num_lats = self.__grid.n_latitude()
-        self.__num_lons = self.__grid.n_longitude()
+        self.__file = None
+        self.__mmap = None
+        if filename is not None:
+            self.__file = open(filename, 'rb')
+            self.__mmap = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.__header_offsets = self.__index_snapshot_headers()
+        self.__full_grid = self.__get_grid()
+        self.__grid = self.__full_grid
+        self.__num_lats = self.__full_grid.n_latitude()
+        self.__num_lons = self.__full_grid.n_longitude()
+        self.__block_lines = math.ceil((self.__num_lats * self.__num_lons) / 8)
+        self.__lat_window = slice(0, self.__num_lats)
+        self.__lon_window = slice(0, self.__num_lons)
 
     def grid(self):
         return self.__grid
 
+    def crop(self, lon_min, lon_max, lat_min, lat_max):
+        self.__lat_window, self.__lon_window, self.__grid = grid_window(self.__full_grid, lon_min, lon_max, lat_min, lat_max)
+
+    def __index_snapshot_headers(self):
+        # One pass over the file to record the byte offset of every "iLat=...DT=..." snapshot header line
+        offsets = []
+        pos = self.__mmap.find(b"iLat=")
+        while pos != -1:
+            if pos == 0 or self.__mmap[pos - 1:pos] == b"\n":
+                offsets.append(pos)
+            pos = self.__mmap.find(b"iLat=", pos + 1)
+        return offsets
+
+    def __file_header(self):
+        if self.__mmap is None:
+            return self.__lines[0]
+        return self.__mmap[0:self.__mmap.find(b"\n")].decode()
+
+    def __snapshot_header(self, idx):
+        if self.__mmap is None:
+            return self.__lines[1 + 2 * self.__block_lines * idx + idx]
+        start = self.__header_offsets[idx]
+        return self.__mmap[start:self.__mmap.find(b"\n", start)].decode()
+
+    def __snapshot_lines(self, idx):
+        # U block lines followed by V block lines for snapshot idx
+        if self.__mmap is None:
+            start = 2 + 2 * self.__block_lines * idx + idx
+            return self.__lines[start:start + 2 * self.__block_lines]
+        start = self.__mmap.find(b"\n", self.__header_offsets[idx]) + 1
+        end = self.__header_offsets[idx + 1] if idx + 1 < len(self.__header_offsets) else len(self.__mmap)
+        return self.__mmap[start:end].splitlines()
+
     def __get_grid(self):
-        num_lats = int(self.__lines[1][5:9])
-        num_lons = int(self.__lines[1][15:19])
-        lat_step = float(self.__lines[1][31:37])
-        lon_step = float(self.__lines[1][22:28])
-        sw_corner_lat = float(self.__lines[1][43:51])
-        sw_corner_lon = float(self.__lines[1][57:65])
+        header = self.__lines[1] if self.__mmap is None else self.__snapshot_header(0)
+        num_lats = int(header[5:9])
+        num_lons = int(header[15:19])
+        lat_step = float(header[31:37])
+        lon_step = float(header[22:28])
+        sw_corner_lat = float(header[43:51])
+        sw_corner_lon = float(header[57:65])
         lat = numpy.linspace(sw_corner_lat, sw_corner_lat + (num_lats - 1) * lat_step, num_lats)
         lon = numpy.linspace(sw_corner_lon, sw_corner_lon + (num_lons - 1) * lon_step, num_lons)
         return WindGrid(lon, lat)
 
     def num_times(self):
-        num_dt = 0
-        for i, line in enumerate(self.__lines):
-            if i == 0:
-                start_date = datetime.datetime.strptime(line[55:65], '%Y%m%d%H')
-                end_date = datetime.datetime.strptime(line[70:80], '%Y%m%d%H')
-            elif line[65:67] == 'DT' and num_dt == 0:
-                dt_1 = datetime.datetime.strptime(line[68:80], '%Y%m%d%H%M')
-                num_dt += 1
-            elif line[65:67] == 'DT' and num_dt == 1:
-                dt_2 = datetime.datetime.strptime(line[68:80], '%Y%m%d%H%M')
-                break
+        file_header = self.__file_header()
+        start_date = datetime.datetime.strptime(file_header[55:65], '%Y%m%d%H')
+        end_date = datetime.datetime.strptime(file_header[70:80], '%Y%m%d%H')
+        dt_1 = datetime.datetime.strptime(self.__snapshot_header(0)[68:80], '%Y%m%d%H%M')
+        dt_2 = datetime.datetime.strptime(self.__snapshot_header(1)[68:80], '%Y%m%d%H%M')
         time_step = dt_2 - dt_1
         return int((end_date - start_date) / time_step + 1)
 
     def get(self, idx):
-        win_idx_header_row = 1 + 2 * math.ceil((self.__num_lats * self.__num_lons) / 8) * idx + idx
-        date_str = self.__lines[win_idx_header_row][68:80]
+        date_str = self.__snapshot_header(idx)[68:80]
         idx_date = datetime.datetime(int(date_str[0:4]), int(date_str[4:6]), int(date_str[6:8]), int(date_str[8:10]), int(date_str[10:12]))
-        uvel = [[None for i in range(self.__num_lons)] for j in range(self.__num_lats)]
-        for i in range(self.__num_lats * self.__num_lons):
-            low_idx = 1 + 10 * (i % 8)
-            high_idx = 10 + 10 * (i % 8)
-            line_idx = win_idx_header_row + 1 + math.floor(i / 8)
-            lon_idx = i % self.__num_lons
-            lat_idx = math.floor(i / self.__num_lons)
-            uvel[lat_idx][lon_idx] = float(self.__lines[line_idx][low_idx:high_idx])
-        vvel = [[None for i in range(self.__num_lons)] for j in range(self.__num_lats)]
-        for i in range(self.__num_lats * self.__num_lons):
-            low_idx = 1 + 10 * (i % 8)
-            high_idx = 10 + 10 * (i % 8)
-            line_idx = win_idx_header_row + 1 + math.floor(i / 8) + math.ceil((self.__num_lats * self.__num_lons) / 8)
-            lon_idx = i % self.__num_lons
-            lat_idx = math.floor(i / self.__num_lons)
-            vvel[lat_idx][lon_idx] = float(self.__lines[line_idx][low_idx:high_idx])
+        snapshot_lines = self.__snapshot_lines(idx)
+        uvel = self.__decode_window(snapshot_lines[:self.__block_lines])
+        vvel = self.__decode_window(snapshot_lines[self.__block_lines:2 * self.__block_lines])
         return WindData(idx_date, self.__grid, uvel, vvel)
 
+    def __decode_window(self, block_lines):
+        # Decode only the lines holding the rows in the lat window (8 values per line), then keep the columns in the lon window
+        num_values = self.__num_lats * self.__num_lons
+        first = self.__lat_window.start * self.__num_lons
+        last = self.__lat_window.stop * self.__num_lons
+        first_line = first // 8
+        last_line = math.ceil(last / 8)
+        values = decode_fixed_width(block_lines[first_line:last_line], min(8 * last_line, num_values) - 8 * first_line)
+        rows = values[first - 8 * first_line:last - 8 * first_line].reshape(-1, self.__num_lons)
+        return rows[:, self.__lon_window]
 
-class OwiNetcdf:
+    def close(self):
+        if self.__mmap is not None:
+            self.__mmap.close()
+            self.__file.close()
+
+
+class OwiNetcdf(WindSource):
+    # Each get() reads one (lat, lon) hyperslab per component at the requested time, never the whole variable; after crop(), only
+    # the rows and columns in the window are read
     def __init__(self, filename):
         self.__nc = netCDF4.Dataset(filename, "r")
-        self.__grid = self.__get_grid()
+        self.__main = self.__nc["Main"]
+        self.__base_date = datetime.datetime(1990, 1, 1, 0, 0, 0)
+        self.__minutes = numpy.array(self.__main.variables["time"][:])
+        self.__lat_window = slice(None)
+        self.__lon_window = slice(None)
+        self.__full_grid = self.__get_grid()
+        self.__grid = self.__full_grid
 
     def grid(self):
         return self.__grid
 
     def __get_grid(self):
-        lon = self.__nc["Main"].variables["lon"][0, :]
-        lat = self.__nc["Main"].variables["lat"][:, 0]
+        lon = self.__main.variables["lon"][0, self.__lon_window]
+        lat = self.__main.variables["lat"][self.__lat_window, 0]
         return WindGrid(lon, lat)
 
+    def crop(self, lon_min, lon_max, lat_min, lat_max):
+        # From now on, read only the part of the grid bilinear interpolation needs for points within these bounds
+        self.__lat_window, self.__lon_window, _ = grid_window(self.__full_grid, lon_min, lon_max, lat_min, lat_max)
+        self.__grid = self.__get_grid()
+
     def num_times(self):
-        return self.__nc["Main"].variables["time"].size
+        return self.__minutes.size
 
     def get(self, idx):
-        base_date = datetime.datetime(1990, 1, 1, 0, 0, 0)
-        m_added = int(self.__nc["Main"].variables["time"][idx])
-        idx_date = base_date + datetime.timedelta(minutes=m_added)
-        uvel = self.__nc["Main"].variables["U10"][:][:][idx]
-        vvel = self.__nc["Main"].variables["V10"][:][:][idx]
+        idx_date = self.__base_date + datetime.timedelta(minutes=int(self.__minutes[idx]))
+        with netcdf_lock:
+            uvel = self.__main.variables["U10"][idx, self.__lat_window, self.__lon_window]
+            vvel = self.__main.variables["V10"][idx, self.__lat_window, self.__lon_window]
         return WindData(idx_date, self.__grid, uvel, vvel)
 
     def close(self):
@@ -376,9 +1055,12 @@ class WndWindInp:
         return start_time, time_step, num_times, spatial_res, s_lim, n_lim, w_lim, e_lim, num_lats, num_lons
 
 
-class WndWind:
-    def __init__(self, lines, wind_inp):
-        self.__lines = lines
+class WndWind(WindSource):
+    # Memory-maps the WND file, which holds num_lats * num_lons "u v" lines per time slice, starting in the NW corner and going row
+    # by row. When every line has the same length, slice idx starts at byte idx * num_lats * num_lons * line length and the rows in
+    # the lat window are decoded in one fixed-width pass; otherwise the line offsets are indexed once and the window's lines are
+    # parsed one by one as before.
+    def __init__(self, filename, wind_inp):
         self.__wind_inp = wind_inp
         self.__num_lats = self.__wind_inp.num_lats()
         self.__num_lons = self.__wind_inp.num_lons()
@@ -386,27 +1068,139 @@ class WndWind:
         self.__sw_corner_lon = self.__wind_inp.w_lim()
         self.__lat_step = self.__wind_inp.spatial_res()
         self.__lon_step = self.__wind_inp.spatial_res()
-        self.__grid = self.__get_grid()
+        self.__full_grid = self.__get_grid()
+        self.__grid = self.__full_grid
+        self.__lat_window = slice(0, self.__num_lats)
+        self.__lon_window = slice(0, self.__num_lons)
+        self.__file = open(filename, 'rb')
+        self.__mmap = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.__line_len = self.__mmap.find(b"\n") + 1
+        self.__line_starts = None
+        if self.__line_len < 20 or len(self.__mmap) % self.__line_len != 0 or len(self.__mmap) < self.num_times() * self.__num_lats * self.__num_lons * self.__line_len:
+            self.__index_lines()
 
     def grid(self):
         return self.__grid
 
+    def crop(self, lon_min, lon_max, lat_min, lat_max):
+        self.__lat_window, self.__lon_window, self.__grid = grid_window(self.__full_grid, lon_min, lon_max, lat_min, lat_max)
+
+    def num_times(self):
+        return self.__wind_inp.num_times()
+
     def __get_grid(self):
         lat = numpy.linspace(self.__sw_corner_lat, self.__sw_corner_lat + (self.__num_lats - 1) * self.__lat_step, self.__num_lats)
         lon = numpy.linspace(self.__sw_corner_lon, self.__sw_corner_lon + (self.__num_lons - 1) * self.__lon_step, self.__num_lons)
         return WindGrid(lon, lat)
 
+    def __index_lines(self):
+        # Byte offset of the start of every line, for files whose lines aren't all the same length
+        newlines = numpy.flatnonzero(numpy.frombuffer(self.__mmap, dtype=numpy.uint8) == ord("\n"))
+        self.__line_starts = numpy.concatenate(([0], newlines + 1))
+
+    def date(self, idx):
+        return self.__wind_inp.start_time() + datetime.timedelta(hours=idx * self.__wind_inp.time_step())
+
     def get(self, idx):
-        idx_date = self.__wind_inp.start_time() + datetime.timedelta(hours=idx * self.__wind_inp.time_step())
-        uvel = [[None for i in range(self.__num_lons)] for j in range(self.__num_lats)]
-        vvel = [[None for i in range(self.__num_lons)] for j in range(self.__num_lats)]
-        for i in range(self.__num_lats * self.__num_lons):
-            line_idx = self.__num_lats * self.__num_lons * idx + i
-            lon_idx = i % self.__num_lons
-            lat_idx = self.__num_lats - math.floor(i / self.__num_lons) - 1  # WND starts in the NW corner and goes row by row
-            uvel[lat_idx][lon_idx] = float(self.__lines[line_idx][0:9])
-            vvel[lat_idx][lon_idx] = float(self.__lines[line_idx][10:19])
-        return WindData(idx_date, self.__grid, uvel, vvel)
+        # File rows num_lats - stop to num_lats - start hold the lat window (last row first), so they're decoded and then flipped
+        first_row = self.__num_lats - self.__lat_window.stop
+        num_rows = self.__lat_window.stop - self.__lat_window.start
+        first_line = self.__num_lats * self.__num_lons * idx + first_row * self.__num_lons
+        uvel = vvel = None
+        if self.__line_starts is None:
+            lines = numpy.frombuffer(self.__mmap, dtype=numpy.uint8, count=num_rows * self.__num_lons * self.__line_len,
+                                     offset=first_line * self.__line_len).reshape(num_rows, self.__num_lons, self.__line_len)[:, self.__lon_window]
+            if numpy.all(lines[:, :, -1] == ord("\n")):
+                uvel = WndWind.__decode_field(lines[:, :, 0:9])
+                vvel = WndWind.__decode_field(lines[:, :, 10:19])
+            else:
+                self.__index_lines()  # The lines aren't all the same length after all
+        if uvel is None:
+            uvel = numpy.empty((num_rows, self.__lon_window.stop - self.__lon_window.start))
+            vvel = numpy.empty(uvel.shape)
+            for j in range(num_rows):
+                for i, lon_idx in enumerate(range(self.__lon_window.start, self.__lon_window.stop)):
+                    line_start = self.__line_starts[first_line + j * self.__num_lons + lon_idx]
+                    line = self.__mmap[line_start:line_start + 19]
+                    uvel[j, i] = float(line[0:9])
+                    vvel[j, i] = float(line[10:19])
+        return WindData(self.date(idx), self.__grid, numpy.flipud(uvel), numpy.flipud(vvel))
+
+    @staticmethod
+    def __decode_field(chars):
+        # (rows, cols, width) characters of one fixed-width field per line to values, matching float() on each field
+        rows, cols, width = chars.shape
+        chars = numpy.ascontiguousarray(chars).reshape(rows * cols, width)
+        values = decode_fixed_point(chars)
+        if values is None:
+            values = chars.view("S" + str(width)).reshape(-1).astype(numpy.float64)
+        return values.reshape(rows, cols)
+
+    def close(self):
+        self.__mmap.close()
+        self.__file.close()
+
+
+def axis_window(axis, lower, upper):
+    # The slice of an ascending axis covering [lower, upper] plus the point on either side (where there is one), so bilinear
+    # interpolation to any point in the range gives the same result from the window as from the whole axis
+    start = max(0, numpy.searchsorted(axis, lower, side='right') - 1)
+    stop = min(len(axis), numpy.searchsorted(axis, upper, side='left') + 1)
+    if stop - start < 2:  # Grids need at least two points along each axis
+        start = max(0, min(start, len(axis) - 2))
+        stop = min(len(axis), start + 2)
+    return slice(int(start), int(stop))
+
+
+def grid_window(grid, lon_min, lon_max, lat_min, lat_max):
+    # (lat slice, lon slice) of grid covering the bounds plus the point on either side, and the WindGrid of that window
+    lat_window = axis_window(grid.lat1d(), lat_min, lat_max)
+    lon_window = axis_window(grid.lon1d(), lon_min, lon_max)
+    return lat_window, lon_window, WindGrid(grid.lon1d()[lon_window], grid.lat1d()[lat_window])
+
+
+def decode_fixed_width(lines, num_values, values_per_line=8, field_width=10, value_start=1):
+    # Decode a block of lines (str or bytes) of fixed-width numeric fields (e.g. one OWI U or V block) in a single vectorized pass
+    # Characters [value_start:field_width] of each field are parsed, matching float(line[low_idx:high_idx]) on each field
+    text = "".join(lines).encode() if isinstance(lines[0], str) else b"".join(lines)
+    fields = text.replace(b"\r", b"").replace(b"\n", b"")
+    if len(fields) != num_values * field_width:
+        # Lines aren't packed edge to edge (e.g. trailing whitespace was trimmed), so pad every line to full width first
+        fields = b"".join(line.ljust(values_per_line * field_width) for line in text.splitlines())
+    chars = numpy.frombuffer(fields, dtype=numpy.uint8, count=num_values * field_width).reshape(num_values, field_width)[:, value_start:]
+    values = decode_fixed_point(chars)
+    if values is None:
+        layout = numpy.dtype([("pad", "S" + str(value_start)), ("value", "S" + str(field_width - value_start))])
+        values = numpy.frombuffer(fields, dtype=layout, count=num_values)["value"].astype(numpy.float64)
+    return values
+
+
+def decode_fixed_point(chars):
+    # Fast path for fields written with a fixed number of decimals (e.g. %10.4f): each row of chars is one field
+    # The value is the integer formed by its digits divided by 10**decimals, which rounds exactly like float() does
+    # Returns None if any field doesn't fit that pattern, in which case the caller falls back to a generic parse
+    point_col = numpy.flatnonzero(chars[0] == ord("."))
+    if point_col.size != 1 or point_col[0] == chars.shape[1] - 1 or not numpy.all(chars[:, point_col[0]] == ord(".")):
+        return None
+    point_col = point_col[0]
+    columns = numpy.ascontiguousarray(chars.T)
+    integer = numpy.zeros(columns.shape[1])
+    started = numpy.zeros(columns.shape[1], dtype=bool)
+    negative = numpy.zeros(columns.shape[1], dtype=bool)
+    for col in range(columns.shape[0]):
+        if col == point_col:
+            started[:] = True
+            continue
+        digit = columns[col] - numpy.uint8(ord("0"))  # wraps to > 9 for anything that isn't a digit
+        is_digit = digit <= 9
+        is_minus = (columns[col] == ord("-")) & ~started
+        started |= columns[col] != ord(" ")
+        if not numpy.all(is_digit | is_minus | ~started) or (col > point_col and not numpy.all(is_digit)):
+            return None
+        negative |= is_minus
+        integer = integer * 10 + numpy.where(is_digit, digit, 0)
+    values = integer / 10.0**(columns.shape[0] - 1 - point_col)
+    return numpy.where(negative, -values, values)
 
 
 def dir_met_to_and_from_math(direction):
@@ -417,7 +1211,9 @@ def direction_from_uv(u_vel, v_vel):
     with numpy.errstate(divide="ignore"):  # Don't warn for divide by 0
         dir_math = numpy.rad2deg(numpy.arctan(numpy.divide(v_vel, u_vel)))
     # arctan only returns values from -pi/2 to pi/2. We need values from 0 to 2*pi.
-    dir_math[u_vel < 0] = dir_math[u_vel < 0] + 180  # Quadrants 2 & 3
+    # Test the sign bit rather than u_vel < 0: v / -0.0 has the opposite sign to v / 0.0, so u = -0.0 is on the quadrant 2 & 3 side
+    west = numpy.signbit(u_vel)
+    dir_math[west] = dir_math[west] + 180  # Quadrants 2 & 3
     dir_math[dir_math < 0] = dir_math[dir_math < 0] + 360  # Quadrant 4
     return dir_math
 
@@ -431,25 +1227,176 @@ def angle_diff(deg1, deg2):
     return abs((delta + 180) % 360 - 180)
 
 
-def generate_directional_z0_interpolant(lon_grid, lat_grid, z0_hr_hr_grid, sigma, radius):
+def directional_lookup(cube, direction):
+    # Linear interpolation between direction bins of a directional cube (the last axis; equally spaced bins from 0 to 360 degrees)
+    # at one direction per cell; cube has the shape of direction plus that last axis. NaN directions (calm wind, which scales to
+    # zero whatever z0 is) are treated as 0 degrees so the scaling factors stay finite.
+    # The cell's own bins are gathered by flat index, so a memory-mapped cube only reads the two bins used from each cell.
+    n_bins = cube.shape[-1]
+    position = numpy.nan_to_num(direction * ((n_bins - 1) / 360))
+    lower = numpy.clip(numpy.floor(position).astype(numpy.intp), 0, n_bins - 2)
+    weight = numpy.subtract(position, lower, dtype=position.dtype)  # Keeps float32 directions float32
+    index = lower + numpy.arange(0, lower.size * n_bins, n_bins).reshape(lower.shape)
+    values = cube.reshape(-1)
+    return values[index] * (1 - weight) + values[index + 1] * weight
+
+
+def generate_water_fraction(lon_grid, lat_grid, z0_hr_hr_grid, water_z0_max, sigma, radius, workers=1):
+    # The cone averaging used for directional z0, applied to a water mask, gives the weighted fraction of each cone that is water
+    # Returns the (n_lat x n_lon x 13) fraction cube as float32 and the mean z0 of the water cells
+    water = z0_hr_hr_grid <= water_z0_max
+    if not water.any():
+        return None, None
+    fraction = generate_directional_z0_interpolant(lon_grid, lat_grid, water.astype(numpy.float64), sigma, radius, "fft", workers).z0_directional()
+    fraction[fraction < 1e-6] = 0  # Round-off from the FFT, far from any water
+    return numpy.clip(fraction, 0, 1).astype(numpy.float32), float(z0_hr_hr_grid[water].mean())
+
+
+def load_or_generate_water_fraction(filename, lon_grid, lat_grid, z0_hr_hr_grid, water_z0_max, sigma, radius, roughness_hash, workers=1):
+    # generate_water_fraction, cached as <filename>.npy plus a <filename>.json header (written like a DirectionalZ0) and reused while
+    # the header's roughness hash, water_z0_max, sigma, and radius match; the cube is memory-mapped read-only when it's reused
+    header = {"format": "richamp-water-fraction", "version": 1, "roughness_sha256": roughness_hash, "water_z0_max": water_z0_max,
+              "sigma": sigma, "radius": radius}
+    water = z0_hr_hr_grid <= water_z0_max
+    if not water.any():
+        return None, None
+    if os.path.exists(filename + '.json'):
+        with open(filename + '.json', 'r') as file:
+            cached = json.load(file) == header
+        if cached:
+            water_fraction = numpy.load(filename + '.npy', mmap_mode='r')
+            if water_fraction.shape[0:2] == z0_hr_hr_grid.shape:
+                print("INFO: Loading directional water fraction for dynamic water z0...", flush=True)
+                return water_fraction, float(z0_hr_hr_grid[water].mean())
+    print("INFO: Generating directional water fraction for dynamic water z0...", flush=True)
+    water_fraction, water_z0_constant = generate_water_fraction(lon_grid, lat_grid, z0_hr_hr_grid, water_z0_max, sigma, radius, workers)
+    with open(filename + '.npy.tmp', 'wb') as file:
+        numpy.save(file, water_fraction)
+    os.replace(filename + '.npy.tmp', filename + '.npy')
+    with open(filename + '.json.tmp', 'w') as file:
+        json.dump(header, file)
+    os.replace(filename + '.json.tmp', filename + '.json')
+    return water_fraction, water_z0_constant
+
+
+def generate_directional_z0_interpolant(lon_grid, lat_grid, z0_hr_hr_grid, sigma, radius, engine="fft", workers=1):
     # Generate a defined number of circular sectors ("cones") around each point in the RICHAMP grid
     # Use a Gaussian decay function to calculate a weighted z0 value for each cone based on the discrete z0 values within the cone
     # Use the same weighting function as John Ratcliff & Rick Luettich
+    # engine selects how the cone averages are computed: "fft" (normalized 2-D correlation; fast) or "loop" (cell by cell; slow reference)
+    # The domain is processed in row tiles, in parallel if workers > 1; the tiling doesn't depend on workers, so neither does the result
+    cone_ctr_angle = numpy.linspace(0, 360, 13)
+    weight, in_cone_if_in_grid = directional_z0_kernels(lon_grid, lat_grid, sigma, radius, cone_ctr_angle)
+    z0_directional = directional_z0_tiles(numpy.asarray(z0_hr_hr_grid, dtype=numpy.float64), weight, in_cone_if_in_grid, engine, workers)
+    z0_directional[:, :, -1] = z0_directional[:, :, 0]  # 360 degrees and 0 degrees are the same
+    return DirectionalZ0(lat_grid[:, 0], lon_grid[0, :], cone_ctr_angle, z0_directional, sigma, radius)
+
+
+def directional_z0_tiles(z0_hr_hr_grid, weight, in_cone_if_in_grid, engine, workers):
+    # Split the domain into row tiles; each tile is computed from its rows plus n_fwd_back halo rows on either side, which is
+    # everything its cones can reach, and written straight into the output cube
+    n_lat, n_lon = z0_hr_hr_grid.shape
+    full_end, _, n_z0 = in_cone_if_in_grid.shape
+    tile_rows = max(128, 2 * full_end)  # Keeps the halo small relative to the tile
+    tiles = [(start, min(n_lat, start + tile_rows)) for start in range(0, n_lat, tile_rows)]
+    if workers <= 1:
+        z0_directional = numpy.zeros((n_lat, n_lon, n_z0 + 1))
+        for tile_number, (start, end) in enumerate(tiles):
+            directional_z0_tile(z0_hr_hr_grid, z0_directional, weight, in_cone_if_in_grid, engine, start, end)
+            print("INFO: Interpolant generation {:d}% complete (tile {:d} of {:d})".format(
+                math.floor(100 * (tile_number + 1) / len(tiles)), tile_number + 1, len(tiles)), flush=True)
+        return z0_directional
+    shared_z0 = SharedArray.copy_of(z0_hr_hr_grid)
+    shared_z0_directional = SharedArray((n_lat, n_lon, n_z0 + 1), numpy.float64)
+    try:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=directional_z0_worker_init,
+                                                    initargs=(shared_z0.spec(), shared_z0_directional.spec(), weight, in_cone_if_in_grid, engine)) as executor:
+            futures = [executor.submit(directional_z0_worker_tile, start, end) for start, end in tiles]
+            for tile_number, future in enumerate(concurrent.futures.as_completed(futures)):
+                start, end = future.result()
+                print("INFO: Interpolant generation {:d}% complete (tile {:d} of {:d}; rows {:d}-{:d})".format(
+                    math.floor(100 * (tile_number + 1) / len(tiles)), tile_number + 1, len(tiles), start, end - 1), flush=True)
+        z0_directional = shared_z0_directional.array().copy()
+    finally:
+        shared_z0.close()
+        shared_z0_directional.close()
+    return z0_directional
+
+
+def directional_z0_tile(z0_hr_hr_grid, z0_directional, weight, in_cone_if_in_grid, engine, start, end):
+    z0_directional[start:end, :, :] = directional_z0_window(z0_hr_hr_grid, weight, in_cone_if_in_grid, engine, start, end, 0, z0_hr_hr_grid.shape[1])
+
+
+def directional_z0_window(z0_hr_hr_grid, weight, in_cone_if_in_grid, engine, row_start, row_end, col_start, col_end):
+    # z0 for every cone at rows row_start:row_end and columns col_start:col_end, computed from that window plus an
+    # n_fwd_back halo on every side, which is everything its cones can reach
+    n_fwd_back = (in_cone_if_in_grid.shape[0] - 1) // 2
+    halo_row_start = max(0, row_start - n_fwd_back)
+    halo_row_end = min(z0_hr_hr_grid.shape[0], row_end + n_fwd_back)
+    halo_col_start = max(0, col_start - n_fwd_back)
+    halo_col_end = min(z0_hr_hr_grid.shape[1], col_end + n_fwd_back)
+    z0_halo = z0_hr_hr_grid[halo_row_start:halo_row_end, halo_col_start:halo_col_end]
+    if engine == "loop":
+        z0_window = directional_z0_loop(z0_halo, weight, in_cone_if_in_grid)
+    else:
+        z0_window = directional_z0_fft(z0_halo, weight, in_cone_if_in_grid)
+    return z0_window[row_start - halo_row_start:row_end - halo_row_start, col_start - halo_col_start:col_end - halo_col_start, :]
+
+
+def update_directional_z0_interpolant(z0_directional, lon_grid, lat_grid, old_z0_hr_hr_grid, new_z0_hr_hr_grid, engine="fft"):
+    # Refresh an existing directional z0 cube after edits to the roughness grid: cells whose cones can reach a changed cell
+    # (the changed cells dilated by the sector radius) are regenerated, one bounding box per connected affected region
+    weight, in_cone_if_in_grid = directional_z0_kernels(lon_grid, lat_grid, z0_directional.sigma(), z0_directional.radius(), z0_directional.angle())
+    full_end = in_cone_if_in_grid.shape[0]
+    z0_updated = numpy.array(z0_directional.z0_directional())  # Copy, since a loaded cube is a read-only memory map
+    changed = old_z0_hr_hr_grid != new_z0_hr_hr_grid
+    affected = scipy.ndimage.maximum_filter(changed.astype(numpy.uint8), size=full_end, mode='constant') > 0
+    regions, n_regions = scipy.ndimage.label(affected)
+    print("INFO: {:d} roughness cells changed; regenerating {:d} of {:d} directional z0 cells in {:d} region(s)".format(
+        int(changed.sum()), int(affected.sum()), affected.size, n_regions), flush=True)
+    new_z0_hr_hr_grid = numpy.asarray(new_z0_hr_hr_grid, dtype=numpy.float64)
+    for region_number, (rows, cols) in enumerate(scipy.ndimage.find_objects(regions)):
+        z0_window = directional_z0_window(new_z0_hr_hr_grid, weight, in_cone_if_in_grid, engine, rows.start, rows.stop, cols.start, cols.stop)
+        in_region = regions[rows, cols] == region_number + 1
+        z0_updated[rows, cols, :-1][in_region] = z0_window[:, :, :-1][in_region]
+        print("INFO: Interpolant update {:d}% complete (region {:d} of {:d})".format(
+            math.floor(100 * (region_number + 1) / n_regions), region_number + 1, n_regions), flush=True)
+    z0_updated[:, :, -1] = z0_updated[:, :, 0]  # 360 degrees and 0 degrees are the same
+    return DirectionalZ0(z0_directional.lat(), z0_directional.lon(), z0_directional.angle(), z0_updated,
+                         z0_directional.sigma(), z0_directional.radius())
+
+
+def directional_z0_worker_init(z0_spec, z0_directional_spec, weight, in_cone_if_in_grid, engine):
+    # Runs once in each worker process; attaches to the shared roughness and output cube
+    worker_state["z0"] = SharedArray.attach(z0_spec)
+    worker_state["z0_directional"] = SharedArray.attach(z0_directional_spec)
+    worker_state["weight"] = weight
+    worker_state["in_cone_if_in_grid"] = in_cone_if_in_grid
+    worker_state["engine"] = engine
+
+
+def directional_z0_worker_tile(start, end):
+    directional_z0_tile(worker_state["z0"].array(), worker_state["z0_directional"].array(), worker_state["weight"],
+                        worker_state["in_cone_if_in_grid"], worker_state["engine"], start, end)
+    return start, end
+
+
+def directional_z0_kernels(lon_grid, lat_grid, sigma, radius, cone_ctr_angle):
+    # Gaussian weight and per-cone membership of every point within n_fwd_back cells of a point of interest
+    # Both are calculated once at the center of the domain and applied everywhere
     overall_mid_lat = (lat_grid[0, 0] + lat_grid[-1, 0]) / 2  # degrees N
     overall_mid_lon = (lon_grid[0, 0] + lon_grid[0, -1]) / 2  # degrees E
     cone_width = 30  # degrees
     half_cone_width = cone_width / 2
-    cone_ctr_angle = numpy.linspace(0, 360, 13)
     wgs84_geod = pyproj.Geod(ellps='WGS84')
     _, _, approx_grid_resolution = wgs84_geod.inv(lon_grid[0, 0], lat_grid[0, 0], lon_grid[0, 0],
                                                   lat_grid[1, 0])  # assumes same resolution in lat and lon
     _, _, one_deg_lon = wgs84_geod.inv(overall_mid_lon - 0.5, overall_mid_lat, overall_mid_lon + 0.5, overall_mid_lat)
     _, _, one_deg_lat = wgs84_geod.inv(overall_mid_lon, overall_mid_lat - 0.5, overall_mid_lon, overall_mid_lat + 0.5)
     n_fwd_back = math.ceil(radius / approx_grid_resolution)
-    n_lat = len(z0_hr_hr_grid)
-    n_lon = len(z0_hr_hr_grid[0])
+    n_lat = len(lat_grid)
+    n_lon = len(lat_grid[0])
     n_z0 = len(cone_ctr_angle) - 1  # A row for 360 degrees exists to allow interpolation between 330 and 0, but we don't calculate z0 for it
-    z0_directional = numpy.zeros((n_lat, n_lon, n_z0 + 1))
     # Pre-calculate distance and angle for points that could be in_cone
     mid_lon = math.ceil(n_lon / 2)
     mid_lat = math.ceil(n_lat / 2)
@@ -461,21 +1408,46 @@ def generate_directional_z0_interpolant(lon_grid, lat_grid, z0_hr_hr_grid, sigma
     _, _, distance = wgs84_geod.inv(numpy.zeros((full_end, full_end)) + lon_grid[mid_lat, mid_lon], numpy.zeros((full_end, full_end)) + lat_grid[mid_lat, mid_lon],
                                     lon_grid[lat_start:lat_end, lon_start:lon_end], lat_grid[lat_start:lat_end, lon_start:lon_end])
     weight = numpy.exp(-distance**2 / (2 * sigma**2))
-    direction = direction_from_uv(one_deg_lon * (lon_grid[mid_lat, mid_lon] - lon_grid[lat_start:lat_end, lon_start:lon_end]),
-                                  one_deg_lat * (lat_grid[mid_lat, mid_lon] - lat_grid[lat_start:lat_end, lon_start:lon_end]))
+    with numpy.errstate(invalid="ignore"):  # The point of interest itself has no direction
+        direction = direction_from_uv(one_deg_lon * (lon_grid[mid_lat, mid_lon] - lon_grid[lat_start:lat_end, lon_start:lon_end]),
+                                      one_deg_lat * (lat_grid[mid_lat, mid_lon] - lat_grid[lat_start:lat_end, lon_start:lon_end]))
     in_cone_if_in_grid = numpy.zeros((full_end, full_end, n_z0), dtype=bool)
-    full_cone_weight = numpy.zeros((n_z0))
     for k in range(n_z0):
         in_cone_if_in_grid[:, :, k] = numpy.logical_and(distance <= radius, angle_diff(direction, cone_ctr_angle[k]) <= half_cone_width)
         in_cone_if_in_grid[n_fwd_back, n_fwd_back, k] = True  # the point of interest must be in every cone
+    return weight, in_cone_if_in_grid
+
+
+def directional_z0_fft(z0_hr_hr_grid, weight, in_cone_if_in_grid):
+    # Each cone is the same fixed kernel (weight * in_cone) everywhere, so z0 for a cone is a normalized 2-D correlation:
+    # correlate z0 with the kernel, then divide by the same kernel correlated with a mask of ones, which drops the part of the
+    # cone that falls outside the domain near the edges. Correlations are done as zero-padded FFT products.
+    n_lat, n_lon = z0_hr_hr_grid.shape
+    full_end, _, n_z0 = in_cone_if_in_grid.shape
+    n_fwd_back = (full_end - 1) // 2
+    fft_shape = (scipy.fft.next_fast_len(n_lat + full_end - 1), scipy.fft.next_fast_len(n_lon + full_end - 1, real=True))
+    z0_fft = scipy.fft.rfft2(z0_hr_hr_grid, fft_shape)
+    in_grid_fft = scipy.fft.rfft2(numpy.ones((n_lat, n_lon)), fft_shape)
+    z0_directional = numpy.zeros((n_lat, n_lon, n_z0 + 1))
+    for k in range(n_z0):
+        kernel_fft = scipy.fft.rfft2((weight * in_cone_if_in_grid[:, :, k])[::-1, ::-1], fft_shape)  # Correlation is convolution with the flipped kernel
+        weighted_z0 = scipy.fft.irfft2(z0_fft * kernel_fft, fft_shape)[n_fwd_back:n_fwd_back + n_lat, n_fwd_back:n_fwd_back + n_lon]
+        cone_weight = scipy.fft.irfft2(in_grid_fft * kernel_fft, fft_shape)[n_fwd_back:n_fwd_back + n_lat, n_fwd_back:n_fwd_back + n_lon]
+        z0_directional[:, :, k] = weighted_z0 / cone_weight
+    return z0_directional
+
+
+def directional_z0_loop(z0_hr_hr_grid, weight, in_cone_if_in_grid):
+    # Reference implementation of directional_z0_fft that sums each cone at each point directly; this will take a while
+    n_lat, n_lon = z0_hr_hr_grid.shape
+    full_end, _, n_z0 = in_cone_if_in_grid.shape
+    n_fwd_back = (full_end - 1) // 2
+    z0_directional = numpy.zeros((n_lat, n_lon, n_z0 + 1))
+    full_cone_weight = numpy.zeros((n_z0))
+    for k in range(n_z0):
         full_cone_weight[k] = sum(weight[in_cone_if_in_grid[:, :, k]])
     # Calculate z0 for each cone at each point
-    old_pct_complete = 0
     for i in range(n_lat):
-        pct_complete = math.floor(100 * (i / n_lat))
-        if pct_complete != old_pct_complete:
-            print("INFO: Interpolant generation " + str(pct_complete) + "% complete", flush=True)
-            old_pct_complete = pct_complete
         local_lat_start = max(0, n_fwd_back - i)
         local_lat_end = full_end - max(0, n_fwd_back + i + 1 - n_lat)
         lat_start = max(0, i - n_fwd_back)
@@ -495,188 +1467,212 @@ def generate_directional_z0_interpolant(lon_grid, lat_grid, z0_hr_hr_grid, sigma
                 for k in range(n_z0):
                     z0_directional[i, j, k] = sum(weight[in_cone_if_in_grid[:, :, k]] * z0_hr_hr_grid[lat_start:lat_end,
                                                   lon_start:lon_end][in_cone_if_in_grid[:, :, k]]) / full_cone_weight[k]
-    z0_directional[:, :, n_z0] = z0_directional[:, :, 0]  # 360 degrees and 0 degrees are the same
-    # Create interpolant
-    z0_directional_interpolant = scipy.interpolate.RegularGridInterpolator(
-        (lat_grid[:, 0], lon_grid[0, :], cone_ctr_angle), z0_directional, method='linear')
-    print("INFO: Interpolant generation 100% complete", flush=True)
-    return z0_directional_interpolant
+    return z0_directional
 
 
 def roughness_adjust(subd_inputs):
     # NOTE: Past versions of this function derived z0 from wind stress over water
-    # That is not feasible performance-wise while also calculating directional z0, so that functionality has been removed
-    # Constant z0 values directly from the appropriate roughness file are now used over water
-    input_wind, input_wback, wfmt, wbackfmt, z0_wr, z0_wbackr, z0_hr, z0_directional_interpolant, sl, \
-        lon_ctr_interpolant, lat_ctr_interpolant, rmw_interpolant, time_ctr_date_0, time_rmw_date_0 = subd_inputs
-    if (wfmt == "owi-ascii") | (wfmt == "owi-netcdf"):
-        z0_wr_w_grid = z0_to_wind_res(z0_wr, input_wind)
-    elif wfmt == "wnd":
-        z0_wr_w_grid = z0_wr
-    if sl == "adcirc":
-        # Interpolate z0_wr to z0_hr resolution and blend if necessary
+    # That was not feasible performance-wise while also calculating directional z0, so by default (waterz0 constant), constant z0
+    # values directly from the appropriate roughness file are used over water; with waterz0 dynamic, the context swaps the water
+    # part of the directional z0 for z0 derived from the wind over the cells whose cones reach water
+    context, input_wind, input_wback = subd_inputs
+    if context.scale_logic() == "adcirc":
+        # Blend if necessary; z0_wr is interpolated to z0_hr resolution in the context
         if input_wback is not None:
             # Scale input_wback to same roughness as input_wind, then blend
             input_wback_w_grid = wind_to_wind_res(input_wback, input_wind)
-            z0_wbackr_w_grid = z0_to_wind_res(z0_wbackr, input_wind)
-            input_wback_scaled = adcirc_scaling(input_wback_w_grid, z0_wbackr_w_grid.land_rough(), z0_wr_w_grid.land_rough())
-            wind_w_grid = blend(input_wind, input_wback_scaled, lon_ctr_interpolant,
-                                lat_ctr_interpolant, rmw_interpolant, time_ctr_date_0, time_rmw_date_0)
+            input_wback_scaled = scale_wind(input_wback_w_grid, context.wback_factor())
+            wind_w_grid = context.blend(input_wind, input_wback_scaled)
         else:
             wind_w_grid = input_wind
-        z0_wr_hr_grid = z0_to_z0_res(z0_wr_w_grid, z0_hr)
-    elif sl == "up-down":
+    elif context.scale_logic() == "up-down":
         # Scale up to z_ref and blend if necessary
-        input_wind_z_ref = ten_to_zref(z0_wr_w_grid.land_rough(), input_wind)
+        input_wind_z_ref = scale_wind(input_wind, context.wind_factor())
         if input_wback is not None:
-            z0_wbackr_wback_grid = z0_to_wind_res(z0_wbackr, input_wback)
-            input_wback_z_ref = ten_to_zref(z0_wbackr_wback_grid.land_rough(), input_wback)
+            input_wback_z_ref = scale_wind(input_wback, context.wback_factor())
             input_wback_z_ref_w_grid = wind_to_wind_res(input_wback_z_ref, input_wind)
-            wind_w_grid = blend(input_wind_z_ref, input_wback_z_ref_w_grid, lon_ctr_interpolant,
-                                lat_ctr_interpolant, rmw_interpolant, time_ctr_date_0, time_rmw_date_0)
+            wind_w_grid = context.blend(input_wind_z_ref, input_wback_z_ref_w_grid)
         else:
             wind_w_grid = input_wind_z_ref
     # Determine z0 based on wind direction, then scale wind with directional z0
-    z0_hr_grid = WindGrid(z0_hr.lon(), z0_hr.lat())
-    wind_hr_grid = wind_to_z0_res(wind_w_grid, z0_hr)
+    wind_hr_grid = context.wind_to_hr_grid(wind_w_grid)
     dir_hr_grid = direction_from_uv(wind_hr_grid.u_velocity(), wind_hr_grid.v_velocity())
-    z0_hr_directional = z0_directional_interpolant((z0_hr_grid.lat(), z0_hr_grid.lon(), dir_hr_grid))
-    if sl == "adcirc":
-        wind_out = adcirc_scaling(wind_hr_grid, z0_wr_hr_grid.land_rough(), z0_hr_directional)
-    elif sl == "up-down":
-        wind_out = zref_to_ten(z0_hr_directional, wind_hr_grid)
-    return wind_out
+    z0_hr_directional = context.apply_water_z0(context.z0_directional(dir_hr_grid), wind_hr_grid, dir_hr_grid)
+    return scale_wind(wind_hr_grid, context.hr_factor(z0_hr_directional))
+
+
+def roughness_adjust_worker_init(scale_logic, wind_grid, z0_wr_w_grid, hr_lon, hr_lat, z0_hr_spec, z0_directional_source,
+                                 subd_start_index, subd_end_index, wback_grid, z0_wbackr, storm_track, water_source=None, dtype=numpy.float64):
+    # Runs once in each worker process when executor is process; attaches to the shared high-res roughness and to the directional
+    # z0 cube, which is either memory-mapped from its file (z0_directional_source is the file name) or in shared memory
+    # (z0_directional_source is (lat, lon, angle, spec)). Scaling contexts are built the first time a worker gets each subdomain.
+    # With waterz0 dynamic, water_source is (spec of the shared water fraction cube, constant water z0).
+    worker_state["z0_hr"] = SharedArray.attach(z0_hr_spec)
+    worker_state["water_fraction"] = None
+    worker_state["water_z0_constant"] = None
+    if water_source is not None:
+        worker_state["water_fraction_shared"] = SharedArray.attach(water_source[0])
+        worker_state["water_fraction"] = worker_state["water_fraction_shared"].array()
+        worker_state["water_z0_constant"] = water_source[1]
+    if isinstance(z0_directional_source, str):
+        worker_state["z0_directional"] = DirectionalZ0.load(z0_directional_source)
+    else:
+        lat, lon, angle, z0_directional_spec = z0_directional_source
+        worker_state["z0_directional_shared"] = SharedArray.attach(z0_directional_spec)
+        worker_state["z0_directional"] = DirectionalZ0(lat, lon, angle, worker_state["z0_directional_shared"].array())
+    worker_state["context_args"] = (scale_logic, wind_grid, z0_wr_w_grid, hr_lon, hr_lat, subd_start_index, subd_end_index, wback_grid, z0_wbackr, storm_track, dtype)
+    worker_state["contexts"] = {}
 
 
-def adcirc_scaling(wind_inp, z0_inp, z0_tgt):
-    # NOTE: This function assumes all inputs have the same spatial resolution
-    u_scaled = wind_inp.u_velocity() * (z0_tgt / z0_inp)**0.0706 * numpy.log(10 / z0_tgt) / numpy.log(10 / z0_inp)
-    v_scaled = wind_inp.v_velocity() * (z0_tgt / z0_inp)**0.0706 * numpy.log(10 / z0_tgt) / numpy.log(10 / z0_inp)
-    return WindData(wind_inp.date(), wind_inp.wind_grid(), u_scaled, v_scaled)
+def roughness_adjust_worker(subd_index, input_wind, input_wback):
+    context = worker_state["contexts"].get(subd_index)
+    if context is None:
+        scale_logic, wind_grid, z0_wr_w_grid, hr_lon, hr_lat, subd_start_index, subd_end_index, wback_grid, z0_wbackr, storm_track, dtype = worker_state["context_args"]
+        start, end = subd_start_index[subd_index], subd_end_index[subd_index]
+        subd_z0_hr = Roughness(hr_lon, hr_lat[start:end], worker_state["z0_hr"].array()[start:end, :])
+        water_fraction = worker_state["water_fraction"][start:end] if worker_state["water_fraction"] is not None else None
+        context = ScalingContext(scale_logic, wind_grid, z0_wr_w_grid, subd_z0_hr, worker_state["z0_directional"].subset(start, end),
+                                 wback_grid, z0_wbackr, storm_track, water_fraction, worker_state["water_z0_constant"], dtype)
+        worker_state["contexts"][subd_index] = context
+    wind_out = roughness_adjust([context, input_wind, input_wback])
+    return WindData(wind_out.date(), None, wind_out.u_velocity(), wind_out.v_velocity())  # The parent only needs the values, not the grid
 
 
-def wind_to_wind_res(wind_inp, wind_tgt):
-    # Interpolate a WindData object to the spatial resolution of another WindData object
-    u_interp = scipy.interpolate.RectBivariateSpline(wind_inp.wind_grid().lat1d(), wind_inp.wind_grid().lon1d(), wind_inp.u_velocity(), kx=1, ky=1)
-    u_wind_tgt_res = u_interp(wind_tgt.wind_grid().lat1d(), wind_tgt.wind_grid().lon1d())
-    v_interp = scipy.interpolate.RectBivariateSpline(wind_inp.wind_grid().lat1d(), wind_inp.wind_grid().lon1d(), wind_inp.v_velocity(), kx=1, ky=1)
-    v_wind_tgt_res = v_interp(wind_tgt.wind_grid().lat1d(), wind_tgt.wind_grid().lon1d())
-    return WindData(wind_inp.date(), wind_tgt.wind_grid(), u_wind_tgt_res, v_wind_tgt_res)
+def roughness_adjust_thread_init(context_args):
+    # Runs once in each worker thread when executor is thread and schedule is time; builds the thread's own scaling context for the
+    # whole domain. The large read-only inputs (high-res roughness, directional z0 cube, water fraction) are shared, not copied.
+    thread_state.context = ScalingContext(*context_args)
 
 
-def wind_to_z0_res(wind, z0):
-    # Interpolate a WindData object to the spatial resolution of a Roughness object
-    u_interp = scipy.interpolate.RectBivariateSpline(wind.wind_grid().lat1d(), wind.wind_grid().lon1d(), wind.u_velocity(), kx=1, ky=1)
-    u_z0_res = u_interp(z0.lat(), z0.lon())
-    v_interp = scipy.interpolate.RectBivariateSpline(wind.wind_grid().lat1d(), wind.wind_grid().lon1d(), wind.v_velocity(), kx=1, ky=1)
-    v_z0_res = v_interp(z0.lat(), z0.lon())
-    return WindData(wind.date(), WindGrid(z0.lon(), z0.lat()), u_z0_res, v_z0_res)
+def roughness_adjust_thread(input_wind, input_wback):
+    return roughness_adjust([thread_state.context, input_wind, input_wback])
 
 
-def z0_to_wind_res(z0, wind):
-    # Interpolate a Roughness object to the spatial resolution of a WindData object
-    z0_wr_interp = scipy.interpolate.RectBivariateSpline(z0.lat(), z0.lon(), z0.land_rough(), kx=1, ky=1)
-    z0_w_res = z0_wr_interp(wind.wind_grid().lat1d(), wind.wind_grid().lon1d())
-    return Roughness(wind.wind_grid().lon1d(), wind.wind_grid().lat1d(), z0_w_res)
+def scale_wind(wind, factor):
+    # NOTE: This function assumes wind and factor have the same spatial resolution
+    return WindData(wind.date(), wind.wind_grid(), wind.u_velocity() * factor, wind.v_velocity() * factor)
 
 
-def z0_to_z0_res(z0_inp, z0_tgt):
-    # Interpolate a Roughness object to the spatial resolution of another Roughness object
-    z0_wr_interp = scipy.interpolate.RectBivariateSpline(z0_inp.lat(), z0_inp.lon(), z0_inp.land_rough(), kx=1, ky=1)
-    z0_w_res = z0_wr_interp(z0_tgt.lat(), z0_tgt.lon())
-    return Roughness(z0_tgt.lon(), z0_tgt.lat(), z0_w_res)
+def adcirc_factor(z0_inp, z0_tgt):
+    # Factor taking wind over z0_inp to wind over z0_tgt; NOTE: This function assumes all inputs have the same spatial resolution
+    return (z0_tgt / z0_inp)**0.0706 * numpy.log(10 / z0_tgt) / numpy.log(10 / z0_inp)
 
 
-def ten_to_zref(z0, wind):
+def zref_factor(z0):
+    # Factor taking 10 m wind to z_ref wind over z0; the inverse takes z_ref wind back down to 10 m
     # Scale using equations 9 & 10 here: https://dr.lib.iastate.edu/handle/20.500.12876/1131
     z_ref = 80  # Per Isaac the logarithmic profile only applies in the near surface layer, which extends roughly 80m up; to verify with lit review
     b = 1 / (numpy.log(10) - numpy.log(z0))  # Eq 10
-    uvel = wind.u_velocity() * (1 + b * numpy.log(z_ref / 10))  # Eq 9
-    vvel = wind.v_velocity() * (1 + b * numpy.log(z_ref / 10))  # Eq 9
-    return WindData(wind.date(), wind.wind_grid(), uvel, vvel)
+    return 1 + b * numpy.log(z_ref / 10)  # Eq 9
 
 
-def zref_to_ten(z0, wind):
-    # Scale using equations 9 & 10 here: https://dr.lib.iastate.edu/handle/20.500.12876/1131
-    z_ref = 80  # Per Isaac the logarithmic profile only applies in the near surface layer, which extends roughly 80m up; to verify with lit review
-    b = 1 / (numpy.log(10) - numpy.log(z0))  # Eq 10
-    uvel = wind.u_velocity() / (1 + b * numpy.log(z_ref / 10))  # Eq 9
-    vvel = wind.v_velocity() / (1 + b * numpy.log(z_ref / 10))  # Eq 9
-    return WindData(wind.date(), wind.wind_grid(), uvel, vvel)
-
-
-def generate_rmw_interpolant():
-    TrackRMW = pandas.read_csv('TrackRMW.txt', header=0, delim_whitespace=True)
-    TrackRMW_rows = len(TrackRMW)
-    rmw = numpy.zeros((TrackRMW_rows, 1))
-    time_rmw = numpy.zeros((TrackRMW_rows, 1))
-    for i in range(0, TrackRMW_rows):
-        rmw[i] = float(TrackRMW.iloc[i, 8]) * 1000  # Convert from km to m
-        time_rmw_date = datetime.datetime(TrackRMW.iloc[i, 0], TrackRMW.iloc[i, 1], TrackRMW.iloc[i, 2],
-                                          TrackRMW.iloc[i, 3], TrackRMW.iloc[i, 4], TrackRMW.iloc[i, 5])
-        if i == 0:
-            time_rmw_date_0 = time_rmw_date
-        time_rmw[i] = (time_rmw_date - time_rmw_date_0).total_seconds()
-    rmw_interpolant = scipy.interpolate.interp1d(time_rmw.flatten(), rmw.flatten(), kind='linear')
-    return rmw_interpolant, time_rmw_date_0
-
-
-def generate_ctr_interpolant():
-    fort22 = pandas.read_csv('fort.22', header=None)
-    fort22_rows = len(fort22)
-    lat_ctr = numpy.zeros((fort22_rows, 1))
-    lon_ctr = numpy.zeros((fort22_rows, 1))
-    time_ctr = numpy.zeros((fort22_rows, 1))
-    for i in range(0, fort22_rows):
-        lat_ctr[i] = float(fort22.iloc[i, 6].replace('N', ''))/10  # Assumes northern hemisphere
-        lon_ctr[i] = -float(fort22.iloc[i, 7].replace('W', ''))/10  # Assumes western hemisphere
-        time_ctr_date = datetime.datetime.strptime(str(fort22.iloc[i, 2]), '%Y%m%d%H')
-        if i == 0:
-            time_ctr_date_0 = time_ctr_date
-        time_ctr[i] = (time_ctr_date - time_ctr_date_0).total_seconds()
-    lon_ctr_interpolant = scipy.interpolate.interp1d(time_ctr.flatten(), lon_ctr.flatten(), kind='linear')
-    lat_ctr_interpolant = scipy.interpolate.interp1d(time_ctr.flatten(), lat_ctr.flatten(), kind='linear')
-    return lon_ctr_interpolant, lat_ctr_interpolant, time_ctr_date_0
-
-
-def blend(param_wind, back_wind, lon_ctr_interpolant, lat_ctr_interpolant, rmw_interpolant, time_ctr_date_0, time_rmw_date_0):
-    # NOTE: This function assumes back_wind and param_wind have the same spatial and temporal resolution
-    # Determine storm center location at param_wind.date()
-    int_param_wind_date = (param_wind.date() - time_ctr_date_0).total_seconds()
-    lon_ctr_interp = lon_ctr_interpolant(int_param_wind_date)
-    lat_ctr_interp = lat_ctr_interpolant(int_param_wind_date)
-    # Determine RMW at param_wind.date()
-    int_param_wind_date = (param_wind.date() - time_rmw_date_0).total_seconds()
-    rmw_interp = rmw_interpolant(int_param_wind_date)
-    # Blend outside RMW region and within low and high limits for wind speed, and apply background wind to vortex center
-    low_pct_of_max = .667
-    high_pct_of_max = .733
-    mag_param = magnitude_from_uv(param_wind.u_velocity(), param_wind.v_velocity())
-    max_wind = mag_param.max()
-    low_lim = min(low_pct_of_max * max_wind, 15.5)
-    high_lim = min(high_pct_of_max * max_wind, 20.5)
-    lon_ctr_interp_grid = numpy.zeros((param_wind.wind_grid().lon1d().size, param_wind.wind_grid().lat1d().size)) + lon_ctr_interp
-    lat_ctr_interp_grid = numpy.zeros((param_wind.wind_grid().lon1d().size, param_wind.wind_grid().lat1d().size)) + lat_ctr_interp
-    wgs84_geod = pyproj.Geod(ellps='WGS84')
-    _, _, dist_from_ctr = wgs84_geod.inv(lon_ctr_interp_grid, lat_ctr_interp_grid, param_wind.wind_grid().lon(), param_wind.wind_grid().lat())
-    rmw_mask = dist_from_ctr <= rmw_interp  # Make sure we don't blend within the RMW
-    blend_mask = (low_lim < mag_param) & (mag_param < high_lim) & ~rmw_mask
-    back_mask = (mag_param <= low_lim) & ~rmw_mask
-    u_blend = param_wind.u_velocity()
-    v_blend = param_wind.v_velocity()
-    alpha = (mag_param - low_lim) / (high_lim - low_lim)
-    u_blend[blend_mask] = (alpha[blend_mask] * param_wind.u_velocity()[blend_mask]) + ((1 - alpha[blend_mask]) * back_wind.u_velocity()[blend_mask])
-    v_blend[blend_mask] = (alpha[blend_mask] * param_wind.v_velocity()[blend_mask]) + ((1 - alpha[blend_mask]) * back_wind.v_velocity()[blend_mask])
-    u_blend[back_mask] = back_wind.u_velocity()[back_mask]
-    v_blend[back_mask] = back_wind.v_velocity()[back_mask]
-    return WindData(param_wind.date(), param_wind.wind_grid(), u_blend, v_blend)
-
-
-def subd_prep(z0_hr, z0_directional_interpolant, threads):
+def wind_to_wind_res(wind_inp, wind_tgt):
+    # Interpolate a WindData object to the spatial resolution of another WindData object
+    regridder = Regridder.get(wind_inp.wind_grid().lat1d(), wind_inp.wind_grid().lon1d(), wind_tgt.wind_grid().lat1d(), wind_tgt.wind_grid().lon1d())
+    uv_wind_tgt_res = regridder.apply(numpy.stack((wind_inp.u_velocity(), wind_inp.v_velocity())))
+    return WindData(wind_inp.date(), wind_tgt.wind_grid(), uv_wind_tgt_res[0], uv_wind_tgt_res[1])
+
+
+def z0_to_grid_res(z0, grid):
+    # Interpolate a Roughness object to the spatial resolution of a WindGrid object
+    regridder = Regridder.get(z0.lat(), z0.lon(), grid.lat1d(), grid.lon1d())
+    return Roughness(grid.lon1d(), grid.lat1d(), regridder.apply(z0.land_rough()))
+
+
+def z0_to_z0_res(z0_inp, z0_tgt):
+    # Interpolate a Roughness object to the spatial resolution of another Roughness object
+    regridder = Regridder.get(z0_inp.lat(), z0_inp.lon(), z0_tgt.lat(), z0_tgt.lon())
+    return Roughness(z0_tgt.lon(), z0_tgt.lat(), regridder.apply(z0_inp.land_rough()))
+
+
+class Blender:
+    # Blends parametric wind with background wind on the parametric grid, following storm_track (a track.StormTrack built for the
+    # dates of the parametric wind). The grid cells are stored once as unit vectors, so each slice finds
+    # the cells within the RMW with one dot product per cell against the storm center; spherical distances are within 1% of WGS84
+    # geodesic distances, so only cells in a thin ring around the RMW are settled with the geodesic, giving the same masks as
+    # computing the geodesic everywhere. Speed, masks, and alpha are written into buffers reused every slice, so build one per
+    # scaling context rather than sharing one between threads.
+    __earth_radius = 6371008.8  # Mean earth radius in m
+    __ring_width = 0.01  # Fraction of the RMW; larger than the difference between spherical and geodesic distances
+    __ring_slack = 1.0  # m; covers rounding in the dot product near the storm center
+
+    def __init__(self, wind_grid, storm_track):
+        self.__storm_track = storm_track
+        self.__shape = (wind_grid.n_latitude(), wind_grid.n_longitude())
+        self.__lon = numpy.ascontiguousarray(wind_grid.lon(), dtype=numpy.float64).reshape(-1)
+        self.__lat = numpy.ascontiguousarray(wind_grid.lat(), dtype=numpy.float64).reshape(-1)
+        self.__unit = Blender.__unit_vector(self.__lon, self.__lat)
+        self.__geod = pyproj.Geod(ellps='WGS84')
+        size = self.__lon.size
+        self.__dot = numpy.empty(size)
+        self.__speed, self.__alpha, self.__alpha_back, self.__term, self.__term_back, self.__u_blend, self.__v_blend = (numpy.empty(self.__shape) for i in range(7))
+        self.__rmw_mask, self.__ring, self.__outside, self.__blend_mask, self.__back_mask = (numpy.empty(self.__shape, dtype=bool) for i in range(5))
+
+    @staticmethod
+    def __unit_vector(lon, lat):
+        lon_rad = numpy.radians(lon)
+        lat_rad = numpy.radians(lat)
+        return numpy.stack((numpy.cos(lat_rad) * numpy.cos(lon_rad), numpy.cos(lat_rad) * numpy.sin(lon_rad), numpy.sin(lat_rad)))
+
+    def rmw_mask(self, lon_ctr, lat_ctr, rmw):
+        # Cells within rmw of the storm center, measured along the WGS84 geodesic; the returned array is reused by the next call
+        numpy.matmul(Blender.__unit_vector(lon_ctr, lat_ctr), self.__unit, out=self.__dot)
+        dot = self.__dot.reshape(self.__shape)
+        inner = rmw * (1 - Blender.__ring_width) - Blender.__ring_slack
+        outer = rmw * (1 + Blender.__ring_width) + Blender.__ring_slack
+        numpy.greater_equal(dot, math.cos(inner / Blender.__earth_radius) if inner > 0 else math.inf, out=self.__rmw_mask)
+        numpy.greater_equal(dot, math.cos(min(outer / Blender.__earth_radius, math.pi)), out=self.__ring)
+        numpy.logical_xor(self.__ring, self.__rmw_mask, out=self.__ring)
+        ring = numpy.flatnonzero(self.__ring)
+        if ring.size > 0:
+            _, _, dist_from_ctr = self.__geod.inv(numpy.full(ring.size, lon_ctr), numpy.full(ring.size, lat_ctr), self.__lon[ring], self.__lat[ring])
+            self.__rmw_mask.reshape(-1)[ring] = dist_from_ctr <= rmw
+        return self.__rmw_mask
+
+    def blend(self, param_wind, back_wind):
+        # NOTE: This function assumes back_wind and param_wind have the same spatial and temporal resolution, on this blender's grid
+        # Returns new WindData; param_wind and back_wind are not modified
+        if param_wind.u_velocity().shape != self.__shape or back_wind.u_velocity().shape != self.__shape:
+            raise RuntimeError("Wind to blend doesn't match the blending grid")
+        param_u, param_v = param_wind.u_velocity(), param_wind.v_velocity()
+        back_u, back_v = back_wind.u_velocity(), back_wind.v_velocity()
+        # Blend outside RMW region and within low and high limits for wind speed, and apply background wind to vortex center
+        low_pct_of_max = .667
+        high_pct_of_max = .733
+        speed = self.__speed
+        numpy.square(param_u, out=speed)
+        numpy.square(param_v, out=self.__term)
+        numpy.add(speed, self.__term, out=speed)
+        numpy.sqrt(speed, out=speed)
+        max_wind = speed.max()
+        low_lim = min(low_pct_of_max * max_wind, 15.5)
+        high_lim = min(high_pct_of_max * max_wind, 20.5)
+        numpy.logical_not(self.rmw_mask(*self.__storm_track.at(param_wind.date())), out=self.__outside)  # Make sure we don't blend within the RMW
+        numpy.greater(speed, low_lim, out=self.__blend_mask)
+        numpy.less(speed, high_lim, out=self.__ring)
+        numpy.logical_and(self.__blend_mask, self.__ring, out=self.__blend_mask)
+        numpy.logical_and(self.__blend_mask, self.__outside, out=self.__blend_mask)
+        numpy.less_equal(speed, low_lim, out=self.__back_mask)
+        numpy.logical_and(self.__back_mask, self.__outside, out=self.__back_mask)
+        with numpy.errstate(divide='ignore', invalid='ignore'):  # No cell is blended when there's no wind
+            numpy.subtract(speed, low_lim, out=self.__alpha)
+            numpy.divide(self.__alpha, high_lim - low_lim, out=self.__alpha)
+        numpy.subtract(1, self.__alpha, out=self.__alpha_back)
+        for param, back, blended in ((param_u, back_u, self.__u_blend), (param_v, back_v, self.__v_blend)):
+            numpy.multiply(self.__alpha, param, out=self.__term)
+            numpy.multiply(self.__alpha_back, back, out=self.__term_back)
+            numpy.add(self.__term, self.__term_back, out=self.__term)
+            numpy.copyto(blended, param)
+            numpy.copyto(blended, self.__term, where=self.__blend_mask)
+            numpy.copyto(blended, back, where=self.__back_mask)
+        return WindData(param_wind.date(), param_wind.wind_grid(), self.__u_blend, self.__v_blend)
+
+
+def subd_prep(z0_hr, z0_directional, threads):
     # Define subdomain indices for multiprocessing; subdomains are comprised of full rows and they are as close to the same size as possible
     subd_rows = math.floor(z0_hr.lat().size / threads)
-    subd_start_index = numpy.zeros([threads, 1], dtype=int)
-    subd_end_index = numpy.zeros([threads, 1], dtype=int)
+    subd_start_index = numpy.zeros(threads, dtype=int)
+    subd_end_index = numpy.zeros(threads, dtype=int)
     for i in range(0, threads):
         subd_end_index[i] = subd_rows * (i + 1)
     for i in range(0, z0_hr.lat().size % threads):
@@ -685,32 +1681,69 @@ def subd_prep(z0_hr, z0_directional_interpolant, threads):
         subd_start_index[i] = subd_end_index[i - 1]
     # Calculate subdomain quantities that will be used for each time slice
     subd_z0_hr = [[] for i in range(threads)]
-    subd_z0_directional_interpolant = [[] for i in range(threads)]
+    subd_z0_directional = [[] for i in range(threads)]
     for i in range(0, threads):
-        subd_z0_hr[i] = Roughness(z0_hr.lon(), z0_hr.lat()[int(subd_start_index[i]):int(subd_end_index[i])],
-                                  z0_hr.land_rough()[int(subd_start_index[i]):int(subd_end_index[i]), :])
-        subd_z0_directional_interpolant[i] = scipy.interpolate.RegularGridInterpolator((z0_directional_interpolant.grid[0][int(subd_start_index[i]):int(subd_end_index[i])],
-                                                                                        z0_directional_interpolant.grid[1][:], z0_directional_interpolant.grid[2][:]),
-                                                                                       z0_directional_interpolant.values[int(subd_start_index[i]):int(subd_end_index[i]), :, :], method='linear')
-    return subd_z0_hr, subd_z0_directional_interpolant, subd_start_index, subd_end_index
+        subd_z0_hr[i] = Roughness(z0_hr.lon(), z0_hr.lat()[subd_start_index[i]:subd_end_index[i]],
+                                  z0_hr.land_rough()[subd_start_index[i]:subd_end_index[i], :])
+        subd_z0_directional[i] = z0_directional.subset(subd_start_index[i], subd_end_index[i])
+    return subd_z0_hr, subd_z0_directional, subd_start_index, subd_end_index
 
 
 def subd_restitch_domain(subd_wind_scaled, subd_start_index, subd_end_index, hr_shape, threads):
-    u_scaled = numpy.zeros(hr_shape)
-    v_scaled = numpy.zeros(hr_shape)
+    u_scaled = None
     for i, subd in enumerate(subd_wind_scaled):
-        u_scaled[int(subd_start_index[i]):int(subd_end_index[i]), :] = subd.u_velocity()
-        v_scaled[int(subd_start_index[i]):int(subd_end_index[i]), :] = subd.v_velocity()
+        if u_scaled is None:  # Same precision as the scaled wind
+            u_scaled = numpy.zeros(hr_shape, dtype=subd.u_velocity().dtype)
+            v_scaled = numpy.zeros(hr_shape, dtype=subd.v_velocity().dtype)
+        u_scaled[subd_start_index[i]:subd_end_index[i], :] = subd.u_velocity()
+        v_scaled[subd_start_index[i]:subd_end_index[i], :] = subd.v_velocity()
         if i == 0:
             date = subd.date()
     return u_scaled, v_scaled, date
 
 
+def chunk_shape_from_str(text):
+    # "time,lat,lon" to a tuple of three positive ints; None if text is None or isn't in that form
+    if text is None:
+        return None
+    try:
+        chunk_shape = tuple(int(size) for size in text.split(","))
+    except ValueError:
+        return None
+    if len(chunk_shape) != 3 or min(chunk_shape) < 1:
+        return None
+    return chunk_shape
+
+
 def is_valid(args):
     if args.wfmt == args.wbackfmt:
         print("ERROR: wfmt and wbackfmt cannot match. Please try again.", flush=True)
     elif args.sl != "adcirc" and args.sl != "up-down":
         print("ERROR: Unsupported scaling logic. Please try again.", flush=True)
+    elif args.z0sv and args.z0update is not None:
+        print("ERROR: z0sv and z0update cannot be used together. Please try again.", flush=True)
+    elif args.ochunk is not None and chunk_shape_from_str(args.ochunk) is None:
+        print("ERROR: ochunk must be three positive integers separated by commas (time,lat,lon). Please try again.", flush=True)
+    elif args.obuffer is not None and args.obuffer < 1:
+        print("ERROR: obuffer must be at least 1. Please try again.", flush=True)
+    elif args.opack != "none" and args.opack != "int16" and args.opack != "lsd":
+        print("ERROR: Unsupported output packing. Please try again.", flush=True)
+    elif args.ocomplevel < 0 or args.ocomplevel > 9:
+        print("ERROR: ocomplevel must be between 0 and 9. Please try again.", flush=True)
+    elif args.precision != "float64" and args.precision != "float32":
+        print("ERROR: Unsupported precision. Please try again.", flush=True)
+    elif args.waterz0 != "constant" and args.waterz0 != "dynamic":
+        print("ERROR: Unsupported water z0 mode. Please try again.", flush=True)
+    elif args.wprefetch < 0:
+        print("ERROR: wprefetch must be 0 or more. Please try again.", flush=True)
+    elif args.wqdepth < 1:
+        print("ERROR: wqdepth must be at least 1. Please try again.", flush=True)
+    elif args.schedule != "subdomain" and args.schedule != "time":
+        print("ERROR: Unsupported schedule. Please try again.", flush=True)
+    elif args.executor != "thread" and args.executor != "process":
+        print("ERROR: Unsupported executor. Please try again.", flush=True)
+    elif args.z0engine != "fft" and args.z0engine != "loop":
+        print("ERROR: Unsupported directional z0 engine. Please try again.", flush=True)
     elif args.wfmt != "owi-ascii" and args.wfmt != "owi-netcdf" and args.wfmt != "wnd":
         print("ERROR: Unsupported wind format. Please try again.", flush=True)
     elif args.wback is not None and args.wbackfmt != "owi-ascii" and args.wbackfmt != "owi-netcdf":
@@ -733,35 +1766,89 @@ def is_valid(args):
 def build_parser():
     parser = argparse.ArgumentParser(description="Scale and subset input wind data based on high-resolution land roughness")
     parser.add_argument("-hr", metavar="highres_roughness", type=str, help="High-resolution land roughness file", required=True)
+    parser.add_argument("-executor", metavar="executor", type=str,
+                        help="How subdomains are scaled in parallel. Supported values: thread (default), process (worker processes that share the "
+                        + "high-res roughness and directional z0 cube instead of copying them; avoids contention for the Python interpreter lock)",
+                        required=False, default="thread")
     parser.add_argument("-o", metavar="outfile", type=str, help="Name of output file to be created", required=False, default="scaled_wind")
+    parser.add_argument("-obuffer", metavar="output_buffer", type=int,
+                        help="Number of time slices buffered in memory and written to the output at once; defaults to the time size of ochunk", required=False)
+    parser.add_argument("-obulktime", help="Add this flag to write the output time values once, when the output is closed, instead of with every buffered write",
+                        action='store_true', required=False, default=False)
+    parser.add_argument("-ochunk", metavar="output_chunks", type=str,
+                        help="Chunk shape of the output spd and dir variables as time,lat,lon (clipped to the grid); the default, "
+                        + ",".join(str(size) for size in NetcdfOutput.default_chunk_shape) + ", suits both map-at-one-time and time-series-at-one-point reads; "
+                        + "if the output is only ever read a map at a time, 1,<lat size>,<lon size> reads maps fastest",
+                        required=False)
+    parser.add_argument("-ocomplevel", metavar="output_complevel", type=int,
+                        help="zlib compression level of the output, from 0 (uncompressed) to 9", required=False, default=2)
+    parser.add_argument("-opack", metavar="output_packing", type=str,
+                        help="How spd and dir are stored in the output. Supported values: none (float32, the default), int16 (packed with scale_factor "
+                        + "0.01 m s-1 for spd and 0.1 degrees for dir), lsd (float32 quantized to 0.01 m s-1 and 0.1 degrees; compresses better). "
+                        + "Use compare_wind_output.py to check the error and file size against an unpacked run", required=False, default="none")
+    parser.add_argument("-onoshuffle", help="Add this flag to turn off the HDF5 shuffle filter, which is applied before compressing the output as it was "
+                        + "before this option existed; the output is usually larger and slower to write without it", action='store_true', required=False, default=False)
+    parser.add_argument("-precision", metavar="precision", type=str,
+                        help="Precision of the high-res scaling and of the spd/dir conversion. Supported values: float64 (the default), float32 "
+                        + "(halves the memory traffic and the resident size of the directional z0 cube; output is float32 either way). float32 has only been checked "
+                        + "against float64 on synthetic inputs (about 1e-4 m/s and 1e-3 deg apart, and a near-calm cell can come out calm with a NaN direction), "
+                        + "not on a reference storm; compare a float32 run against a float64 run with compare_wind_output.py before relying on it", required=False, default="float64")
     parser.add_argument("-r", metavar="radius", type=int,
-                        help="Sector radius for directional z0 calculation, in meters; will be ignored if z0sv is false", required=False, default=3000)
+                        help="Sector radius for directional z0 calculation, in meters; used by z0sv, and by z0update if the interpolant doesn't record it", required=False, default=3000)
     parser.add_argument("-sigma", metavar="sigma", type=int,
-                        help="Weighting parameter for directional z0 calculation, in meters; will be ignored if z0sv is false", required=False, default=1000)
+                        help="Weighting parameter for directional z0 calculation, in meters; used by z0sv, and by z0update if the interpolant doesn't record it", required=False, default=1000)
+    parser.add_argument("-schedule", metavar="schedule", type=str,
+                        help="How work is split between the t threads or processes. Supported values: subdomain (default; each time slice is split "
+                        + "into t row bands), time (each thread or process scales whole time slices, up to 2t at once, and output is still written "
+                        + "in order; faster for small grids and long time series, but holds up to 2t slices in memory)", required=False, default="subdomain")
     parser.add_argument("-sl", metavar="scale_logic", type=str,
                         help="Which logic to use for the directional z0 adjustment. Supported values: adcirc, up-down", required=False, default='adcirc')
     parser.add_argument("-t", metavar="threads", type=int,
-                        help="Number of threads to use for calculations; must not exceed the number available; total threads = t + wasync", required=False, default=1)
+                        help="Number of threads (or worker processes, if executor is process) to use for calculations; must not exceed the number available; total threads = t + wasync", required=False, default=1)
     parser.add_argument("-w", metavar="wind", type=str, help="Wind file to be scaled and subsetted", required=True)
     parser.add_argument("-wasync", help="Add this flag to begin scaling winds for the next time step while writing the output for the current time step; "
-                        + "writes run in series and are thread safe, but peak memory use may be high if write times are slower than computation times; "
-                        + "total threads = t + wasync", action='store_true', required=False, default=False)
+                        + "writes run in series on one writer thread, and at most wqdepth time slices wait to be written; total threads = t + wasync",
+                        action='store_true', required=False, default=False)
     parser.add_argument("-wback", metavar="wind_background", type=str,
                         help="Background wind to be blended with the wind file; if included, w and wback will be blended", required=False)
     parser.add_argument("-wbackfmt", metavar="wback_format", type=str,
                         help="Format of the input background wind file. Supported values: owi-ascii, owi-netcdf. Required if wback is provided.", required=False)
     parser.add_argument("-wbackr", metavar="wback_roughness", type=str,
                         help="Wind-resolution land roughness file; required if wbackfmt is owi-ascii or owi-netcdf", required=False)
+    parser.add_argument("-waterz0", metavar="water_z0", type=str,
+                        help="How z0 over water is determined. Supported values: constant (the default; z0 from the high-res roughness file), "
+                        + "dynamic (derived from the wind each time slice with the GFDL ustar-z0 relationship in water_z0.py; adds roughly 15-25%% to the "
+                        + "scaling time of each slice, more than the 10%% it was meant to stay under, depending on how much of the grid is near water). "
+                        + "The directional water fraction dynamic needs is cached as z0_name_water.npy and z0_name_water.json", required=False, default="constant")
+    parser.add_argument("-waterz0max", metavar="water_z0_max", type=float,
+                        help="High-res roughness values at or below this, in meters, are treated as water when waterz0 is dynamic", required=False, default=0.005)
     parser.add_argument("-wfmt", metavar="w_format", type=str,
                         help="Format of the input wind file. Supported values: owi-ascii, owi-netcdf, wnd. If wback is provided, this must be wnd.", required=True)
     parser.add_argument("-winp", metavar="wind_inp", type=str,
                         help="Wind_Inp.txt metadata file; required if wfmt is wnd", required=False)
+    parser.add_argument("-wprefetch", metavar="wind_prefetch", type=int,
+                        help="Number of input wind slices each wind source reads ahead on a background thread, so reading can overlap with scaling when a spare core "
+                        + "is free (it saves at most the read time, and nothing on a single core; the gain hasn't been measured on a multi-core node); "
+                        + "0 (the default) reads each slice when it's needed", required=False, default=0)
+    parser.add_argument("-wqdepth", metavar="write_queue_depth", type=int,
+                        help="Maximum number of scaled time slices waiting to be written when wasync is used; computations wait when the queue is full, "
+                        + "so this caps the extra memory used by asynchronous writes", required=False, default=2)
     parser.add_argument("-wr", metavar="wind_roughness", type=str,
                         help="Wind-resolution land roughness file; required if wfmt is owi-ascii or owi-netcdf", required=False)
     parser.add_argument("-z0sv", help="Add this flag to generate and save off a directional z0 interpolant; do this in advance to save time during regular runs",
                         action='store_true', required=False, default=False)
+    parser.add_argument("-z0engine", metavar="z0_engine", type=str,
+                        help="How z0sv computes the directional z0 cone averages. Supported values: fft (fast), loop (slow reference implementation)",
+                        required=False, default="fft")
+    parser.add_argument("-z0workers", metavar="z0_workers", type=int,
+                        help="Number of processes z0sv uses to generate the directional z0 interpolant; the result doesn't depend on this", required=False, default=1)
+    parser.add_argument("-z0update", metavar="z0_update_roughness", type=str,
+                        help="High-res roughness file the existing directional z0 interpolant was generated from; if provided, only the part of the "
+                        + "interpolant affected by differences between this file and hr is regenerated, and the interpolant is saved over z0_name",
+                        required=False)
     parser.add_argument("-z0name", metavar="z0_name", type=str,
-                        help="Name of directional z0 interpolant file; it will be generated if z0sv is True and loaded if z0sv is False", required=False, default='z0_interp')
+                        help="Name of directional z0 interpolant file, without extension; z0_name.npy and z0_name.json will be generated if z0sv is True "
+                        + "and loaded if z0sv is False (a legacy z0_name.pickle is loaded if z0_name.json doesn't exist)", required=False, default='z0_interp')
     return parser
 
 
@@ -774,124 +1861,180 @@ def main():
     if not is_valid(args):
         return
 
-    # Create wind files, set num_times
-    if args.wfmt == "owi-ascii":
-        win_file = open(args.w, 'r')
-        lines = win_file.readlines()
-        win_file.close()
-        owi_ascii = OwiAsciiWind(lines)
-        num_times = owi_ascii.num_times()
-    elif args.wfmt == "owi-netcdf":
-        owi_netcdf = OwiNetcdf(args.w)
-        num_times = owi_netcdf.num_times()
-    elif args.wfmt == "wnd":
-        metadata = WndWindInp(args.winp)
-        num_times = metadata.num_times()
-        wnd_file = open(args.w, 'r')
-        lines = wnd_file.readlines()
-        wnd_file.close()
-        wnd = WndWind(lines, metadata)
-    if args.wbackfmt == "owi-ascii":
-        win_file = open(args.wback, 'r')
-        lines = win_file.readlines()
-        win_file.close()
-        owi_ascii = OwiAsciiWind(lines)
-    elif args.wbackfmt == "owi-netcdf":
-        owi_netcdf = OwiNetcdf(args.wback)
-
-    # If blending, generate interpolants used for every time slice
+    # Read the high-res roughness first; its extent bounds the part of the input wind that's needed
+    hr_lon, hr_lat, hr_land_rough = Roughness.get(args.hr)
+    z0_hr = Roughness(hr_lon, hr_lat, hr_land_rough)
+    hr_grid = WindGrid(z0_hr.lon(), z0_hr.lat())
+    lon_grid, lat_grid = hr_grid.lon(), hr_grid.lat()
+
+    # Open wind sources, set num_times
+    # Input wind is cropped once to the window of its grid that covers the high-res domain (plus the points around it that
+    # interpolation uses), so decoding, blending, and scaling skip the rest with the same output. When blending, the parametric
+    # wind is kept whole, since the blend limits come from its maximum speed, and the background is cropped to the parametric grid.
+    wind_source = WindSource.open(args.wfmt, args.w, args.winp)
+    wback_source = None
+    if args.wback is not None:
+        wback_source = WindSource.open(args.wbackfmt, args.wback)
+        crop_source, crop_grid = wback_source, wind_source.grid()
+    else:
+        crop_source, crop_grid = wind_source, hr_grid
+    full_n_lat, full_n_lon = crop_source.grid().n_latitude(), crop_source.grid().n_longitude()
+    crop_source.crop(crop_grid.xll(), crop_grid.xur(), crop_grid.yll(), crop_grid.yur())
+    print("INFO: Reading {:d} x {:d} of the {:d} x {:d} {:s} grid".format(crop_source.grid().n_latitude(), crop_source.grid().n_longitude(),
+                                                                    full_n_lat, full_n_lon, "background wind" if wback_source is not None else "input wind"), flush=True)
+    num_times = wind_source.num_times()
+    wind_grid = wind_source.grid()
+    wback_grid = wback_source.grid() if wback_source is not None else None
+
+    # If blending, interpolate the storm center and RMW to every time slice up front
+    storm_track = None
     if args.wback is not None:
-        lon_ctr_interpolant, lat_ctr_interpolant, time_ctr_date_0 = generate_ctr_interpolant()
-        rmw_interpolant, time_rmw_date_0 = generate_rmw_interpolant()
+        storm_track = track.StormTrack.read([wind_source.date(idx) for idx in range(num_times)])
 
     # Define roughness grids
     if (args.wfmt == "owi-ascii") | (args.wfmt == "owi-netcdf"):
         wr_lon, wr_lat, wr_land_rough = Roughness.get(args.wr)
-        z0_wr = Roughness(wr_lon, wr_lat, wr_land_rough)
+        z0_wr_w_grid = z0_to_grid_res(Roughness(wr_lon, wr_lat, wr_land_rough), wind_grid)
     elif args.wfmt == "wnd":
         z0_wnd = 0.0033
-        wr_land_rough = numpy.zeros((metadata.num_lats(), metadata.num_lons())) + z0_wnd  # z0_wr defined below, after wnd grid is available
+        z0_wr_w_grid = Roughness(wind_grid.lon1d(), wind_grid.lat1d(), numpy.zeros((wind_grid.n_latitude(), wind_grid.n_longitude())) + z0_wnd)
+    z0_wbackr = None
     if (args.wbackfmt == "owi-ascii") | (args.wbackfmt == "owi-netcdf"):
         wbackr_lon, wbackr_lat, wbackr_land_rough = Roughness.get(args.wbackr)
         z0_wbackr = Roughness(wbackr_lon, wbackr_lat, wbackr_land_rough)
-    hr_lon, hr_lat, hr_land_rough = Roughness.get(args.hr)
-    z0_hr = Roughness(hr_lon, hr_lat, hr_land_rough)
-    lon_grid, lat_grid = numpy.meshgrid(z0_hr.lon(), z0_hr.lat())
 
     # Generate or load directional z0 interpolants
     if args.z0sv:
-        print("INFO: z0sv is True, so a directional z0 interpolant file will be generated. This will take a while.", flush=True)
+        print("INFO: z0sv is True, so a directional z0 interpolant file will be generated.", flush=True)
         print("INFO: Generating directional z0 interpolant...", flush=True)
-        z0_directional_interpolant = generate_directional_z0_interpolant(lon_grid, lat_grid, z0_hr.land_rough(), args.sigma, args.r)
-        with open(args.z0name + '.pickle', 'wb') as file:
-            pickle.dump(z0_directional_interpolant, file, pickle.HIGHEST_PROTOCOL)
+        z0_directional = generate_directional_z0_interpolant(lon_grid, lat_grid, z0_hr.land_rough(), args.sigma, args.r, args.z0engine, args.z0workers)
+        z0_directional.save(args.z0name, file_sha256(args.hr))
     else:
         print("INFO: Loading directional z0 interpolant...", flush=True)
-        with open(args.z0name + '.pickle', 'rb') as file:
-            z0_directional_interpolant = pickle.load(file)
-
-    # Define subdomains for multiprocessing
-    subd_z0_hr, subd_z0_directional_interpolant, subd_start_index, subd_end_index = subd_prep(z0_hr, z0_directional_interpolant, args.t)
-
-    # Scale wind one time slice at a time
-    wind = None
-    time_index = 0
+        z0_directional = DirectionalZ0.load(args.z0name)
+        if z0_directional.z0_directional().shape[0:2] != z0_hr.land_rough().shape or not (
+                numpy.allclose(z0_directional.lat(), z0_hr.lat()) and numpy.allclose(z0_directional.lon(), z0_hr.lon())):
+            print("ERROR: The directional z0 interpolant does not match the high-res roughness grid. Please regenerate it with z0sv.", flush=True)
+            return
+        if args.z0update is not None:
+            _, _, old_land_rough = Roughness.get(args.z0update)
+            if old_land_rough.shape != z0_hr.land_rough().shape:
+                print("ERROR: z0update and hr must be on the same grid. Please try again.", flush=True)
+                return
+            if z0_directional.roughness_hash() is not None and z0_directional.roughness_hash() != file_sha256(args.z0update):
+                print("WARNING: The directional z0 interpolant was not generated from the z0update roughness file. "
+                      + "Only cells near differences between z0update and hr will be regenerated.", flush=True)
+            if z0_directional.sigma() is None:  # Legacy pickles don't record the parameters they were generated with
+                z0_directional = DirectionalZ0(z0_directional.lat(), z0_directional.lon(), z0_directional.angle(),
+                                               z0_directional.z0_directional(), args.sigma, args.r)
+            print("INFO: Updating directional z0 interpolant...", flush=True)
+            z0_directional = update_directional_z0_interpolant(z0_directional, lon_grid, lat_grid, old_land_rough, z0_hr.land_rough(), args.z0engine)
+            z0_directional.save(args.z0name, file_sha256(args.hr))
+        elif z0_directional.roughness_hash() is not None and z0_directional.roughness_hash() != file_sha256(args.hr):
+            print("WARNING: The directional z0 interpolant was generated from a different high-res roughness file. "
+                  + "Consider regenerating it with z0sv or updating it with z0update.", flush=True)
+
+    # If water z0 is dynamic, find how much of each directional z0 cone is water
+    water_fraction = None
+    water_z0_constant = None
+    if args.waterz0 == "dynamic":
+        sigma = z0_directional.sigma() if z0_directional.sigma() is not None else args.sigma
+        radius = z0_directional.radius() if z0_directional.radius() is not None else args.r
+        water_fraction, water_z0_constant = load_or_generate_water_fraction(args.z0name + "_water", lon_grid, lat_grid, z0_hr.land_rough(), args.waterz0max,
+                                                                            sigma, radius, file_sha256(args.hr), args.z0workers)
+        if water_fraction is None:
+            print("WARNING: No high-res roughness values are at or below waterz0max, so water z0 will be constant.", flush=True)
+        else:
+            print("INFO: Water z0 in the high-res roughness is {:.6f} on average; it will be derived from the wind for each time slice".format(water_z0_constant), flush=True)
+
+    # Define subdomains for multiprocessing; when scheduling by time, each task is a whole time slice, so there's one subdomain
+    # With precision float32, thread workers share a float32 copy of the directional z0 cube (process workers get one in shared memory)
+    dtype = numpy.dtype(args.precision)
+    if args.executor == "thread":
+        z0_directional = z0_directional.astype(dtype)
+    num_subd = 1 if args.schedule == "time" else args.t
+    subd_z0_hr, subd_z0_directional, subd_start_index, subd_end_index = subd_prep(z0_hr, z0_directional, num_subd)
+    shared_arrays = []
+    if args.executor == "process":
+        # Worker processes build their own scaling contexts from shared copies of the large read-only inputs
+        shared_z0_hr = SharedArray.copy_of(z0_hr.land_rough())
+        shared_arrays.append(shared_z0_hr)
+        if isinstance(z0_directional.z0_directional(), numpy.memmap) and z0_directional.z0_directional().dtype == dtype:
+            z0_directional_source = args.z0name
+        else:
+            shared_z0_directional = SharedArray.copy_of(z0_directional.z0_directional(), dtype)
+            shared_arrays.append(shared_z0_directional)
+            z0_directional_source = (z0_directional.lat(), z0_directional.lon(), z0_directional.angle(), shared_z0_directional.spec())
+        water_source = None
+        if water_fraction is not None:
+            shared_water_fraction = SharedArray.copy_of(water_fraction)
+            shared_arrays.append(shared_water_fraction)
+            water_source = (shared_water_fraction.spec(), water_z0_constant)
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=args.t, initializer=roughness_adjust_worker_init,
+                                                          initargs=(args.sl, wind_grid, z0_wr_w_grid, z0_hr.lon(), z0_hr.lat(), shared_z0_hr.spec(),
+                                                                    z0_directional_source, subd_start_index, subd_end_index, wback_grid, z0_wbackr, storm_track,
+                                                                    water_source, dtype))
+    elif args.schedule == "time":
+        # Threads scale whole slices concurrently, so each builds its own context for the one subdomain
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=args.t, initializer=roughness_adjust_thread_init,
+                                                         initargs=((args.sl, wind_grid, z0_wr_w_grid, subd_z0_hr[0], subd_z0_directional[0],
+                                                                    wback_grid, z0_wbackr, storm_track, water_fraction, water_z0_constant, dtype),))
+    else:
+        subd_context = [ScalingContext(args.sl, wind_grid, z0_wr_w_grid, subd_z0_hr[i], subd_z0_directional[i],
+                                       wback_grid, z0_wbackr, storm_track,
+                                       water_fraction[subd_start_index[i]:subd_end_index[i]] if water_fraction is not None else None,
+                                       water_z0_constant, dtype) for i in range(num_subd)]
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=args.t)
+
+    # Scale wind one time slice at a time, or with schedule time, up to max_in_flight slices at a time; pending holds the slices
+    # in flight in index order and acts as the reorder buffer, so output is always written in index order
+    # Inputs for roughness_adjust are streamed from the wind sources, which read wprefetch slices ahead on background threads; the
+    # output is created first, so its netCDF setup never overlaps with those reads
+    wind = NetcdfOutput(args.o, z0_hr.lon(), z0_hr.lat(), num_times, chunk_shape_from_str(args.ochunk), args.obuffer,
+                        args.ocomplevel, not args.onoshuffle, args.obulktime, args.opack, dtype)
     if args.wasync:
-        write_thread = [[] for i in range(num_times)]
-        lock = threading.Lock()
-        did_warn = False
-    with concurrent.futures.ThreadPoolExecutor(max_workers=args.t) as executor:
-        for time_index in range(0, num_times):
+        writer = AsyncWriter(wind, args.wqdepth)
+    write_index = 0
+    pending = collections.deque()
+    max_in_flight = 2 * args.t
+    with executor:
+        for time_index, (input_wind, input_wback) in enumerate(wind_slices(wind_source, wback_source, num_times, args.wprefetch)):
             print("INFO: Processing time slice {:d} of {:d}".format(time_index + 1, num_times), flush=True)
-            subd_inputs = [[] for i in range(args.t)]
-            # Generate inputs for roughness_adjust
-            if args.wfmt == "owi-ascii":
-                input_wind = owi_ascii.get(time_index)
-            elif args.wfmt == "owi-netcdf":
-                input_wind = owi_netcdf.get(time_index)
-            elif args.wfmt == "wnd":
-                input_wind = wnd.get(time_index)
-                if time_index == 0:
-                    z0_wr = Roughness(input_wind.wind_grid().lon1d(), input_wind.wind_grid().lat1d(), wr_land_rough)
-            if args.wback is not None:
-                if args.wbackfmt == 'owi-ascii':
-                    input_wback = owi_ascii.get(time_index)
-                elif args.wbackfmt == 'owi-netcdf':
-                    input_wback = owi_netcdf.get(time_index)
-                for i in range(0, args.t):
-                    subd_inputs[i] = [input_wind, input_wback, args.wfmt, args.wbackfmt, z0_wr, z0_wbackr, subd_z0_hr[i], subd_z0_directional_interpolant[i],
-                                      args.sl, lon_ctr_interpolant, lat_ctr_interpolant, rmw_interpolant, time_ctr_date_0, time_rmw_date_0]
+            if args.schedule == "time":
+                # Call roughness_adjust for the whole slice; once max_in_flight slices are pending, wait for the oldest
+                if args.executor == "process":
+                    pending.append(executor.submit(roughness_adjust_worker, 0, input_wind, input_wback))
+                else:
+                    pending.append(executor.submit(roughness_adjust_thread, input_wind, input_wback))
+                finished = []
+                while pending and (len(pending) >= max_in_flight or time_index == num_times - 1):
+                    finished.append(pending.popleft().result())
             else:
-                for i in range(0, args.t):
-                    subd_inputs[i] = [input_wind, None, args.wfmt, None, z0_wr, None, subd_z0_hr[i], subd_z0_directional_interpolant[i],
-                                      args.sl, None, None, None, None, None]
-            # Call roughness_adjust for each subdomain
-            subd_wind_scaled = executor.map(roughness_adjust, subd_inputs)
-            u_scaled, v_scaled, date = subd_restitch_domain(subd_wind_scaled, subd_start_index, subd_end_index, z0_hr.land_rough().shape, args.t)
-            wind_scaled = WindData(date, WindGrid(z0_hr.lon(), z0_hr.lat()), u_scaled, v_scaled)
+                # Call roughness_adjust for each subdomain
+                if args.executor == "process":
+                    subd_wind_scaled = executor.map(roughness_adjust_worker, range(num_subd), [input_wind] * num_subd, [input_wback] * num_subd)
+                else:
+                    subd_inputs = [[subd_context[i], input_wind, input_wback] for i in range(num_subd)]
+                    subd_wind_scaled = executor.map(roughness_adjust, subd_inputs)
+                u_scaled, v_scaled, date = subd_restitch_domain(subd_wind_scaled, subd_start_index, subd_end_index, z0_hr.land_rough().shape, num_subd)
+                finished = [WindData(date, hr_grid, u_scaled, v_scaled)]
             # Write to NetCDF; single-threaded with optional asynchronicity for now, as thread-safe NetCDF is complicated
-            if not wind:
-                wind = NetcdfOutput(args.o, z0_hr.lon(), z0_hr.lat())
-            if args.wasync:
-                if time_index > 0 and not did_warn and write_thread[time_index - 1].is_alive():
-                    print("WARNING: NetCDF writes are taking longer than computations. This may result in higher memory use. "
-                          + "Especially if this warning appears early, consider using fewer threads or disabling asynchronous writes.", flush=True)
-                    did_warn = True
-                write_thread[time_index] = threading.Thread(target=wind.append, args=(time_index, wind_scaled.date(),
-                                                                                      wind_scaled.u_velocity(), wind_scaled.v_velocity(), lock))
-                write_thread[time_index].start()
-            else:
-                wind.append(time_index, wind_scaled.date(), wind_scaled.u_velocity(), wind_scaled.v_velocity(), None)
-        # If writes are asynchronous, wait for all threads to return
+            for wind_scaled in finished:
+                if args.wasync:
+                    writer.put(write_index, wind_scaled.date(), wind_scaled.u_velocity(), wind_scaled.v_velocity())
+                else:
+                    wind.append(write_index, wind_scaled.date(), wind_scaled.u_velocity(), wind_scaled.v_velocity())
+                write_index += 1
+        # If writes are asynchronous, wait for the writer to finish
         if args.wasync:
-            for i in range(0, num_times):
-                if write_thread[i].is_alive():
-                    print("INFO: Still writing output to NetCDF for time slice {:d} of {:d}".format(i + 1, num_times), flush=True)
-                write_thread[i].join()
+            writer.close()
 
     # Clean up
-    if args.wfmt == "owi-netcdf" or args.wbackfmt == "owi-netcdf":
-        owi_netcdf.close()
+    for shared_array in shared_arrays:
+        shared_array.close()
+    wind_source.close()
+    if wback_source is not None:
+        wback_source.close()
     wind.close()
     print("RICHAMP wind generation complete. Runtime:", str(datetime.datetime.now() - start), flush=True)
 
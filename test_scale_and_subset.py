@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# Contact: Josh Port (joshua_port@uri.edu)
+#
+# Regression tests for scale_and_subset.py; run with "python -m pytest -q"
+#
+import concurrent.futures
+import datetime
+import netCDF4
+import numpy
+import scipy.interpolate
+import scale_and_subset
+import track
+
+
+def test_regrid_zero_u_next_to_nonzero_v():
+    # u is exactly zero in the western column, written as -0.000 by the parametric model, next to a nonzero u; v is nonzero
+    # everywhere. The spline gives +0.0 there, so the wind blows due north (90 degrees math, from 180 degrees met), not due south.
+    src_lat = numpy.array([41.0, 41.1])
+    src_lon = numpy.array([-71.0, -70.9])
+    u_vel = numpy.array([[-0.0, -2.0], [-0.0, -2.0]])
+    v_vel = numpy.full((2, 2), 5.0)
+    tgt_lat = numpy.array([41.0, 41.05])
+    tgt_lon = numpy.array([-71.0, -70.95])
+    regridder = scale_and_subset.Regridder(src_lat, src_lon, tgt_lat, tgt_lon)
+    for dtype in (numpy.float64, numpy.float32):
+        u_hr = regridder.apply(u_vel.astype(dtype))
+        v_hr = regridder.apply(v_vel.astype(dtype))
+        spline = scipy.interpolate.RectBivariateSpline(src_lat, src_lon, u_vel, kx=1, ky=1)(tgt_lat, tgt_lon)
+        assert numpy.array_equal(numpy.signbit(u_hr), numpy.signbit(spline))
+        direction = scale_and_subset.direction_from_uv(u_hr, v_hr)
+        assert direction[0, 0] == 90
+        assert direction[1, 0] == 90
+
+
+def test_direction_from_uv_negative_zero_u():
+    # -0.0 and +0.0 u give the same direction, whichever way v points
+    u_vel = numpy.array([-0.0, 0.0, -0.0, 0.0])
+    v_vel = numpy.array([5.0, 5.0, -5.0, -5.0])
+    direction = scale_and_subset.direction_from_uv(u_vel, v_vel)
+    assert numpy.array_equal(direction, [90, 90, 270, 270])
+    spd = numpy.empty(4)
+    dir_met = numpy.empty(4)
+    scale_and_subset.SpeedDirection((4,)).compute(u_vel, v_vel, spd, dir_met)
+    assert numpy.array_equal(dir_met, scale_and_subset.dir_met_to_and_from_math(direction))
+
+
+def test_int16_packing_wraps_direction_below_360(tmp_path):
+    # Directions within half a packing step of 360 are stored as 0, not 360; the rest round to the nearest step
+    lon = numpy.array([-71.0, -70.9, -70.8])
+    lat = numpy.array([41.0])
+    dir_met = numpy.array([359.97, 359.94, 0.02])
+    dir_math = scale_and_subset.dir_met_to_and_from_math(dir_met)
+    u_vel = 10 * numpy.cos(numpy.radians(dir_math))[numpy.newaxis, :]
+    v_vel = 10 * numpy.sin(numpy.radians(dir_math))[numpy.newaxis, :]
+    filename = str(tmp_path / "packed")
+    output = scale_and_subset.NetcdfOutput(filename, lon, lat, num_times=1, pack="int16")
+    output.append(0, datetime.datetime(2022, 9, 15), u_vel, v_vel)
+    output.close()
+    with netCDF4.Dataset(filename + ".nc") as nc:
+        stored = nc["Main"]["dir"][0, 0, :]
+    assert numpy.allclose(stored, [0.0, 359.9, 0.0])
+
+
+def blending_domain(num_times, water=False):
+    # A small storm on a 0.01 degree wind grid, blended with a uniform background wind, scaled to a 0.005 degree high-res grid
+    # Returns the ScalingContext arguments and (parametric wind, background wind) for each time slice
+    rng = numpy.random.default_rng(0)
+    lon = -71.5 + 0.01 * numpy.arange(40)
+    lat = 41.0 + 0.01 * numpy.arange(40)
+    wind_grid = scale_and_subset.WindGrid(lon, lat)
+    hr_lon = -71.45 + 0.005 * numpy.arange(50)
+    hr_lat = 41.05 + 0.005 * numpy.arange(50)
+    z0_wr = scale_and_subset.Roughness(lon, lat, rng.uniform(0.001, 0.5, (40, 40)))
+    z0_hr = scale_and_subset.Roughness(hr_lon, hr_lat, rng.uniform(0.001, 0.5, (50, 50)))
+    angle = numpy.linspace(0, 360, 13)
+    z0_directional = scale_and_subset.DirectionalZ0(hr_lat, hr_lon, angle, rng.uniform(0.001, 0.5, (50, 50, 13)))
+    dates = [datetime.datetime(2022, 9, 15) + datetime.timedelta(hours=i) for i in range(num_times)]
+    ctr_lon = -71.4 + 0.01 * numpy.arange(num_times)
+    storm_track = track.StormTrack(dates, dates, ctr_lon, numpy.full(num_times, 41.2), dates, numpy.full(num_times, 8000.0))
+    water_fraction = None
+    water_z0_constant = None
+    if water:
+        water_fraction = numpy.zeros((50, 50, 13))
+        water_fraction[:, :20, :] = 1  # Open water
+        water_fraction[:, 20:30, :] = rng.uniform(0, 1, (50, 10, 13))  # Coast
+        water_fraction[..., 12] = water_fraction[..., 0]
+        water_z0_constant = 0.001
+    lon_grid, lat_grid = numpy.meshgrid(lon, lat)
+    winds = []
+    for i, date in enumerate(dates):
+        dx = (lon_grid - ctr_lon[i]) * 84000
+        dy = (lat_grid - 41.2) * 111000
+        r = numpy.hypot(dx, dy) + 1
+        vt = 25 * numpy.minimum(r / 8000, (8000 / r) ** 0.5)
+        param = scale_and_subset.WindData(date, wind_grid, -vt * dy / r, vt * dx / r)
+        back = scale_and_subset.WindData(date, wind_grid, numpy.full((40, 40), 8.0), numpy.full((40, 40), -3.0))
+        winds.append((param, back))
+    context_args = ("adcirc", wind_grid, z0_wr, z0_hr, z0_directional, wind_grid, z0_wr, storm_track, water_fraction, water_z0_constant)
+    return context_args, winds
+
+
+def test_schedule_time_threads_match_serial_blending():
+    # With schedule time, threads scale whole slices at once; each builds its own context, so blending buffers aren't shared
+    context_args, winds = blending_domain(24)
+    context = scale_and_subset.ScalingContext(*context_args)
+    serial = [scale_and_subset.roughness_adjust([context, param, back]) for param, back in winds]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=4, initializer=scale_and_subset.roughness_adjust_thread_init,
+                                               initargs=(context_args,)) as executor:
+        threaded = list(executor.map(scale_and_subset.roughness_adjust_thread, *zip(*winds)))
+    for a, b in zip(serial, threaded):
+        assert numpy.array_equal(a.u_velocity(), b.u_velocity())
+        assert numpy.array_equal(a.v_velocity(), b.v_velocity())
+
+
+def test_schedule_time_threads_match_serial_dynamic_water_z0():
+    # The same with dynamic water z0, whose work arrays are also per context
+    context_args, winds = blending_domain(24, water=True)
+    context = scale_and_subset.ScalingContext(*context_args)
+    serial = [scale_and_subset.roughness_adjust([context, param, back]) for param, back in winds]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=4, initializer=scale_and_subset.roughness_adjust_thread_init,
+                                               initargs=(context_args,)) as executor:
+        threaded = list(executor.map(scale_and_subset.roughness_adjust_thread, *zip(*winds)))
+    for a, b in zip(serial, threaded):
+        assert numpy.array_equal(a.u_velocity(), b.u_velocity())
+        assert numpy.array_equal(a.v_velocity(), b.v_velocity())
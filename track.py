@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# Contact: Josh Port (joshua_port@uri.edu)
+# Requirements: python3, numpy, pandas
+#
+# Storm track inputs for blending parametric wind with background wind in scale_and_subset.py: the storm center from an ATCF
+# fort.22 and the radius of maximum wind from the parametric model's TrackRMW.txt
+# Both files are parsed a column at a time, and the track is interpolated to every wind time slice up front
+#
+import numpy
+import pandas
+
+
+def read_fort22(filename='fort.22'):
+    # Times (datetime64), longitudes, and latitudes of the storm center in an ATCF fort.22, in time order
+    # Positions are in tenths of a degree with an N/S or E/W suffix; the lines repeated for each wind radius are only read once
+    fort22 = pandas.read_csv(filename, header=None, usecols=[2, 6, 7], dtype=str, skipinitialspace=True)
+    times = pandas.to_datetime(fort22[2].str.strip(), format='%Y%m%d%H')
+    lat_ctr = hemisphere_coordinate(fort22[6], 'N', 'S', filename)
+    lon_ctr = hemisphere_coordinate(fort22[7], 'E', 'W', filename)
+    track = pandas.DataFrame({"time": times, "lon": lon_ctr, "lat": lat_ctr}).sort_values("time", kind="stable")
+    track = track.drop_duplicates("time")
+    return track["time"].to_numpy(), track["lon"].to_numpy(), track["lat"].to_numpy()
+
+
+def hemisphere_coordinate(column, positive, negative, filename):
+    # ATCF latitude or longitude strings (e.g. 411N, 718W) to signed degrees
+    column = column.str.strip().str.upper()
+    suffix = column.str[-1]
+    if not suffix.isin([positive, negative]).all():
+        raise RuntimeError("Unrecognized " + positive + "/" + negative + " coordinate in " + filename + ": " + str(column[~suffix.isin([positive, negative])].iloc[0]))
+    value = column.str[:-1].astype(float).to_numpy() / 10
+    return numpy.where(suffix.to_numpy() == negative, -value, value)
+
+
+def read_track_rmw(filename='TrackRMW.txt'):
+    # Times (datetime64) and radii of maximum wind (m) in TrackRMW.txt, in time order
+    # Columns are year, month, day, hour, minute, second, lon, lat, and RMW in km, after one header line
+    track_rmw = pandas.read_csv(filename, header=0, sep=r"\s+")
+    date_parts = track_rmw.iloc[:, 0:6].astype(int)
+    date_parts.columns = ["year", "month", "day", "hour", "minute", "second"]
+    track = pandas.DataFrame({"time": pandas.to_datetime(date_parts), "rmw": track_rmw.iloc[:, 8].astype(float) * 1000})  # Convert from km to m
+    track = track.sort_values("time", kind="stable").drop_duplicates("time")
+    return track["time"].to_numpy(), track["rmw"].to_numpy()
+
+
+def interpolate(times, values, at, name):
+    # Linear interpolation of values at times to the times in at (numpy.interp, as scipy.interpolate.interp1d uses for 1-D data)
+    # Raises RuntimeError if any time in at is outside the track
+    seconds = (times - times[0]) / numpy.timedelta64(1, 's')
+    at_seconds = (at - times[0]) / numpy.timedelta64(1, 's')
+    outside = (at_seconds < seconds[0]) | (at_seconds > seconds[-1])
+    if outside.any():
+        raise RuntimeError("Wind time " + str(at[outside][0]) + " is outside the " + name + " (" + str(times[0]) + " to " + str(times[-1]) + ")")
+    return numpy.interp(at_seconds, seconds, values)
+
+
+class StormTrack:
+    # Storm center and RMW at each of a fixed list of dates (the wind time slices), interpolated from the track when built
+    def __init__(self, dates, ctr_times, lon_ctr, lat_ctr, rmw_times, rmw):
+        at = numpy.array(dates, dtype='datetime64[us]')
+        ctr_times = numpy.asarray(ctr_times, dtype='datetime64[us]')
+        rmw_times = numpy.asarray(rmw_times, dtype='datetime64[us]')
+        self.__index = {date: i for i, date in enumerate(dates)}
+        self.__lon_ctr = interpolate(ctr_times, numpy.asarray(lon_ctr, dtype=float), at, "storm track")
+        self.__lat_ctr = interpolate(ctr_times, numpy.asarray(lat_ctr, dtype=float), at, "storm track")
+        self.__rmw = interpolate(rmw_times, numpy.asarray(rmw, dtype=float), at, "RMW track")
+
+    @staticmethod
+    def read(dates, fort22_filename='fort.22', track_rmw_filename='TrackRMW.txt'):
+        ctr_times, lon_ctr, lat_ctr = read_fort22(fort22_filename)
+        rmw_times, rmw = read_track_rmw(track_rmw_filename)
+        return StormTrack(dates, ctr_times, lon_ctr, lat_ctr, rmw_times, rmw)
+
+    def lon_ctr(self):
+        return self.__lon_ctr
+
+    def lat_ctr(self):
+        return self.__lat_ctr
+
+    def rmw(self):
+        return self.__rmw
+
+    def at(self, date):
+        # (lon, lat, rmw in m) at one of the dates the track was built for
+        i = self.__index.get(date)
+        if i is None:
+            raise RuntimeError("No storm track position for " + str(date))
+        return float(self.__lon_ctr[i]), float(self.__lat_ctr[i]), float(self.__rmw[i])
@@ -3,76 +3,74 @@
 # Requirements: python3, numpy
 #
 # This is a Python port of Xuanyu Chen's retrieve_ust_U10.m and cal_z0_from_ustar.m Matlab functions
-# This version also supports vector inputs for performance reasons
+# This version also supports vector inputs for performance reasons; both functions work on whole arrays at once
 #
+import functools
+
+
 def retrieve_ust_U10(u_obs, z_obs):
-    from numpy import arange, argmin, empty, exp #, log
-   
-    k = 0.40    
-    y = exp(k * u_obs)
-    res = 0.001
-    ust = arange(0, 5, res)
-    z0 = cal_z0_from_ustar(ust)
-    Y = empty(len(ust))
-    for i in range(len(ust)):
-        if z0[i] == 0 and ust[i] == 0:
-            Y[0] = 1 # python throws a divide by zero error otherwise; Matlab doesn't, since the exponent is 0
-        else:
-            Y[i] = (z_obs / z0[i])**ust[i]
-            
-    # find Y closest to y and then retrieve corresponding ust_est
-    ust_est = empty((len(u_obs), len(u_obs[0])))
-    for i in range(len(u_obs)):
-        for j in range(len(u_obs[0])):
-            dif = abs(y[i,j] - Y)        
-            loc = argmin(dif)
-            if Y[loc] - y[i,j] > 0:
-                slp = (Y[loc] - Y[loc-1]) / res
-                dust = (y[i,j] - Y[loc-1]) / slp
-                ust_est[i,j] = ust[loc-1] + dust
-            else:
-                slp = (Y[loc+1] - Y[loc]) / res
-                dust = (y[i,j] - Y[loc]) / slp
-                ust_est[i,j] = ust[loc] + dust
-    
+    from numpy import asarray, clip, exp, searchsorted
+
+    k = 0.40
+    y = exp(k * asarray(u_obs, dtype=float))
+    res, ust, Y = ust_lookup_table(z_obs)
+
+    # find the segment of Y containing y and interpolate linearly within it to retrieve the corresponding ust_est; this matches
+    # interpolating from the Y closest to y, since Y increases with ust, and extrapolates from the end segments beyond the table
+    loc = clip(searchsorted(Y, y, side='right') - 1, 0, len(Y) - 2)
+    slp = (Y[loc + 1] - Y[loc]) / res
+    dust = (y - Y[loc]) / slp
+    ust_est = ust[loc] + dust
+
     # # use ust_y to calculate U10; not relevant for RICHAMP, so commenting out
     # z0_ust_est = cal_z0_from_ustar(ust_est)
     # U10 = ust_est / k * log(10.0 / z0_ust_est)
-    
+
     return ust_est #, U10
 
+@functools.lru_cache(maxsize=None)
+def ust_lookup_table(z_obs):
+    # Y = (z_obs / z0)**ust on a fine ustar grid, computed once per z_obs and shared by every call to retrieve_ust_U10
+    from numpy import arange, diff, ones
+
+    res = 0.001
+    ust = arange(0, 5, res)
+    z0 = cal_z0_from_ustar(ust)
+    Y = ones(len(ust))  # Y is 1 where z0 and ust are both 0; python throws a divide by zero error otherwise, Matlab doesn't since the exponent is 0
+    nonzero = (z0 != 0) | (ust != 0)
+    Y[nonzero] = (z_obs / z0[nonzero])**ust[nonzero]
+    if not (diff(Y) > 0).all():
+        raise RuntimeError("The ustar lookup table is not monotonic for z_obs = " + str(z_obs) + ", so it can't be inverted")
+    ust.flags.writeable = False
+    Y.flags.writeable = False
+    return res, ust, Y
+
 def cal_z0_from_ustar(ust):
-    # Function to calculate z0 based on 4 regimes of ustar (based on Old GFDL)   
-    from numpy import array, empty, matmul
-    
-    z0 = empty(len(ust))
-    ust_array = array([[ust**8],[ust**7],[ust**6],[ust**5],[ust**4],[ust**3],[ust**2],[ust**1],[ust**0]]).squeeze()
-    
+    # Function to calculate z0 based on 4 regimes of ustar (based on Old GFDL)
+    from numpy import array, asarray, full, polyval
+
+    ust = asarray(ust, dtype=float)
+
     # polynomial:
     p_b1 = array([-0.000098701949811,  0.001486209983407,
                   -0.007584567778927,  0.019487056157620,
                   -0.029314498154105,  0.024309735869547,
                   -0.006997554677642,  0.001258400989803,
-                  -0.000043976208055]).reshape(1,9)
+                  -0.000043976208055])
     p_b2 = array([-0.002182648458354,  0.046387047659009,
                   -0.428830523588356,  2.251251262348664,
                   -7.334368361013868, 15.163848944684784,
                   -19.388290305787166,13.970227275905133,
-                  -4.319572176336596]).reshape(1,9)
+                  -4.319572176336596])
     g = 9.806650;
-    
-    for i in range(len(ust)):
-        ustar = ust[i]
-        if ustar < 0.3:
-            z0[i] = 0.0185 / g * ustar**2
-        elif ustar < 2.35:
-            p = p_b1
-            z0[i] = float(matmul(p,ust_array[:,i]))
-        elif ustar < 3:
-            p = p_b2
-            z0[i] = float(matmul(p,ust_array[:,i]))
-        else:
-            z0[i] = 0.001305
+
+    z0 = full(ust.shape, 0.001305)  # ustar >= 3 (and NaN)
+    regime_0 = ust < 0.3
+    regime_1 = (ust >= 0.3) & (ust < 2.35)
+    regime_2 = (ust >= 2.35) & (ust < 3)
+    z0[regime_0] = 0.0185 / g * ust[regime_0]**2
+    z0[regime_1] = polyval(p_b1, ust[regime_1])
+    z0[regime_2] = polyval(p_b2, ust[regime_2])
 
     return z0
 
@@ -85,8 +83,3 @@ def cal_z0_from_ustar(ust):
     
 # if __name__ == '__main__':
 #     main()
-
-
-
-
-